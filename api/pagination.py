@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class PostCursorPagination(CursorPagination):
+    ordering = ("-pub_date", "-id")
+
+
+class CommentCursorPagination(CursorPagination):
+    ordering = ("-created", "-id")
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = "-id"
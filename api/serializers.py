@@ -0,0 +1,62 @@
+from rest_framework import serializers
+
+from posts.models import Comment, Follow, Group, Post, PostRate
+
+
+class FieldsMixin:
+    """Оставляет в ответе только поля из параметра ?fields=id,text."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or not request.query_params.get("fields"):
+            return
+        wanted = set(request.query_params["fields"].split(","))
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class GroupSerializer(FieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Group
+        fields = ("id", "title", "slug", "description")
+
+
+class PostSerializer(FieldsMixin, serializers.ModelSerializer):
+    author = serializers.SlugRelatedField(slug_field="username",
+                                          read_only=True)
+    group = serializers.SlugRelatedField(slug_field="slug", read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
+    rate_avg = serializers.IntegerField(source="post_rate_avg",
+                                        read_only=True)
+
+    class Meta:
+        model = Post
+        fields = ("id", "text", "pub_date", "author", "group", "image",
+                  "comments_count", "rate_avg", "rate_count")
+
+
+class CommentSerializer(FieldsMixin, serializers.ModelSerializer):
+    author = serializers.SlugRelatedField(slug_field="username",
+                                          read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ("id", "post", "author", "text", "created")
+
+
+class FollowSerializer(FieldsMixin, serializers.ModelSerializer):
+    user = serializers.SlugRelatedField(slug_field="username",
+                                        read_only=True)
+    author = serializers.SlugRelatedField(slug_field="username",
+                                          read_only=True)
+
+    class Meta:
+        model = Follow
+        fields = ("id", "user", "author")
+
+
+class PostRateSerializer(FieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = PostRate
+        fields = ("id", "post", "rate")
@@ -0,0 +1,78 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from posts.models import Comment, Follow, Group, Post
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create_user(
+            username="ApiAuthor", password="api-password-123"
+        )
+        cls.reader = get_user_model().objects.create_user(
+            username="ApiReader", password="api-password-123"
+        )
+        cls.group = Group.objects.create(title="API", slug="api-group")
+        for number in range(15):
+            post = Post.objects.create(text=f"Запись {number}",
+                                       author=cls.author,
+                                       group=cls.group if number % 2 else None)
+            Comment.objects.create(post=post, author=cls.reader,
+                                   text="Комментарий")
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_posts_are_paginated_by_cursor(self):
+        """Лента постов отдается страницами по курсору"""
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/posts/")
+
+        first = response.json()
+        self.assertEqual(len(first["results"]), 10)
+        self.assertEqual(first["results"][0]["text"], "Запись 14")
+        self.assertEqual(first["results"][0]["comments_count"], 1)
+        self.assertEqual(first["results"][0]["author"], "ApiAuthor")
+
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(len(second["results"]), 5)
+        self.assertIsNone(second["next"])
+
+    def test_field_selection_and_filters(self):
+        """Параметры fields и group сужают ответ"""
+        response = self.client.get("/api/v1/posts/",
+                                   {"fields": "id,text", "group": "api-group"})
+
+        results = response.json()["results"]
+        self.assertEqual(len(results), 7)
+        self.assertEqual(set(results[0]), {"id", "text"})
+
+    def test_post_comments(self):
+        post = Post.objects.get(text="Запись 3")
+
+        response = self.client.get(f"/api/v1/posts/{post.pk}/comments/")
+
+        self.assertEqual([comment["author"]
+                          for comment in response.json()["results"]],
+                         ["ApiReader"])
+
+    def test_follows_require_jwt(self):
+        """Подписки доступны только с JWT-токеном"""
+        self.assertEqual(self.client.get("/api/v1/follows/").status_code,
+                         401)
+
+        token = self.client.post("/api/v1/token/", {
+            "username": "ApiReader", "password": "api-password-123"
+        }).json()["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+        response = self.client.get("/api/v1/follows/")
+
+        self.assertEqual(response.json()["results"],
+                         [{"id": Follow.objects.get().pk,
+                           "user": "ApiReader",
+                           "author": "ApiAuthor"}])
@@ -0,0 +1,65 @@
+from django.shortcuts import get_object_or_404
+from django_filters import rest_framework as filters
+from rest_framework import permissions, viewsets
+
+from posts.models import Comment, Follow, Group, Post, PostRate
+
+from .pagination import (CommentCursorPagination, IdCursorPagination,
+                         PostCursorPagination)
+from .serializers import (CommentSerializer, FollowSerializer,
+                          GroupSerializer, PostRateSerializer,
+                          PostSerializer)
+
+
+class PostFilter(filters.FilterSet):
+    group = filters.CharFilter(field_name="group__slug")
+    author = filters.CharFilter(field_name="author__username")
+
+    class Meta:
+        model = Post
+        fields = ("group", "author")
+
+
+class PostViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Post.objects.feed()
+    serializer_class = PostSerializer
+    pagination_class = PostCursorPagination
+    filterset_class = PostFilter
+
+
+class GroupViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Group.objects.all()
+    serializer_class = GroupSerializer
+    pagination_class = IdCursorPagination
+
+
+class CommentViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = CommentSerializer
+    pagination_class = CommentCursorPagination
+
+    def get_queryset(self):
+        post = get_object_or_404(Post.objects.only("id"),
+                                 id=self.kwargs["post_id"])
+        return Comment.objects.filter(post=post).select_related("author")
+
+
+class FollowViewSet(viewsets.ReadOnlyModelViewSet):
+    """Подписки текущего пользователя."""
+    serializer_class = FollowSerializer
+    pagination_class = IdCursorPagination
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Follow.objects.filter(user=self.request.user).select_related(
+            "user", "author"
+        )
+
+
+class PostRateViewSet(viewsets.ReadOnlyModelViewSet):
+    """Оценки, которые поставил текущий пользователь."""
+    serializer_class = PostRateSerializer
+    pagination_class = IdCursorPagination
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return PostRate.objects.filter(user=self.request.user)
@@ -0,0 +1,36 @@
+import pytest
+from django.core.cache import caches
+from django.test import override_settings
+
+from posts.thumbnails import wait_for_thumbnails
+
+# Свой кеш в памяти процесса тестов: cache.clear() в тестах не должен
+# очищать кеш запущенного сайта. Версии лежат в отдельном хранилище,
+# как и на сайте, чтобы тесты замечали, когда сбрасывается не тот кеш
+TEST_CACHES = {
+    alias: {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": f"yatube-tests-{alias}",
+        "TIMEOUT": None if alias == "versions" else 300,
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    }
+    for alias in ("default", "versions")
+}
+
+
+@pytest.fixture(autouse=True, scope="session")
+def isolated_caches():
+    with override_settings(CACHES=TEST_CACHES):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def fresh_versions():
+    # Версии прошлого теста ссылались бы на его данные
+    caches["versions"].clear()
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtest_teardown(item):
+    # Фоновый поток миниатюр не должен писать в базу, пока ее очищают
+    wait_for_thumbnails()
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Post, Group, Comment, Follow, PostRate
+from .search import matching_post_ids
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +9,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        # Ищем по полнотекстовому индексу, а не через LIKE по text
+        if not search_term:
+            return queryset, False
+        return queryset.filter(id__in=matching_post_ids(search_term)), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ("pk", "title", "slug", "description")
@@ -1,5 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class PostsConfig(AppConfig):
     name = "posts"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import create_fts_table
+        from .sqlite import configure_connection
+
+        post_migrate.connect(create_fts_table, sender=self)
+        connection_created.connect(configure_connection)
+
+        if settings.POSTS_WRITE_QUEUE:
+            from .writequeue import install_signal_handler
+
+            install_signal_handler()
@@ -0,0 +1,240 @@
+"""Асинхронные версии читающих представлений posts для ASGI.
+
+Под WSGI воркер занят запросом все время, пока идут запросы к базе и
+рендеринг шаблона. Здесь независимые запросы страницы выполняются
+одновременно: число постов ленты и сама страница, счетчики автора в
+профиле и его посты, автор, пост и комментарии на странице поста.
+Каждый запрос к базе идет в своем потоке со своим соединением
+(sync_to_async с thread_sensitive=False), а цикл событий тем временем
+обслуживает другие запросы. Шаблоны рендерятся тоже в потоке: в них
+бывают ленивые обращения к базе.
+
+ETag, Last-Modified и ответ 304 считаются так же, как в @condition.
+Страницы для анонимов берутся из кеша страниц (posts.pagecache) в
+потоке, и промах рендерит синхронное представление: такая страница
+рендерится один раз на версию ленты, а блокировка пересчета не должна
+занимать цикл.
+
+posts.urls подключает этот модуль при POSTS_ASYNC_VIEWS, иначе
+работают posts.views. Точка входа ASGI — yatube/asgi.py.
+"""
+import asyncio
+import functools
+import inspect
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import Page, Paginator
+from django.db import close_old_connections
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import freshness, views
+from .cache import attach_card_versions, feed_count
+from .comments import comment_page
+from .forms import CommentForm
+from .models import Group, Post
+from .pagecache import cache_anonymous_page, page_cache_applies
+from .stats import get_stats, profile_summaries
+from .thumbnails import prefetch_thumbnails
+from .timeline import timeline_posts
+from .writequeue import apply_pending_rates, pending_comments
+
+
+async def run(func, *args, **kwargs):
+    """Выполнить синхронный код с запросами к базе в отдельном потоке."""
+    return await sync_to_async(_closing, thread_sensitive=False)(
+        func, *args, **kwargs
+    )
+
+
+def _closing(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Потоки пула живут дольше запроса: соединение закрывается, как
+        # в конце синхронного запроса, с учетом CONN_MAX_AGE
+        close_old_connections()
+
+
+def conditional(etag_func, last_modified_func, sync_view):
+    """@condition и @cache_anonymous_page для корутин.
+
+    sync_view — синхронное представление с той же сигнатурой, им
+    рендерятся промахи кеша страниц.
+    """
+    cached_view = cache_anonymous_page(etag_func, last_modified_func)(
+        inspect.unwrap(sync_view)
+    )
+
+    def validators(request, *args, **kwargs):
+        etag = etag_func(request, *args, **kwargs)
+        last_modified = last_modified_func(request, *args, **kwargs)
+        return (quote_etag(etag) if etag is not None else None,
+                last_modified and int(last_modified.timestamp()))
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag, last_modified = await run(validators, request,
+                                            *args, **kwargs)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                # request.user ленивый и читает сессию из базы
+                if etag is not None and await run(page_cache_applies,
+                                                  request):
+                    response = await run(cached_view, request,
+                                         *args, **kwargs)
+                else:
+                    response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header(
+                        "Last-Modified"):
+                    response["Last-Modified"] = http_date(last_modified)
+                if etag is not None:
+                    response.setdefault("ETag", etag)
+            return response
+        return wrapper
+    return decorator
+
+
+async def paginate(request, posts, per_page=10, scope=None):
+    """Страница ленты, как в views.paginate, но число постов и посты
+    страницы выбираются одновременно."""
+    number = request.GET.get("page") or "1"
+    if (settings.POSTS_CURSOR_PAGINATION or "cursor" in request.GET
+            or not number.isdigit() or int(number) < 1):
+        return await run(views.paginate, request, posts, per_page, scope)
+
+    number = int(number)
+    paginator = Paginator(posts, per_page)
+    count = (posts.count if scope is None
+             else functools.partial(feed_count, scope, posts))
+    bottom = (number - 1) * per_page
+    paginator.count, object_list = await asyncio.gather(
+        run(count), run(_slice, posts, bottom, bottom + per_page),
+    )
+    if number <= paginator.num_pages:
+        page = Page(object_list, number, paginator)
+    else:
+        # За концом ленты get_page отдает последнюю страницу
+        page = await run(paginator.get_page, number)
+
+    await run(_prepare_cards, request.user, page)
+    return page, paginator
+
+
+def _slice(posts, bottom, top):
+    # Срез ленты подписок выполняет запросы сразу, а не при list()
+    return list(posts[bottom:top])
+
+
+def _prepare_cards(user, page):
+    attach_card_versions(page)
+    apply_pending_rates(user, page)
+    prefetch_thumbnails(page)
+
+
+@conditional(freshness.index_etag, freshness.index_last_modified,
+             views.index)
+async def index(request):
+    latest = Post.objects.feed()
+    page, paginator = await paginate(request, latest, scope="index")
+
+    return await run(render, request, "posts/index.html",
+                     {"page": page, "paginator": paginator,
+                      "latest": latest})
+
+
+@conditional(freshness.group_etag, freshness.group_last_modified,
+             views.group_posts)
+async def group_posts(request, slug):
+    group = await run(Group.objects.filter(slug=slug).first)
+    if group is None:
+        return await run(render, request, "posts/group.html")
+
+    posts = group.posts.feed()
+    page, paginator = await paginate(request, posts,
+                                     scope=f"group:{group.pk}")
+
+    return await run(render, request, "posts/group.html",
+                     {"group": group, "page": page,
+                      "paginator": paginator, "posts": posts})
+
+
+@conditional(freshness.profile_etag, freshness.profile_last_modified,
+             views.profile)
+async def profile(request, username):
+    user = request.user
+    author = await run(get_object_or_404, profile_summaries(user),
+                       username=username)
+    stats, (page, paginator) = await asyncio.gather(
+        run(get_stats, author),
+        paginate(request, author.posts.feed(), scope=f"author:{author.pk}"),
+    )
+
+    return await run(render, request, "posts/profile.html", {
+        "author": author,
+        "user": user,
+        "stats": stats,
+        "page": page,
+        "paginator": paginator,
+        "db_name": author if author.is_following else None,
+        "following": stats.followers_count,
+    })
+
+
+@conditional(freshness.post_etag, freshness.post_last_modified,
+             views.post_view)
+async def post_view(request, username, post_id):
+    author, post, (comments, comments_page) = await asyncio.gather(
+        run(get_object_or_404, profile_summaries(request.user),
+            username=username),
+        run(get_object_or_404, Post.objects.feed(), id=post_id,
+            author__username=username),
+        run(_comment_page, post_id, request.GET.get("comments")),
+    )
+    stats, _, pending = await asyncio.gather(
+        run(get_stats, author),
+        run(_prepare_post, request.user, post),
+        run(pending_comments, request.user, post_id),
+    )
+
+    return await run(render, request, "posts/post.html", {
+        "form": CommentForm(request.POST or None),
+        "author": author,
+        "stats": stats,
+        "user": request.user,
+        "post": post,
+        "comments": comments,
+        "comments_page": comments_page,
+        "pending_comments": pending,
+        "post_id": post_id,
+    })
+
+
+def _prepare_post(user, post):
+    attach_card_versions([post])
+    apply_pending_rates(user, [post])
+
+
+def _comment_page(post_id, cursor):
+    comments, page = comment_page(post_id, cursor)
+    # Выборка вычисляется здесь, в потоке, а не при рендеринге
+    return list(comments), page
+
+
+async def follow_index(request):
+    # request.user ленивый и читает сессию из базы — только в потоке
+    if not await run(getattr, request.user, "is_authenticated"):
+        return redirect_to_login(request.get_full_path())
+
+    posts = await run(timeline_posts, request.user)
+    page, paginator = await paginate(request, posts)
+
+    return await run(render, request, "posts/follow.html",
+                     {"page": page, "paginator": paginator})
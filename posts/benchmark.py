@@ -0,0 +1,452 @@
+"""Нагрузочный стенд для представлений posts.
+
+generate_data наполняет базу синтетическими пользователями, группами,
+постами, комментариями, подписками и оценками. Данные детерминированы
+по seed и пишутся потоковой загрузкой posts.transfer. run_benchmark
+прогоняет сценарии (ленты, профиль, пост, подписки, поиск, комментарий
+и оценка) тестовым клиентом. Для каждого сценария он считает p50/p95
+времени ответа, число SQL-запросов и пик выделенной памяти на запрос.
+Результат сохраняется в JSON вместе с коммитом, и compare сравнивает
+его с прошлым прогоном.
+
+run_concurrency_benchmark сравнивает синхронные представления с
+асинхронными (posts.async_views) на искусственно медленной базе.
+
+run_sqlite_benchmark сравнивает профили PRAGMA SQLite (posts.sqlite)
+под одновременными чтением и записью из нескольких процессов.
+"""
+import asyncio
+import collections
+import contextlib
+import datetime
+import math
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Max
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from . import async_views, benchmark_worker, views
+from .models import Comment, Follow, Group, Post, User
+from .transfer import IdMap, finish_import, load_records
+
+WORDS = (
+    "кот", "собака", "город", "река", "утро", "вечер", "книга", "чай",
+    "дорога", "лес", "море", "работа", "праздник", "музыка", "поезд",
+    "снег", "солнце", "друг", "фильм", "сад", "окно", "ветер", "дом",
+    "парк", "кофе", "отпуск", "горы", "дождь", "звезды", "велосипед",
+)
+
+Scenario = collections.namedtuple("Scenario",
+                                  "name method path data login")
+
+# PRAGMA SQLite и Django по умолчанию — точка отсчета для профилей
+DEFAULT_SQLITE_PRAGMAS = {
+    "journal_mode": "delete",
+    "synchronous": "full",
+    "mmap_size": 0,
+    "cache_size": -2000,
+    "busy_timeout": 5000,
+}
+
+
+def generate_data(users=100, groups=10, posts=2000, comments=5000,
+                  follows=1000, rates=3000, seed=0):
+    """Добавить в базу синтетические данные; возвращает число записей
+    по таблицам."""
+    rng = random.Random(seed)
+    usernames = [f"bench{number}" for number in range(users)]
+    slugs = [f"bench-{number}" for number in range(groups)]
+    first_post = (Post.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+    first_comment = (
+        Comment.objects.aggregate(last=Max("pk"))["last"] or 0
+    ) + 1
+    post_ids = range(first_post, first_post + posts)
+    now = timezone.now()
+
+    def text(length):
+        return " ".join(rng.choice(WORDS) for _ in range(length))
+
+    def date(minutes_ago):
+        return (now - datetime.timedelta(minutes=minutes_ago)).isoformat()
+
+    datasets = {
+        "groups": ({"slug": slug, "title": slug, "description": text(8)}
+                   for slug in slugs),
+        "posts": ({"id": post_id,
+                   "author": rng.choice(usernames),
+                   "group": rng.choice(slugs + [None]) if slugs else None,
+                   "pub_date": date(posts - number),
+                   "text": text(rng.randint(5, 60)),
+                   "image": None}
+                  for number, post_id in enumerate(post_ids)),
+        "comments": ({"id": first_comment + number,
+                      "post": rng.choice(post_ids),
+                      "author": rng.choice(usernames),
+                      "created": date(rng.randint(0, posts)),
+                      "text": text(rng.randint(3, 20))}
+                     for number in range(comments if posts else 0)),
+        "follows": ({"user": rng.choice(usernames),
+                     "author": rng.choice(usernames)}
+                    for _ in range(follows)),
+        "rates": ({"post": rng.choice(post_ids),
+                   "user": rng.choice(usernames),
+                   "rate": rng.randint(1, 5)}
+                  for _ in range(rates if posts else 0)),
+    }
+    with IdMap() as ids:
+        counts = {name: load_records(name, records, ids=ids)
+                  for name, records in datasets.items()}
+    finish_import()
+    return counts
+
+
+def default_scenarios():
+    """Сценарии на текущих данных: самый новый пост, его автор и группа,
+    читатель с наибольшим числом подписок."""
+    post = Post.objects.select_related("author").order_by("-pk").first()
+    if post is None:
+        raise ValueError("В базе нет постов, сначала наполните ее")
+    group = Group.objects.order_by("pk").first()
+    reader = (User.objects.filter(pk__in=Follow.objects.values("user"))
+              .order_by("-stats__following_count", "pk").first()
+              or post.author)
+    post_kwargs = {"username": post.author.username, "post_id": post.pk}
+    pages = max(Post.objects.count() // 10, 1)
+
+    scenarios = [
+        Scenario("index", "get", reverse("posts:index"), None, None),
+        Scenario("index_last_page", "get",
+                 reverse("posts:index") + f"?page={pages}", None, None),
+        Scenario("profile", "get",
+                 reverse("posts:profile", args=[post.author.username]),
+                 None, None),
+        Scenario("post", "get", reverse("posts:post", kwargs=post_kwargs),
+                 None, None),
+        Scenario("search", "get", reverse("posts:search") + "?q=кот",
+                 None, None),
+        Scenario("follow", "get", reverse("posts:follow_index"),
+                 None, reader),
+        Scenario("comment", "post",
+                 reverse("posts:add_comment", kwargs=post_kwargs),
+                 {"text": "Комментарий стенда"}, reader),
+        Scenario("rate", "get",
+                 reverse("posts:post_rate", kwargs={**post_kwargs,
+                                                    "rate": 3}),
+                 None, reader),
+    ]
+    if group is not None:
+        scenarios.insert(2, Scenario(
+            "group", "get", reverse("posts:group", args=[group.slug]),
+            None, None,
+        ))
+    return scenarios
+
+
+def run_benchmark(scenarios=None, requests=50, warmup=5, cold=False,
+                  page_cache=False):
+    """Прогнать сценарии; возвращает словарь метрик по сценариям.
+
+    С cold=True кеш очищается перед каждым запросом, иначе меряется
+    установившийся режим с прогретым кешем карточек и версий. Кеш
+    страниц анонимов по умолчанию выключен, чтобы мерить само
+    представление; page_cache=True включает его.
+    """
+    if scenarios is None:
+        scenarios = default_scenarios()
+    results = {}
+    # DEBUG включает журнал запросов и панель отладки — мерим без них
+    timeout = settings.POSTS_PAGE_CACHE_TIMEOUT if page_cache else 0
+    with override_settings(DEBUG=False, POSTS_PAGE_CACHE_TIMEOUT=timeout):
+        for scenario in scenarios:
+            results[scenario.name] = _measure(scenario, requests,
+                                              warmup, cold)
+    return results
+
+
+def _measure(scenario, requests, warmup, cold):
+    client = Client()
+    if scenario.login is not None:
+        client.force_login(scenario.login)
+
+    def call():
+        if cold:
+            cache.clear()
+        return getattr(client, scenario.method)(scenario.path,
+                                                scenario.data)
+
+    for _ in range(warmup):
+        call()
+
+    # Журнал запросов ограничен по длине: после наполнения базы и
+    # прогрева его нужно очистить, иначе новые запросы не посчитаются
+    connection.queries_log.clear()
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        response = call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Список запросов берется из журнала лениво, запоминаем сразу
+    query_count = len(queries)
+
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "status": response.status_code,
+        "queries": query_count,
+        "peak_kb": round(peak / 1024, 1),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+    }
+
+
+def run_concurrency_benchmark(scenarios=None, requests=20, delay=0.005):
+    """Сравнить синхронные и асинхронные представления на медленной базе.
+
+    Каждый запрос к базе задерживается на delay секунд, как у базы на
+    другом хосте под нагрузкой. В синхронном режиме requests запросов
+    сценария по очереди обслуживает один воркер WSGI, в асинхронном их
+    одновременно обслуживает один цикл событий. Возвращает по
+    сценариям общее время, p50 ответа в обоих режимах и ускорение.
+    Кеш страниц выключен: мерится само представление.
+    """
+    if scenarios is None:
+        scenarios = default_scenarios()
+    factory = RequestFactory()
+    results = {}
+    with override_settings(DEBUG=False, POSTS_PAGE_CACHE_TIMEOUT=0):
+        for scenario in scenarios:
+            match = resolve(urlsplit(scenario.path).path)
+            name = match.func.__name__
+            async_view = getattr(async_views, name, None)
+            if scenario.method != "get" or async_view is None:
+                continue
+            sync_view = getattr(views, name)
+
+            def make_request(scenario=scenario):
+                request = factory.get(scenario.path)
+                request.user = scenario.login or AnonymousUser()
+                return request
+
+            # Прогрев кеша версий и карточек без задержки
+            sync_view(make_request(), **match.kwargs)
+            with slow_database(delay):
+                sync = _serve_sync(sync_view, make_request, match.kwargs,
+                                   requests)
+                concurrent = _serve_async(async_view, make_request,
+                                          match.kwargs, requests)
+            results[scenario.name] = {
+                "status": max(sync["status"], concurrent["status"]),
+                "sync_total_ms": sync["total_ms"],
+                "async_total_ms": concurrent["total_ms"],
+                "sync_p50_ms": sync["p50_ms"],
+                "async_p50_ms": concurrent["p50_ms"],
+                "speedup": round(
+                    sync["total_ms"] / max(concurrent["total_ms"], 0.001), 2
+                ),
+            }
+    return results
+
+
+@contextlib.contextmanager
+def slow_database(delay):
+    """Задерживать каждый запрос к базе на delay секунд.
+
+    Обертка ставится на соединения, открытые внутри блока, — в том
+    числе в потоках пулов, которые создает стенд.
+    """
+    def slow_execute(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        if slow_execute not in connection.execute_wrappers:
+            connection.execute_wrappers.append(slow_execute)
+
+    connection_created.connect(install)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+
+
+def _serve_sync(view, make_request, kwargs, requests):
+    def call(_):
+        started = time.perf_counter()
+        response = view(make_request(), **kwargs)
+        return response.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Свежий поток — свое соединение, на которое встанет задержка
+    with ThreadPoolExecutor(max_workers=1) as worker:
+        answers = list(worker.map(call, range(requests)))
+        worker.submit(connections.close_all).result()
+    return _summary(answers, time.perf_counter() - started)
+
+
+def _serve_async(view, make_request, kwargs, requests):
+    async def call():
+        started = time.perf_counter()
+        response = await view(make_request(), **kwargs)
+        return response.status_code, time.perf_counter() - started
+
+    async def serve():
+        return await asyncio.gather(*(call() for _ in range(requests)))
+
+    started = time.perf_counter()
+    # asyncio.run создает свой пул потоков и закрывает его в конце
+    answers = asyncio.run(serve())
+    return _summary(answers, time.perf_counter() - started)
+
+
+def _summary(answers, total):
+    statuses, timings = zip(*answers)
+    return {
+        "status": max(statuses),
+        "total_ms": round(total * 1000, 3),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+    }
+
+
+def run_sqlite_benchmark(readers=4, writers=2, operations=100,
+                         profiles=None):
+    """Сравнить профили PRAGMA SQLite под одновременными чтением и
+    записью.
+
+    Для каждого профиля текущая база SQLite копируется в файл, и
+    readers процессов читают ленту, пока writers процессов ставят
+    оценки и пишут комментарии, каждый по operations операций. Как у
+    воркеров gunicorn, у каждого процесса свое соединение. Возвращает
+    по профилям пропускную способность и p95 чтений и записей и число
+    отказов «database is locked». По умолчанию сравниваются настройки
+    SQLite без изменений и POSTS_SQLITE_PRAGMAS.
+    """
+    if profiles is None:
+        profiles = {"default": DEFAULT_SQLITE_PRAGMAS,
+                    "tuned": settings.POSTS_SQLITE_PRAGMAS}
+    ids = (list(Post.objects.values_list("pk", flat=True)),
+           list(User.objects.values_list("pk", flat=True)))
+    results = {}
+    # Копия лежит рядом с проектом, а не в /tmp: там может быть tmpfs,
+    # где fsync ничего не стоит и synchronous не на что влиять
+    with tempfile.TemporaryDirectory(dir=settings.BASE_DIR) as directory:
+        for name, pragmas in profiles.items():
+            path = os.path.join(directory, f"{name}.sqlite3")
+            _copy_database(path)
+            overrides = {"POSTS_SQLITE_PRAGMAS": pragmas,
+                         "POSTS_WRITE_QUEUE": False,
+                         "CACHES": settings.CACHES}
+            results[name] = _serve_processes(
+                path, overrides, ids, readers, writers, operations
+            )
+    return results
+
+
+def _copy_database(path):
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.connection.backup(target)
+    finally:
+        target.close()
+
+
+def _serve_processes(path, overrides, ids, readers, writers, operations):
+    # spawn, а не fork: процесс не наследует соединения и потоки
+    # родителя и поднимает Django заново, как воркер сервера
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(readers + writers + 1)
+    output = context.Queue()
+    roles = ["read"] * readers + ["write"] * writers
+    processes = [
+        context.Process(target=benchmark_worker.serve, args=(
+            role, path, overrides, ids, operations, seed, ready, output,
+        ))
+        for seed, role in enumerate(roles)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        ready.wait(60)
+        answers = [output.get(timeout=600) for _ in processes]
+    finally:
+        for process in processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+
+    timings = {"read": [], "write": []}
+    # Пропускная способность роли — за время ее самого долгого процесса
+    elapsed = {"read": 0, "write": 0}
+    locked = 0
+    for role, durations, errors, seconds in answers:
+        timings[role].extend(durations)
+        elapsed[role] = max(elapsed[role], seconds)
+        locked += errors
+    metrics = {"locked": locked}
+    for role, durations in timings.items():
+        metrics[f"{role}s_per_s"] = round(
+            len(durations) / max(elapsed[role], 0.001), 1
+        )
+        metrics[f"{role}_p95_ms"] = round(
+            percentile(durations, 95) * 1000 if durations else 0, 3
+        )
+    return metrics
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold=0.2):
+    """Регрессии относительно baseline: p95 вырос больше чем на
+    threshold или запросов стало больше."""
+    regressions = []
+    for name, metrics in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if metrics["queries"] > before["queries"]:
+            regressions.append(
+                f"{name}: запросов {before['queries']} -> "
+                f"{metrics['queries']}"
+            )
+        if metrics["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(
+                f"{name}: p95 {before['p95_ms']} -> {metrics['p95_ms']} мс"
+            )
+    return regressions
@@ -0,0 +1,61 @@
+"""Процесс-воркер для run_sqlite_benchmark.
+
+Модуль импортируется в новом процессе до django.setup(), поэтому
+модели и все, что их тянет, импортируются внутри функции.
+"""
+import os
+import random
+import time
+
+
+def serve(role, path, overrides, ids, operations, seed, ready, output):
+    """Выполнить operations чтений или записей в базе path.
+
+    Отдает в output (role, длительности операций в секундах, число
+    ошибок «database is locked», общее время в секундах).
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+    import django
+
+    django.setup()
+
+    from django.db import OperationalError, connection
+    from django.test import override_settings
+
+    from posts.models import Comment, Post
+    from posts.ratings import rate_post
+
+    post_ids, user_ids = ids
+    rng = random.Random(seed)
+
+    def read():
+        offset = rng.randrange(max(len(post_ids) - 10, 1))
+        list(Post.objects.feed()[offset:offset + 10])
+        Post.objects.count()
+
+    def write():
+        post_id, user_id = rng.choice(post_ids), rng.choice(user_ids)
+        if rng.random() < 0.5:
+            rate_post(post_id, user_id, rng.randint(1, 5))
+        else:
+            Comment.objects.create(post_id=post_id, author_id=user_id,
+                                   text="Комментарий под нагрузкой")
+
+    action = read if role == "read" else write
+    connection.settings_dict["NAME"] = path
+    timings, errors = [], 0
+    with override_settings(**overrides):
+        connection.ensure_connection()
+        ready.wait(60)
+        begin = time.perf_counter()
+        for _ in range(operations):
+            started = time.perf_counter()
+            try:
+                action()
+            except OperationalError:
+                errors += 1
+                continue
+            timings.append(time.perf_counter() - started)
+        elapsed = time.perf_counter() - begin
+        connection.close()
+    output.put((role, timings, errors, elapsed))
@@ -0,0 +1,191 @@
+"""Версии кеша постов и лент.
+
+Фрагмент карточки в post_item.html кешируется по id поста и его
+версии, а у лент (главная, группа, автор, страница поста) есть своя
+версия, из которой строится ETag. Версии меняются сигналами при
+правке, удалении, новом комментарии, оценке или подписке, поэтому
+устаревшие данные просто перестают запрашиваться. В качестве версии
+берется время в наносекундах, а не счетчик: после очистки кеша версия
+не может совпасть со старой.
+
+Версии хранятся в отдельном кеше POSTS_VERSION_CACHE_ALIAS без
+вытеснения: потерянная версия сменила бы ETag и ключи фрагментов без
+изменения данных.
+
+Дорогие значения (страницы лент, число постов в ленте) берутся через
+get_or_compute: когда запись устаревает, ее пересчитывает один запрос,
+а не все одновременные.
+"""
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+CARD_VERSION_KEY = "posts:card_version:{}"
+FEED_VERSION_KEY = "posts:feed_version:{}"
+FEED_COUNT_KEY = "posts:feed_count:{}:{}"
+COMPUTE_LOCK_KEY = "posts:lock:{}"
+# Как часто ожидающий запрос проверяет, готово ли значение, секунды
+LOCK_POLL_INTERVAL = 0.05
+
+
+def new_version():
+    return time.time_ns()
+
+
+def attach_card_versions(posts):
+    """Проставить постам атрибут card_version одним обращением к кешу."""
+    posts = list(posts)
+    keys = {CARD_VERSION_KEY.format(post.pk): post for post in posts}
+    versions = _get_versions(keys)
+
+    for key, post in keys.items():
+        post.card_version = versions[key]
+    return posts
+
+
+def bump_card_version(post_id):
+    _versions().set(CARD_VERSION_KEY.format(post_id), new_version(),
+                    timeout=None)
+
+
+def feed_versions(*scopes):
+    """Версии лент: "index", "group:<id>", "author:<id>", "post:<id>"."""
+    keys = [FEED_VERSION_KEY.format(scope) for scope in scopes]
+    versions = _get_versions(keys)
+    return tuple(versions[key] for key in keys)
+
+
+def bump_feed_versions(*scopes):
+    version = new_version()
+    _versions().set_many({FEED_VERSION_KEY.format(scope): version
+                          for scope in scopes}, timeout=None)
+
+
+def reset_versions():
+    """Сменить версии всех карточек и лент, например после загрузки
+    данных в обход сигналов.
+
+    Версии — метки времени, поэтому после очистки их кеша новые не
+    совпадут со старыми ETag и ключами фрагментов.
+    """
+    _versions().clear()
+
+
+def post_scopes(post_id, author_id, group_id):
+    scopes = ["index", f"author:{author_id}", f"post:{post_id}"]
+    if group_id is not None:
+        scopes.append(f"group:{group_id}")
+    return scopes
+
+
+def touch_post(post_id, author_id=None, group_id=None):
+    """Сбросить карточку поста и все ленты, где он показан.
+
+    Без author_id автор и группа берутся из базы; если поста уже нет,
+    ленты сбросит сигнал его удаления.
+    """
+    bump_card_version(post_id)
+    if author_id is None:
+        from .models import Post
+
+        row = Post.objects.filter(pk=post_id).values_list(
+            "author_id", "group_id"
+        ).first()
+        if row is None:
+            return
+        author_id, group_id = row
+    bump_feed_versions(*post_scopes(post_id, author_id, group_id))
+
+
+def feed_count(scope, queryset):
+    """Число постов ленты; пересчитывается при смене ее версии."""
+    version, = feed_versions(scope)
+    return get_or_compute(FEED_COUNT_KEY.format(scope, version),
+                          queryset.count, settings.POSTS_FEED_COUNT_TIMEOUT)
+
+
+def get_or_compute(key, compute, timeout, stale_key=None, cacheable=None,
+                   backend=None):
+    """Значение из кеша, а при промахе — compute(), вычисленное одним
+    запросом.
+
+    Вместе со значением хранятся срок и время вычисления. Запись
+    пересчитывается заранее с вероятностью, растущей к концу срока и со
+    временем вычисления (XFetch), поэтому истечение не застает всех
+    разом. Пересчет ведет тот, кто взял блокировку; остальные тем
+    временем получают прежнее значение, при промахе — последнее
+    значение под stale_key (прошлая версия того же ключа), а без него
+    ждут результата до POSTS_CACHE_LOCK_TIMEOUT секунд. Значения, для
+    которых cacheable(value) ложно, не сохраняются.
+
+    Блокировка — cache.add, атомарный в memcached и Redis; в файловом
+    кеше она лишь сокращает число одновременных пересчетов.
+    """
+    backend = backend or cache
+    entry = backend.get(key)
+    if entry is not None and not _expiring(entry):
+        return entry[0]
+
+    lock = COMPUTE_LOCK_KEY.format(key)
+    if backend.add(lock, 1, settings.POSTS_CACHE_LOCK_TIMEOUT):
+        try:
+            return _compute(backend, key, compute, timeout,
+                            stale_key, cacheable)
+        finally:
+            backend.delete(lock)
+
+    if entry is None and stale_key is not None:
+        entry = backend.get(stale_key)
+    if entry is not None:
+        return entry[0]
+
+    deadline = time.monotonic() + settings.POSTS_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        found = backend.get_many([key, lock])
+        if key in found:
+            return found[key][0]
+        if lock not in found:
+            # Пересчет завершился без сохранения
+            break
+    return _compute(backend, key, compute, timeout, stale_key, cacheable)
+
+
+def _expiring(entry):
+    value, delta, expires = entry
+    if expires is None:
+        return False
+    beta = settings.POSTS_CACHE_EARLY_REFRESH_BETA
+    # 1 - random() лежит в (0, 1], логарифм от него конечен
+    early = -delta * beta * math.log(1 - random.random())
+    return time.time() + early >= expires
+
+
+def _compute(backend, key, compute, timeout, stale_key, cacheable):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    if cacheable is None or cacheable(value):
+        expires = None if timeout is None else time.time() + timeout
+        entry = (value, delta, expires)
+        backend.set(key, entry, timeout)
+        if stale_key is not None:
+            backend.set(stale_key, entry, timeout)
+    return value
+
+
+def _versions():
+    return caches[settings.POSTS_VERSION_CACHE_ALIAS]
+
+
+def _get_versions(keys):
+    backend = _versions()
+    versions = backend.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        backend.set_many(missing, timeout=None)
+        versions.update(missing)
+    return versions
@@ -0,0 +1,91 @@
+"""Комментарии на странице поста.
+
+Комментарии первого уровня выводятся страницами по курсору
+(posts.paginators.CursorPaginator по created, новые сверху), так что
+страница стоит одинаково, сколько бы комментариев ни было у поста.
+Ответы — только один уровень — загружаются к комментариям страницы
+одним запросом, авторы — соединением: страница обходится в три запроса
+(ключи страницы, комментарии, ответы). К каждому комментарию выбираются
+только первые POSTS_COMMENT_REPLIES_PER_PAGE ответов, поэтому и
+оживленная ветка не делает страницу дороже. Следующие страницы
+комментариев отдает представление post_comments, следующие ответы —
+comment_replies, оба в JSON для кнопок «Показать еще».
+"""
+from django.conf import settings
+from django.db.models import OuterRef, Prefetch, Subquery
+
+from .models import Comment
+from .paginators import CursorPaginator
+
+
+def comment_page(post_id, cursor=None):
+    """Страница корневых комментариев поста.
+
+    Возвращает (comments, page): comments — выборка комментариев
+    страницы с авторами, первыми ответами в replies_list и курсором
+    следующих ответов в replies_cursor, page — CursorPage с курсорами
+    соседних страниц.
+    """
+    roots = Comment.objects.filter(post_id=post_id,
+                                   parent=None).only("id", "created")
+    page = CursorPaginator(roots, settings.POSTS_COMMENTS_PER_PAGE,
+                           date_field="created").get_page(cursor)
+
+    # Не больше POSTS_COMMENT_REPLIES_PER_PAGE + 1 ответов на
+    # комментарий: коррелированный подзапрос с LIMIT
+    first = Comment.objects.filter(
+        parent_id=OuterRef("parent_id")
+    ).order_by("created", "id").values("pk")[
+        :settings.POSTS_COMMENT_REPLIES_PER_PAGE + 1
+    ]
+    replies = Comment.objects.filter(
+        pk__in=Subquery(first)
+    ).select_related("author").order_by("created", "id")
+    comments = Comment.objects.filter(
+        pk__in=[comment.pk for comment in page]
+    ).select_related("author").prefetch_related(
+        Prefetch("replies", queryset=replies, to_attr="first_replies")
+    ).order_by("-created", "-id")
+    return comments, page
+
+
+def reply_page(root_id, cursor=None):
+    """Страница ответов на комментарий root_id по курсору, старые
+    сверху."""
+    replies = Comment.objects.filter(parent_id=root_id).select_related(
+        "author"
+    )
+    return CursorPaginator(replies, settings.POSTS_COMMENT_REPLIES_PER_PAGE,
+                           date_field="created",
+                           descending=False).get_page(cursor)
+
+
+def reply_parent_id(post_id, parent_id):
+    """id корня ветки для ответа на комментарий parent_id или None,
+    если такого комментария у поста нет."""
+    try:
+        parent_id = int(parent_id)
+    except (TypeError, ValueError):
+        return None
+    row = Comment.objects.filter(pk=parent_id, post_id=post_id).values_list(
+        "id", "parent_id"
+    ).first()
+    if row is None:
+        return None
+    pk, root_id = row
+    return root_id or pk
+
+
+def comment_data(comment):
+    """Комментарий для JSON-ответа вместе с ответами."""
+    data = {
+        "id": comment.pk,
+        "author": comment.author.username,
+        "text": comment.text,
+        "created": comment.created.isoformat(),
+    }
+    replies = getattr(comment, "replies_list", None)
+    if replies is not None:
+        data["replies"] = [comment_data(reply) for reply in replies]
+        data["replies_cursor"] = comment.replies_cursor
+    return data
@@ -0,0 +1,129 @@
+"""RSS и Atom для главной ленты, групп и авторов.
+
+Ленты опрашиваются ботами, поэтому они дешевле HTML-страниц: ETag и
+Last-Modified берутся из тех же версий лент (posts.freshness), и
+неизменившаяся лента отдает 304 без единого запроса постов. Иначе
+посты выбираются тем же запросом feed(), что и в HTML-лентах, и
+отдаются через StreamingHttpResponse по одному элементу, без шаблонов
+и без сборки всего документа в памяти.
+"""
+import io
+import itertools
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils import feedgenerator
+from django.utils.text import Truncator
+from django.utils.xmlutils import SimplerXMLGenerator
+from django.views.decorators.http import condition
+
+from . import freshness
+from .models import Group, Post, User
+
+
+class StreamingFeedMixin:
+    """Генератор ленты, который пишет элементы по одному."""
+
+    item_element = None
+    closing_tag = None
+
+    def stream(self, posts, encoding="utf-8"):
+        items = (self.post_item(post) for post in posts)
+        first = next(items, None)
+        self.latest = first["pubdate"] if first is not None else None
+        # Заголовок и хвост — это документ без элементов, разрезанный
+        # по закрывающему тегу
+        head, tail = self.writeString(encoding).rsplit(self.closing_tag, 1)
+        yield head
+
+        buffer = io.StringIO()
+        handler = SimplerXMLGenerator(buffer, encoding)
+        if first is not None:
+            for item in itertools.chain([first], items):
+                handler.startElement(self.item_element,
+                                     self.item_attributes(item))
+                self.add_item_elements(handler, item)
+                handler.endElement(self.item_element)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield self.closing_tag + tail
+
+    def post_item(self, post):
+        link = self.feed["link"].rstrip("/") + reverse(
+            "posts:post", args=[post.author.username, post.pk]
+        )
+        self.add_item(
+            title=Truncator(post.text).words(8),
+            link=link,
+            description=post.text,
+            author_name=post.author.get_full_name() or post.author.username,
+            pubdate=post.pub_date,
+            unique_id=link,
+            categories=[post.group.title] if post.group_id else None,
+            comments=link if post.comments_count else None,
+        )
+        return self.items.pop()
+
+    def latest_post_date(self):
+        return self.latest or super().latest_post_date()
+
+
+class RssFeed(StreamingFeedMixin, feedgenerator.Rss201rev2Feed):
+    item_element = "item"
+    closing_tag = "</channel>"
+
+
+class AtomFeed(StreamingFeedMixin, feedgenerator.Atom1Feed):
+    item_element = "entry"
+    closing_tag = "</feed>"
+
+
+FEED_CLASSES = {"rss": RssFeed, "atom": AtomFeed}
+
+
+def _feed_response(request, feed_format, title, posts):
+    feed = FEED_CLASSES[feed_format](
+        title=f"{title} | Yatube",
+        link=request.build_absolute_uri("/"),
+        description=title,
+        feed_url=request.build_absolute_uri(),
+        language=settings.LANGUAGE_CODE,
+    )
+    posts = posts.feed()[:settings.POSTS_FEED_ITEMS]
+    return StreamingHttpResponse(feed.stream(posts.iterator()),
+                                 content_type=feed.content_type)
+
+
+def _feed(func):
+    """ETag и Last-Modified ленты — те же, что у HTML-страницы; в ETag
+    входит путь запроса, так что ETag не совпадают."""
+    def feed_func(request, feed_format, **kwargs):
+        return func(request, **kwargs)
+    return feed_func
+
+
+@condition(etag_func=_feed(freshness.index_etag),
+           last_modified_func=_feed(freshness.index_last_modified))
+def index_feed(request, feed_format):
+    return _feed_response(request, feed_format, "Последние обновления",
+                          Post.objects.all())
+
+
+@condition(etag_func=_feed(freshness.group_etag),
+           last_modified_func=_feed(freshness.group_last_modified))
+def group_feed(request, slug, feed_format):
+    group = get_object_or_404(Group, slug=slug)
+    return _feed_response(request, feed_format, group.title,
+                          group.posts.all())
+
+
+@condition(etag_func=_feed(freshness.profile_etag),
+           last_modified_func=_feed(freshness.profile_last_modified))
+def profile_feed(request, username, feed_format):
+    author = get_object_or_404(User, username=username)
+    return _feed_response(request, feed_format,
+                          author.get_full_name() or author.username,
+                          author.posts.all())
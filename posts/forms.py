@@ -1,6 +1,8 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
 
+from .images import prepare_image
 from .models import Post, Comment, Follow, Group#, PostRate
 
 
@@ -20,6 +22,13 @@ class PostForm(ModelForm):
             raise forms.ValidationError("Текст отсутствует!")
         return data
 
+    def clean_image(self):
+        image = self.cleaned_data["image"]
+        # Пересохраняется только новая загрузка, а не уже сохраненный файл
+        if isinstance(image, UploadedFile):
+            image = prepare_image(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -27,6 +36,15 @@ class CommentForm(ModelForm):
         fields = ["text"]
 
 
+class SearchForm(forms.Form):
+    q = forms.CharField(label="Поиск", max_length=200)
+    group = forms.ModelChoiceField(queryset=Group.objects.all(),
+                                   to_field_name="slug",
+                                   required=False,
+                                   label="Группа")
+    author = forms.CharField(label="Автор", max_length=150, required=False)
+
+
 class FollowForm(ModelForm):
     class Meta:
         model = Follow
@@ -0,0 +1,95 @@
+"""ETag и Last-Modified для условных GET-запросов к лентам и страницам
+постов.
+
+Оба заголовка считаются по версиям лент (см. posts.cache), поэтому
+ответ 304 не требует ни выборки постов, ни рендеринга шаблона. ETag
+собирается из версий, пользователя и параметров запроса. Last-Modified —
+время самой свежей из версий: версия и есть время последней записи в
+ленту в наносекундах. Last-Modified точен до секунды и не зависит от
+пользователя, поэтому при If-None-Match он не проверяется (RFC 7232).
+Версии ленты ищутся один раз на запрос: их спрашивают и @condition, и
+кеш страниц (posts.pagecache), который хранит страницу под ETag.
+"""
+import datetime
+import functools
+import hashlib
+
+from .cache import feed_versions
+from .models import Group, User
+
+
+def _etag(request, versions):
+    viewer = request.user.pk if request.user.is_authenticated else "-"
+    raw = "|".join(str(part) for part in (
+        request.path, request.GET.urlencode(), viewer, *versions
+    ))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def per_request(versions_func):
+    """Запомнить версии лент в запросе."""
+    @functools.wraps(versions_func)
+    def wrapper(request, *args, **kwargs):
+        if not hasattr(request, "posts_versions"):
+            request.posts_versions = versions_func(request, *args, **kwargs)
+        return request.posts_versions
+    return wrapper
+
+
+def etag_func(versions_func):
+    def etag(request, *args, **kwargs):
+        versions = versions_func(request, *args, **kwargs)
+        return None if versions is None else _etag(request, versions)
+    return etag
+
+
+def last_modified_func(versions_func):
+    def last_modified(request, *args, **kwargs):
+        versions = versions_func(request, *args, **kwargs)
+        if versions is None:
+            return None
+        return datetime.datetime.fromtimestamp(max(versions) / 10 ** 9,
+                                               tz=datetime.timezone.utc)
+    return last_modified
+
+
+def _user_id(username):
+    return User.objects.filter(username=username).values_list(
+        "id", flat=True
+    ).first()
+
+
+@per_request
+def index_versions(request):
+    return feed_versions("index")
+
+
+@per_request
+def group_versions(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        "id", flat=True
+    ).first()
+    if group_id is None:
+        # Страница-заглушка без группы не меняет версий: не кешируем
+        return None
+    return feed_versions(f"group:{group_id}")
+
+
+@per_request
+def profile_versions(request, username):
+    return feed_versions(f"author:{_user_id(username)}")
+
+
+@per_request
+def post_versions(request, username, post_id, **kwargs):
+    return feed_versions(f"post:{post_id}", f"author:{_user_id(username)}")
+
+
+index_etag = etag_func(index_versions)
+index_last_modified = last_modified_func(index_versions)
+group_etag = etag_func(group_versions)
+group_last_modified = last_modified_func(group_versions)
+profile_etag = etag_func(profile_versions)
+profile_last_modified = last_modified_func(profile_versions)
+post_etag = etag_func(post_versions)
+post_last_modified = last_modified_func(post_versions)
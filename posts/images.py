@@ -0,0 +1,62 @@
+"""Обработка картинок, загружаемых с постами.
+
+Картинка из формы проверяется по размерам, поворачивается по EXIF,
+лишается метаданных (EXIF с геометкой, ICC, комментарии) и
+пересохраняется в POSTS_IMAGE_FORMAT не больше POSTS_IMAGE_STORED_SIDE
+по длинной стороне. Так в media/posts/ не попадают многомегабайтные
+оригиналы, а миниатюры для srcset (см. posts.thumbnails) режутся из
+уже уменьшенной картинки.
+"""
+import io
+import os
+
+from django import forms
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+def prepare_image(upload):
+    """Проверить и пересохранить загруженную картинку; возвращает
+    ContentFile, который можно присвоить ImageField."""
+    upload.seek(0)
+    image = Image.open(upload)
+    width, height = image.size
+    if (max(width, height) > settings.POSTS_IMAGE_MAX_SIDE
+            or width * height > settings.POSTS_IMAGE_MAX_PIXELS):
+        raise forms.ValidationError(
+            "Картинка слишком большая: не больше %(side)s точек по "
+            "стороне и %(pixels)s мегапикселей.",
+            code="image_too_large",
+            params={"side": settings.POSTS_IMAGE_MAX_SIDE,
+                    "pixels": settings.POSTS_IMAGE_MAX_PIXELS // 10 ** 6},
+        )
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((settings.POSTS_IMAGE_STORED_SIDE,) * 2,
+                    Image.LANCZOS)
+    image = _convert(image, settings.POSTS_IMAGE_FORMAT)
+    # Без info в файл не попадут EXIF, ICC-профиль и комментарии
+    image.info = {}
+
+    buffer = io.BytesIO()
+    image.save(buffer, settings.POSTS_IMAGE_FORMAT,
+               quality=settings.POSTS_IMAGE_QUALITY, optimize=True)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    extension = EXTENSIONS[settings.POSTS_IMAGE_FORMAT]
+    return ContentFile(buffer.getvalue(), name=f"{name}.{extension}")
+
+
+def _convert(image, fmt):
+    has_alpha = image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    )
+    if fmt == "JPEG" and has_alpha:
+        # В JPEG нет прозрачности: кладем картинку на белый фон
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGBA" if has_alpha else "RGB")
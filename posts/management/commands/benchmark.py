@@ -0,0 +1,151 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from posts.benchmark import (compare, current_commit, generate_data,
+                             run_benchmark, run_concurrency_benchmark,
+                             run_sqlite_benchmark)
+
+COLUMNS = ("p50_ms", "p95_ms", "mean_ms", "queries", "peak_kb")
+CONCURRENCY_COLUMNS = ("sync_total_ms", "async_total_ms", "sync_p50_ms",
+                       "async_p50_ms", "speedup")
+SQLITE_COLUMNS = ("reads_per_s", "writes_per_s", "read_p95_ms",
+                  "write_p95_ms", "locked")
+
+
+class Command(BaseCommand):
+    help = ("Замерить представления posts на синтетических данных во "
+            "временной тестовой базе")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument("--comments", type=int, default=5000)
+        parser.add_argument("--follows", type=int, default=1000)
+        parser.add_argument("--rates", type=int, default=3000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--cold", action="store_true",
+                            help="Очищать кеш перед каждым запросом")
+        parser.add_argument("--page-cache", action="store_true",
+                            help="Отдавать анонимам страницы из кеша")
+        parser.add_argument("--concurrency", action="store_true",
+                            help="Сравнить синхронные и асинхронные "
+                                 "представления на медленной базе "
+                                 "(без --output и --compare)")
+        parser.add_argument("--db-delay", type=float, default=5,
+                            help="Задержка запроса к базе для "
+                                 "--concurrency, мс")
+        parser.add_argument("--sqlite", action="store_true",
+                            help="Сравнить профили PRAGMA SQLite под "
+                                 "чтением и записью из нескольких "
+                                 "процессов; --requests — операций на "
+                                 "процесс (без --output и --compare)")
+        parser.add_argument("--readers", type=int, default=4,
+                            help="Читающих процессов для --sqlite")
+        parser.add_argument("--writers", type=int, default=2,
+                            help="Пишущих процессов для --sqlite")
+        parser.add_argument("--output",
+                            help="Сохранить результат в JSON")
+        parser.add_argument("--compare",
+                            help="JSON прошлого прогона для сравнения")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Допустимый рост p95, доля")
+
+    def handle(self, *args, **options):
+        if options["sqlite"] and connection.vendor != "sqlite":
+            raise CommandError("--sqlite работает только с SQLite")
+        # Ключи стенда не пересекаются с кешем рабочей базы
+        caches = {alias: benchmark_cache(config)
+                  for alias, config in settings.CACHES.items()}
+        old_name = connection.creation.create_test_db(verbosity=0,
+                                                      autoclobber=True,
+                                                      serialize=False)
+        try:
+            with override_settings(CACHES=caches):
+                generate_data(
+                    users=options["users"], posts=options["posts"],
+                    comments=options["comments"],
+                    follows=options["follows"], rates=options["rates"],
+                    seed=options["seed"],
+                )
+                if options["sqlite"]:
+                    results = run_sqlite_benchmark(
+                        readers=options["readers"],
+                        writers=options["writers"],
+                        operations=options["requests"],
+                    )
+                elif options["concurrency"]:
+                    results = run_concurrency_benchmark(
+                        requests=options["requests"],
+                        delay=options["db_delay"] / 1000,
+                    )
+                else:
+                    results = run_benchmark(
+                        requests=options["requests"],
+                        warmup=options["warmup"], cold=options["cold"],
+                        page_cache=options["page_cache"],
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["sqlite"]:
+            self.report(results, columns=SQLITE_COLUMNS)
+            return
+        if options["concurrency"]:
+            self.report(results, columns=CONCURRENCY_COLUMNS)
+            return
+
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                baseline = json.load(file)
+        self.report(results, baseline and baseline["results"])
+
+        if options["output"]:
+            report = {"commit": current_commit(),
+                      "options": {key: options[key] for key in (
+                          "users", "posts", "comments", "follows",
+                          "rates", "seed", "requests", "cold",
+                          "page_cache")},
+                      "results": results}
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+        if baseline is not None:
+            regressions = compare(results, baseline["results"],
+                                  options["threshold"])
+            if regressions:
+                raise CommandError(
+                    f"Регрессии относительно {baseline['commit']}:\n"
+                    + "\n".join(regressions)
+                )
+
+    def report(self, results, baseline=None, columns=COLUMNS):
+        width = max(12, *(len(column) + 2 for column in columns))
+        self.stdout.write(f"{'scenario':<18}" + "".join(
+            f"{column:>{width}}" for column in columns))
+        for name, metrics in results.items():
+            line = f"{name:<18}" + "".join(
+                f"{metrics[column]:>{width}}" for column in columns)
+            if baseline and name in baseline:
+                before = baseline[name]["p95_ms"]
+                change = (metrics["p95_ms"] - before) / before * 100
+                line += f"   p95 {change:+.0f}%"
+            if metrics.get("status", 200) >= 400:
+                line += f"   HTTP {metrics['status']}"
+            self.stdout.write(line)
+
+
+def benchmark_cache(config):
+    config = {**config, "KEY_PREFIX": "benchmark"}
+    if config["BACKEND"].endswith("FileBasedCache"):
+        # clear() файлового кеша удаляет весь каталог, а не только
+        # ключи с префиксом
+        config["LOCATION"] = os.path.join(config["LOCATION"], "benchmark")
+    return config
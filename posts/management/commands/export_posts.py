@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from posts.transfer import FORMATS, export_data
+
+
+class Command(BaseCommand):
+    help = ("Выгрузить группы, посты, комментарии, подписки и оценки "
+            "в каталог в формате NDJSON или CSV")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument("--images",
+                            help="Каталог, куда скопировать картинки постов")
+
+    def handle(self, *args, **options):
+        counts = export_data(options["directory"],
+                             fmt=options["format"],
+                             images=options["images"])
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts.benchmark import generate_data
+
+
+class Command(BaseCommand):
+    help = ("Наполнить базу синтетическими пользователями, группами, "
+            "постами, комментариями, подписками и оценками")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--groups", type=int, default=10)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument("--comments", type=int, default=5000)
+        parser.add_argument("--follows", type=int, default=1000)
+        parser.add_argument("--rates", type=int, default=3000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        counts = generate_data(
+            users=options["users"], groups=options["groups"],
+            posts=options["posts"], comments=options["comments"],
+            follows=options["follows"], rates=options["rates"],
+            seed=options["seed"],
+        )
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
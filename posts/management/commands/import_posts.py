@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts.transfer import BATCH_SIZE, import_data
+
+
+class Command(BaseCommand):
+    help = ("Загрузить группы, посты, комментарии, подписки и оценки "
+            "из каталога, выгруженного export_posts")
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument("--images",
+                            help="Каталог с картинками постов для "
+                                 "загрузки в хранилище")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--no-rebuild", action="store_false",
+                            dest="rebuild",
+                            help="Не пересобирать счетчики, ленты и "
+                                 "поисковый индекс")
+
+    def handle(self, *args, **options):
+        counts = import_data(options["directory"],
+                             images=options["images"],
+                             batch_size=options["batch_size"],
+                             rebuild=options["rebuild"])
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count}")
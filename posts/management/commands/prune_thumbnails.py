@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts.storage import find_orphans, prune_orphans
+
+
+class Command(BaseCommand):
+    help = ("Найти миниатюры sorl и картинки постов, на которые не "
+            "ссылается ни один пост; с --prune удалить их")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prune", action="store_true",
+                            help="Удалить найденные файлы")
+        parser.add_argument("--list", action="store_true",
+                            help="Вывести имена файлов")
+
+    def handle(self, *args, **options):
+        if options["prune"]:
+            images, thumbnails = prune_orphans()
+            verb = "Удалено"
+        else:
+            images, thumbnails = find_orphans()
+            verb = "Найдено"
+        if options["list"]:
+            for name in images + thumbnails:
+                self.stdout.write(name)
+        self.stdout.write(f"{verb} картинок без постов: {len(images)}, "
+                          f"лишних миниатюр: {len(thumbnails)}")
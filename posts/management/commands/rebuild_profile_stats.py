@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.stats import rebuild_profile_stats
+
+
+class Command(BaseCommand):
+    help = "Пересчитать счетчики подписчиков, подписок и записей"
+
+    def handle(self, *args, **options):
+        users = rebuild_profile_stats()
+        self.stdout.write(f"Счетчики пересчитаны, пользователей: {users}")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Переиндексировать текст постов для поиска"
+
+    def handle(self, *args, **options):
+        posts = rebuild_index()
+        self.stdout.write(f"Поисковый индекс пересобран, постов: {posts}")
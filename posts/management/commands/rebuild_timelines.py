@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Пересобрать материализованные ленты подписок"
+
+    def handle(self, *args, **options):
+        follows = rebuild_timelines()
+        self.stdout.write(f"Ленты пересобраны, подписок: {follows}")
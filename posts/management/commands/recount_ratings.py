@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.ratings import recount_ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитать сумму и число оценок постов"
+
+    def handle(self, *args, **options):
+        posts = recount_ratings()
+        self.stdout.write(f"Оценки пересчитаны, постов: {posts}")
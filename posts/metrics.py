@@ -0,0 +1,240 @@
+"""Метрики производительности запросов.
+
+MetricsMiddleware на каждый запрос считает время ответа, число и время
+SQL-запросов, время рендера шаблонов, попадания и промахи кеша. Все это
+суммируется по имени представления и отдается страницей /-/metrics/ в
+текстовом формате Prometheus. С POSTS_METRICS_SERVER_TIMING те же
+цифры уходят в заголовок Server-Timing ответа.
+
+Без POSTS_METRICS_ENABLED middleware выбрасывает MiddlewareNotUsed и
+исключается из цепочки: шаблоны и кеш не оборачиваются, накладных
+расходов нет. Счетчики хранятся в памяти процесса, поэтому при
+нескольких воркерах каждый из них опрашивается отдельно.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+from django.template.backends.django import Template
+
+# Границы корзин гистограммы времени ответа, секунды
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_MISSING = object()
+_current = contextvars.ContextVar("posts_metrics", default=None)
+
+
+class RequestMetrics:
+    """Счетчики одного запроса."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def execute(self, execute, sql, params, many, context):
+        """Обертка connection.execute_wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+
+
+class Registry:
+    """Накопленные метрики процесса по представлениям."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+
+    def record(self, view, status, elapsed, metrics):
+        with self._lock:
+            stats = self.views.setdefault(view, {
+                "requests": {}, "seconds": 0.0,
+                "buckets": [0] * len(BUCKETS),
+                "queries": 0, "db_seconds": 0.0, "template_seconds": 0.0,
+                "cache_hits": 0, "cache_misses": 0,
+            })
+            stats["requests"][status] = stats["requests"].get(status, 0) + 1
+            stats["seconds"] += elapsed
+            for index, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    stats["buckets"][index] += 1
+            stats["queries"] += metrics.queries
+            stats["db_seconds"] += metrics.db_time
+            stats["template_seconds"] += metrics.template_time
+            stats["cache_hits"] += metrics.cache_hits
+            stats["cache_misses"] += metrics.cache_misses
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        with self._lock:
+            views = {view: dict(stats, requests=dict(stats["requests"]),
+                                buckets=list(stats["buckets"]))
+                     for view, stats in self.views.items()}
+
+        lines = [
+            "# TYPE yatube_requests_total counter",
+            "# TYPE yatube_request_duration_seconds histogram",
+            "# TYPE yatube_db_queries_total counter",
+            "# TYPE yatube_db_duration_seconds_total counter",
+            "# TYPE yatube_template_duration_seconds_total counter",
+            "# TYPE yatube_cache_hits_total counter",
+            "# TYPE yatube_cache_misses_total counter",
+        ]
+        for view, stats in sorted(views.items()):
+            label = f'view="{view}"'
+            total = sum(stats["requests"].values())
+            for status, count in sorted(stats["requests"].items()):
+                lines.append(f'yatube_requests_total{{{label},'
+                             f'status="{status}"}} {count}')
+            for bound, count in zip(BUCKETS, stats["buckets"]):
+                lines.append(f'yatube_request_duration_seconds_bucket'
+                             f'{{{label},le="{bound}"}} {count}')
+            lines += [
+                f'yatube_request_duration_seconds_bucket'
+                f'{{{label},le="+Inf"}} {total}',
+                f'yatube_request_duration_seconds_sum{{{label}}} '
+                f'{stats["seconds"]:.6f}',
+                f'yatube_request_duration_seconds_count{{{label}}} {total}',
+                f'yatube_db_queries_total{{{label}}} {stats["queries"]}',
+                f'yatube_db_duration_seconds_total{{{label}}} '
+                f'{stats["db_seconds"]:.6f}',
+                f'yatube_template_duration_seconds_total{{{label}}} '
+                f'{stats["template_seconds"]:.6f}',
+                f'yatube_cache_hits_total{{{label}}} {stats["cache_hits"]}',
+                f'yatube_cache_misses_total{{{label}}} '
+                f'{stats["cache_misses"]}',
+            ]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not settings.POSTS_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_templates()
+        for alias in settings.CACHES:
+            instrument_cache(type(caches[alias]))
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.execute)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        elapsed = metrics.elapsed
+        match = request.resolver_match
+        view = match.view_name if match else "unmatched"
+        registry.record(view, response.status_code, elapsed, metrics)
+        if settings.POSTS_METRICS_SERVER_TIMING:
+            response["Server-Timing"] = server_timing(metrics, elapsed)
+        return response
+
+
+def server_timing(metrics, elapsed):
+    return ", ".join([
+        f'db;dur={metrics.db_time * 1000:.1f};'
+        f'desc="{metrics.queries} queries"',
+        f"tpl;dur={metrics.template_time * 1000:.1f}",
+        f'cache;desc="{metrics.cache_hits} hits, '
+        f'{metrics.cache_misses} misses"',
+        f"total;dur={elapsed * 1000:.1f}",
+    ])
+
+
+def instrument_templates():
+    """Считать время рендера шаблонов верхнего уровня; {% include %}
+    рендерится внутри них и отдельно не учитывается."""
+    if getattr(Template.render, "posts_metrics", False):
+        return
+    render = Template.render
+
+    def timed_render(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+    timed_render.posts_metrics = True
+    Template.render = timed_render
+
+
+def instrument_cache(backend):
+    """Считать попадания и промахи get и get_many бэкенда кеша."""
+    if getattr(backend.get, "posts_metrics", False):
+        return
+    get, get_many = backend.get, backend.get_many
+
+    def counted_get(self, key, default=None, version=None):
+        value = get(self, key, _MISSING, version=version)
+        metrics = _current.get()
+        if metrics is not None:
+            if value is _MISSING:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is _MISSING else value
+
+    def counted_get_many(self, keys, version=None):
+        keys = list(keys)
+        # Базовый get_many вызывает get по ключам: не считаем их дважды
+        metrics = _current.get()
+        token = _current.set(None)
+        try:
+            values = get_many(self, keys, version=version)
+        finally:
+            _current.reset(token)
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    counted_get.posts_metrics = counted_get_many.posts_metrics = True
+    backend.get, backend.get_many = counted_get, counted_get_many
+
+
+def metrics_view(request):
+    """Страница для Prometheus; доступна только с адресов
+    POSTS_METRICS_ALLOWED_IPS."""
+    allowed = request.META.get("REMOTE_ADDR") in (
+        settings.POSTS_METRICS_ALLOWED_IPS
+    )
+    if not settings.POSTS_METRICS_ENABLED or not allowed:
+        raise Http404
+    return HttpResponse(registry.render(),
+                        content_type="text/plain; version=0.0.4")
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+from .paginators import encode_cursor
+from .storage import post_images
+
 User = get_user_model()
 
 
@@ -15,6 +19,24 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        """Выборка для лент: автор, группа и число комментариев
+        загружаются одним запросом вместо запросов на каждую карточку."""
+        # Коррелированный подзапрос вместо JOIN + GROUP BY: так выборка
+        # страницы идет по индексу даты без сортировки всей таблицы
+        comments = Comment.objects.filter(
+            post=models.OuterRef("pk")
+        ).order_by().annotate(
+            count=models.Func(models.F("id"), function="COUNT")
+        ).values("count")
+        return self.select_related("author", "group").annotate(
+            comments_count=models.Subquery(
+                comments, output_field=models.IntegerField()
+            )
+        )
+
+
 class Post(models.Model):
     text = models.TextField(verbose_name="Текст поста",
                             help_text="* Обязательно поле")
@@ -30,17 +52,38 @@ class Post(models.Model):
                               related_name="posts",
                               help_text="Укажите наименование группы")
     image = models.ImageField(upload_to="posts/",
+                              storage=post_images,
                               blank=True,
                               null=True,
                               verbose_name="Изображение")
-    post_rate_avg = models.FloatField(blank=True,
-                                        null=True)
+    # Сумма и число оценок ведутся инкрементально в posts.ratings,
+    # средняя считается из них без агрегата по PostRate
+    rate_sum = models.IntegerField(default=0)
+    rate_count = models.IntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
 
     def __str__(self):
         return self.text[:15]
 
+    @property
+    def post_rate_avg(self):
+        if not self.rate_count:
+            return None
+        return round(self.rate_sum / self.rate_count)
+
     class Meta:
-        ordering = ["-pub_date"]
+        ordering = ["-pub_date", "-id"]
+        # Индексы под ленты: главная сортирует по дате, группа и профиль
+        # сначала фильтруют по группе или автору
+        indexes = [
+            models.Index(fields=["-pub_date", "-id"],
+                         name="post_pub_date_idx"),
+            models.Index(fields=["group", "-pub_date", "-id"],
+                         name="post_group_date_idx"),
+            models.Index(fields=["author", "-pub_date", "-id"],
+                         name="post_author_date_idx"),
+        ]
 
 
 class Comment(models.Model):
@@ -53,10 +96,40 @@ class Comment(models.Model):
     text = models.TextField(verbose_name="Комментарий",
                             help_text="Напишите ваш комментарий к посту")
     created = models.DateTimeField("date published", auto_now_add=True)
+    # Ответы — один уровень: ответ на ответ прикрепляется к корню ветки
+    parent = models.ForeignKey("self",
+                               on_delete=models.CASCADE,
+                               blank=True,
+                               null=True,
+                               related_name="replies",
+                               verbose_name="Ответ на")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["post", "created", "id"],
+                         name="comment_post_created_idx"),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    # first_replies — первые ответы с одним лишним, их загружает
+    # posts.comments.comment_page: по лишнему видно, есть ли следующие
+    @property
+    def replies_list(self):
+        replies = getattr(self, "first_replies", None)
+        if replies is None:
+            return None
+        return replies[:settings.POSTS_COMMENT_REPLIES_PER_PAGE]
+
+    @property
+    def replies_cursor(self):
+        """Курсор следующих ответов или None, если их больше нет."""
+        shown = self.replies_list
+        if shown is None or len(self.first_replies) <= len(shown):
+            return None
+        return encode_cursor("n", shown[-1].created, shown[-1].pk)
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User,
@@ -83,4 +156,80 @@ class PostRate(models.Model):
                              on_delete=models.CASCADE,
                              related_name="rates")
     rate = models.IntegerField(blank=True,
-                               null=True)
\ No newline at end of file
+                               null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "user"],
+                name="unique_post_rate"
+            )
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок: пост автора,
+    разложенный подписчику при публикации."""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"],
+                name="unique_timeline_post"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "-pub_date"],
+                         name="timeline_user_date_idx")
+        ]
+
+
+class SearchToken(models.Model):
+    """Инвертированный индекс для поиска по постам там, где нет FTS5:
+    слово, пост и число вхождений слова в текст."""
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="search_tokens")
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["term", "post"],
+                         name="search_term_post_idx")
+        ]
+
+
+class StoredImage(models.Model):
+    """Строка-замок картинки в хранилище постов.
+
+    Ее берут на запись и сохранение картинки, и release_image, поэтому
+    удаление файла не пересекается с загрузкой такой же картинки
+    (см. posts.storage).
+    """
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ProfileStats(models.Model):
+    """Счетчики профиля: подписчики, подписки и записи пользователя.
+
+    Поддерживаются сигналами Follow и Post, пересобираются командой
+    rebuild_profile_stats.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="stats")
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    posts_count = models.IntegerField(default=0)
@@ -0,0 +1,93 @@
+"""Кеш целых страниц для анонимных посетителей.
+
+Ключ страницы — ее ETag из posts.freshness: он собран из пути,
+параметров запроса и версий лент. Запись поста, комментария, оценки
+или подписки меняет версию, и следующий запрос ищет страницу под новым
+ключом, так что устаревшая страница никогда не отдается. Срок
+POSTS_PAGE_CACHE_TIMEOUT нужен только для того, чтобы осиротевшие
+записи освобождали место. Чтобы кеш и версии были общими для всех
+воркеров, бэкенд POSTS_PAGE_CACHE_ALIAS должен быть общим (файловый
+кеш, memcached).
+
+Страница рендерится через get_or_compute: после записи новую версию
+рендерит один запрос, а одновременные с ним получают прошлую версию
+той же страницы (PAGE_STALE_KEY) и не нагружают базу. Страница хранится
+со своими ETag и Last-Modified, поэтому прошлая версия уходит под
+прошлыми: клиент не запомнит старое содержимое под новыми и при
+следующей проверке получит свежую страницу, а не 304.
+
+Авторизованным пользователям страницы рендерятся каждый раз: в них
+есть кнопки, формы и CSRF-токен конкретного пользователя.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import http_date, quote_etag
+
+from .cache import get_or_compute
+
+PAGE_KEY = "posts:page:{}"
+PAGE_STALE_KEY = "posts:page_stale:{}"
+
+
+def cache_anonymous_page(etag_func, last_modified_func=None):
+    """Отдавать анонимные GET-запросы к представлению из кеша по ETag.
+
+    Ставится под @condition с теми же etag_func и last_modified_func:
+    версии лент ищутся один раз на запрос (см. freshness.per_request).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not page_cache_applies(request):
+                return view(request, *args, **kwargs)
+
+            etag = etag_func(request, *args, **kwargs)
+            if etag is None:
+                return view(request, *args, **kwargs)
+
+            path = hashlib.md5(
+                request.get_full_path().encode()
+            ).hexdigest()
+
+            def render():
+                response = view(request, *args, **kwargs)
+                # @condition не перепишет заголовки, уже стоящие в ответе
+                response["ETag"] = quote_etag(etag)
+                if last_modified_func is not None:
+                    last_modified = last_modified_func(request, *args,
+                                                       **kwargs)
+                    response["Last-Modified"] = http_date(
+                        last_modified.timestamp()
+                    )
+                return response
+
+            return get_or_compute(
+                PAGE_KEY.format(etag),
+                render,
+                settings.POSTS_PAGE_CACHE_TIMEOUT,
+                stale_key=PAGE_STALE_KEY.format(path),
+                cacheable=functools.partial(_is_cacheable, request),
+                backend=caches[settings.POSTS_PAGE_CACHE_ALIAS],
+            )
+        return wrapper
+    return decorator
+
+
+def page_cache_applies(request):
+    """Может ли ответ на запрос браться из кеша страниц."""
+    return bool(settings.POSTS_PAGE_CACHE_TIMEOUT
+                and request.method in ("GET", "HEAD")
+                and not request.user.is_authenticated)
+
+
+def _is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # Страница с CSRF-токеном принадлежит одному посетителю
+        and not request.META.get("CSRF_COOKIE_USED")
+    )
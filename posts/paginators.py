@@ -0,0 +1,141 @@
+import base64
+import collections.abc
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(direction, value, pk):
+    """Курсор страницы после ("n") или до ("p") записи с ключом
+    (value, pk)."""
+    raw = f"{direction}|{value.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+class CursorPage(collections.abc.Sequence):
+    """Страница курсорной пагинации.
+
+    Повторяет интерфейс ``django.core.paginator.Page``, которым
+    пользуются шаблоны, но вместо номеров страниц хранит курсоры
+    соседних страниц.
+    """
+
+    def __init__(self, object_list, paginator,
+                 next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return "<CursorPage>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class CursorPaginator:
+    """Keyset-пагинация по паре ``(pub_date, id)``.
+
+    Страница выбирается условием по ключу последней показанной записи
+    и ``LIMIT``, без ``COUNT(*)`` и ``OFFSET``, поэтому далекие страницы
+    стоят столько же, сколько первая. По умолчанию новые записи идут
+    первыми; с ``descending=False`` — старые.
+    """
+
+    cursor_mode = True
+    date_field = "pub_date"
+
+    def __init__(self, object_list, per_page, date_field=None,
+                 descending=True):
+        if date_field is not None:
+            self.date_field = date_field
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.descending = descending
+
+    def get_page(self, cursor=None):
+        """Вернуть страницу по курсору; неверный курсор — первая
+        страница."""
+        position = self.decode_cursor(cursor)
+        if position is None:
+            return self._page_after(None)
+        direction, value, pk = position
+        if direction == "p":
+            return self._page_before(value, pk)
+        return self._page_after((value, pk))
+
+    def _select(self, position, descending):
+        # Выборка со своим keyset (например, лента подписок из двух
+        # запросов) сама выбирает посты после ключа
+        keyset = getattr(self.object_list, "keyset", None)
+        if keyset is not None:
+            return keyset(position, descending, self.per_page + 1)
+        sign, compare = ("-", "lt") if descending else ("", "gt")
+        queryset = self.object_list.order_by(f"{sign}{self.date_field}",
+                                             f"{sign}id")
+        if position is not None:
+            value, pk = position
+            queryset = queryset.filter(
+                Q(**{f"{self.date_field}__{compare}": value})
+                | Q(**{self.date_field: value, f"id__{compare}": pk})
+            )
+        return list(queryset[:self.per_page + 1])
+
+    def _page_after(self, position):
+        items = self._select(position, self.descending)
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+
+        return CursorPage(
+            items,
+            self,
+            next_cursor=self._cursor("n", items[-1]) if has_more else None,
+            previous_cursor=(self._cursor("p", items[0])
+                             if position is not None and items else None),
+        )
+
+    def _page_before(self, value, pk):
+        items = self._select((value, pk), not self.descending)
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page][::-1]
+        if not items:
+            return self._page_after(None)
+
+        return CursorPage(
+            items,
+            self,
+            next_cursor=self._cursor("n", items[-1]),
+            previous_cursor=self._cursor("p", items[0]) if has_more else None,
+        )
+
+    def _cursor(self, direction, obj):
+        return encode_cursor(direction, getattr(obj, self.date_field),
+                             obj.pk)
+
+    @staticmethod
+    def decode_cursor(cursor):
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            direction, value, pk = raw.decode().split("|")
+            value = parse_datetime(value)
+            pk = int(pk)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if direction not in ("n", "p") or value is None:
+            return None
+        return direction, value, pk
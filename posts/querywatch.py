@@ -0,0 +1,148 @@
+"""Поиск медленных и повторяющихся SQL-запросов.
+
+watch_queries оборачивает выполнение запросов на всех соединениях и
+сводит каждый запрос к отпечатку: литералы, числа и списки IN
+заменяются на «?». Если запрос одной формы выполнился за запрос
+страницы POSTS_QUERYWATCH_DUPLICATES раз и больше, это почти наверняка
+N+1. Такие запросы пишутся в лог posts.querywatch вместе с
+представлением, строкой кода и строкой шаблона, откуда пришел первый
+из них. Запросы дольше POSTS_QUERYWATCH_SLOW_MS логируются сразу.
+
+В режиме проверки (POSTS_QUERYWATCH_RAISE или watch_queries(
+raise_errors=True) в тестах) повторы вызывают DuplicateQueriesError.
+"""
+import contextlib
+import logging
+import os
+import re
+import sys
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\((?:\s*(?:\?|%s)\s*,)+\s*(?:\?|%s)\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+class DuplicateQueriesError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """Форма запроса без значений параметров."""
+    sql = _LITERALS.sub("?", sql)
+    sql = _LISTS.sub("(?)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+class QueryStats:
+    def __init__(self, sql, origin):
+        self.sql = sql
+        self.origin = origin
+        self.count = 0
+        self.duration = 0.0
+
+
+class QueryWatcher:
+    """Обертка connection.execute_wrapper, собирающая отпечатки."""
+
+    def __init__(self, view=None, slow_ms=None, duplicates=None):
+        if slow_ms is None:
+            slow_ms = settings.POSTS_QUERYWATCH_SLOW_MS
+        if duplicates is None:
+            duplicates = settings.POSTS_QUERYWATCH_DUPLICATES
+        self.view = view
+        self.slow = slow_ms / 1000
+        self.threshold = duplicates
+        self.queries = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            shape = fingerprint(sql)
+            stats = self.queries.get(shape)
+            if stats is None:
+                stats = self.queries[shape] = QueryStats(sql, origin())
+            stats.count += 1
+            stats.duration += duration
+            if duration >= self.slow:
+                logger.warning("Медленный запрос %.1f мс в %s (%s): %s",
+                               duration * 1000, self.view, origin(), sql)
+
+    def duplicates(self):
+        return [stats for stats in self.queries.values()
+                if stats.count >= self.threshold]
+
+    def report(self, raise_errors=False):
+        duplicates = self.duplicates()
+        messages = [
+            f"{stats.count} одинаковых запросов в {self.view} "
+            f"({stats.origin}): {stats.sql}"
+            for stats in duplicates
+        ]
+        for message in messages:
+            logger.warning(message)
+        if raise_errors and messages:
+            raise DuplicateQueriesError("\n".join(messages))
+
+
+@contextlib.contextmanager
+def watch_queries(view=None, raise_errors=False, **options):
+    """Следить за запросами внутри блока; по выходу сообщить о
+    повторах, а с raise_errors — упасть на них."""
+    watcher = QueryWatcher(view, **options)
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(watcher))
+        yield watcher
+    watcher.report(raise_errors)
+
+
+def origin():
+    """Строка кода проекта и строка шаблона, откуда выполнен запрос."""
+    code = template = None
+    frame = sys._getframe(1)
+    while frame is not None and (code is None or template is None):
+        node = frame.f_locals.get("self")
+        if (template is None and frame.f_code.co_name == "render_annotated"
+                and isinstance(node, Node) and node.token is not None):
+            template = f"{node.origin.template_name}:{node.token.lineno}"
+        filename = frame.f_code.co_filename
+        if code is None and _is_project_file(filename):
+            path = os.path.relpath(filename, settings.BASE_DIR)
+            code = f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return ", ".join(filter(None, (code, template))) or "?"
+
+
+def _is_project_file(filename):
+    return (filename.startswith(settings.BASE_DIR)
+            and filename != __file__
+            and "site-packages" not in filename)
+
+
+class QueryWatchMiddleware:
+    def __init__(self, get_response):
+        if not settings.POSTS_QUERYWATCH_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with watch_queries(request.path,
+                           settings.POSTS_QUERYWATCH_RAISE) as watcher:
+            request.query_watcher = watcher
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_watcher.view = (
+            f"{view_func.__module__}.{view_func.__name__}"
+        )
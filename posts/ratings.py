@@ -0,0 +1,107 @@
+"""Инкрементальный учет оценок постов.
+
+Голос меняет сумму и число оценок поста выражениями F() в той же
+транзакции, что и строку PostRate, поэтому его стоимость не зависит
+от количества оценок, а параллельные голоса не теряют обновления.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .cache import touch_post
+from .models import Post, PostRate
+
+
+def rate_post(post_id, user_id, rate, author_id=None, group_id=None):
+    """Поставить или изменить оценку пользователя посту.
+
+    Автора и группу поста можно передать, если они уже известны: тогда
+    сброс кеша не будет искать их в базе.
+    """
+    with transaction.atomic():
+        # Транзакция начинается с записи: в SQLite транзакция, начатая
+        # чтением, не ждет блокировку записи (busy_timeout), а сразу
+        # падает с «database is locked», если пишет другой процесс
+        try:
+            with transaction.atomic():
+                PostRate.objects.create(post_id=post_id, user_id=user_id,
+                                        rate=rate)
+        except IntegrityError:
+            # Пользователь уже голосовал за пост, в том числе
+            # параллельным запросом. FOR UPDATE держит строку голоса до
+            # конца транзакции в PostgreSQL; SQLite его не поддерживает,
+            # но там запись уже сериализована блокировкой, взятой INSERT
+            votes = PostRate.objects.select_for_update().filter(
+                post_id=post_id, user_id=user_id
+            )
+            previous = votes.values_list("rate", flat=True).get()
+            votes.update(rate=rate)
+            Post.objects.filter(pk=post_id).update(
+                rate_sum=F("rate_sum") + rate - previous
+            )
+        else:
+            Post.objects.filter(pk=post_id).update(
+                rate_sum=F("rate_sum") + rate,
+                rate_count=F("rate_count") + 1,
+            )
+    touch_post(post_id, author_id, group_id)
+
+
+def apply_rates(votes):
+    """Записать пачку голосов {(post_id, user_id): rate} одним набором
+    запросов: чтение прежних голосов, вставка новых, правка измененных
+    и по одному UPDATE сумм на пост.
+
+    Вызывается внутри транзакции; при гонке с одиночным голосом того
+    же пользователя вставка падает с IntegrityError, и пачку нужно
+    записать заново по одному голосу через rate_post.
+    """
+    if not votes:
+        return
+    post_ids = {post_id for post_id, _ in votes}
+    user_ids = {user_id for _, user_id in votes}
+    existing = {
+        (post_id, user_id): rate
+        for post_id, user_id, rate in PostRate.objects.filter(
+            post_id__in=post_ids, user_id__in=user_ids
+        ).values_list("post_id", "user_id", "rate")
+        if (post_id, user_id) in votes
+    }
+
+    PostRate.objects.bulk_create(
+        PostRate(post_id=post_id, user_id=user_id, rate=rate)
+        for (post_id, user_id), rate in votes.items()
+        if (post_id, user_id) not in existing
+    )
+    deltas = {}
+    for (post_id, user_id), rate in votes.items():
+        rate_sum, rate_count = deltas.get(post_id, (0, 0))
+        if (post_id, user_id) in existing:
+            previous = existing[post_id, user_id]
+            if previous == rate:
+                continue
+            PostRate.objects.filter(post_id=post_id,
+                                    user_id=user_id).update(rate=rate)
+            deltas[post_id] = (rate_sum + rate - previous,
+                               rate_count)
+        else:
+            deltas[post_id] = (rate_sum + rate, rate_count + 1)
+
+    for post_id, (rate_sum, rate_count) in deltas.items():
+        Post.objects.filter(pk=post_id).update(
+            rate_sum=F("rate_sum") + rate_sum,
+            rate_count=F("rate_count") + rate_count,
+        )
+
+
+def recount_ratings():
+    """Пересчитать сумму и число оценок всех постов по PostRate."""
+    votes = PostRate.objects.filter(post=OuterRef("pk")).order_by().values(
+        "post"
+    )
+    total = votes.annotate(total=Sum("rate")).values("total")
+    count = votes.annotate(count=Count("pk")).values("count")
+    return Post.objects.update(
+        rate_sum=Coalesce(Subquery(total, output_field=IntegerField()), 0),
+        rate_count=Coalesce(Subquery(count, output_field=IntegerField()), 0),
+    )
@@ -0,0 +1,219 @@
+"""Полнотекстовый поиск по постам.
+
+На SQLite с FTS5 текст постов дублируется в виртуальную таблицу
+posts_post_fts (rowid = id поста) и ранжируется по bm25. На других
+базах или без FTS5 используется инвертированный индекс SearchToken,
+который строится на Python. Оба индекса поддерживаются сигналами
+Post, так что поиск не сканирует posts_post через LIKE.
+"""
+import collections
+import re
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.expressions import RawSQL
+
+from .models import Post, SearchToken
+
+FTS_TABLE = "posts_post_fts"
+MAX_TERMS = 10
+TERM_LENGTH = SearchToken._meta.get_field("term").max_length
+
+_fts_enabled = {}
+
+
+def tokenize(text):
+    return [word[:TERM_LENGTH] for word in re.findall(r"\w+", text.lower())]
+
+
+def query_terms(query):
+    """Уникальные слова запроса в исходном порядке."""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+
+
+def fts_enabled():
+    alias = connection.alias
+    if alias not in _fts_enabled:
+        _fts_enabled[alias] = (
+            connection.vendor == "sqlite"
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_enabled[alias]
+
+
+def create_fts_table(using="default", **kwargs):
+    """Обработчик post_migrate: создать таблицу FTS5, если база умеет,
+    и заполнить ее уже существующими постами."""
+    from django.db import connections
+
+    db = connections[using]
+    if (db.vendor != "sqlite"
+            or FTS_TABLE in db.introspection.table_names()):
+        return
+    try:
+        with transaction.atomic(using=using), db.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} "
+                f"USING fts5(text, tokenize='unicode61 remove_diacritics 2')"
+            )
+            # Посты, написанные до появления таблицы, иначе не нашлись
+            # бы до rebuild_search_index
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, text) "
+                f"SELECT id, text FROM {Post._meta.db_table}"
+            )
+    except OperationalError:
+        # SQLite собран без FTS5 — остается запасной индекс
+        pass
+    _fts_enabled.pop(using, None)
+
+
+def index_post(post):
+    if fts_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                           [post.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)",
+                [post.pk, post.text]
+            )
+        return
+
+    weights = collections.Counter(tokenize(post.text))
+    with transaction.atomic():
+        SearchToken.objects.filter(post_id=post.pk).delete()
+        SearchToken.objects.bulk_create(
+            SearchToken(term=term, post_id=post.pk, weight=weight)
+            for term, weight in weights.items()
+        )
+
+
+def unindex_post(post_id):
+    # Строки SearchToken удаляются каскадом вместе с постом
+    if fts_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                           [post_id])
+
+
+def rebuild_index():
+    """Переиндексировать все посты; возвращает их число."""
+    if fts_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, text) "
+                f"SELECT id, text FROM {Post._meta.db_table}"
+            )
+        return Post.objects.count()
+
+    SearchToken.objects.all().delete()
+    count = 0
+    for post in Post.objects.only("id", "text").iterator():
+        index_post(post)
+        count += 1
+    return count
+
+
+def _match_expression(terms):
+    return " ".join('"{}"'.format(term.replace('"', '""'))
+                    for term in terms)
+
+
+def matching_post_ids(query):
+    """Подзапрос id постов, содержащих все слова запроса."""
+    terms = query_terms(query)
+    if not terms:
+        return Post.objects.none().values("id")
+    if fts_enabled():
+        return RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+            [_match_expression(terms)]
+        )
+    return (
+        SearchToken.objects.filter(term__in=terms)
+        .values("post_id")
+        .annotate(matched=Count("term"))
+        .filter(matched=len(terms))
+        .values("post_id")
+    )
+
+
+class SearchResults:
+    """Ранжированная выдача, которую можно отдать в Paginator: считает
+    общее число совпадений и выбирает посты только для среза."""
+
+    def __init__(self, query, group=None, author=None):
+        self.terms = query_terms(query)
+        self.group = group
+        self.author = author
+
+    def count(self):
+        if not self.terms:
+            return 0
+        if fts_enabled():
+            sql, params = self._fts_sql("COUNT(*)")
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchone()[0]
+        return self._token_ranking().count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start = index.start or 0
+        if not self.terms or index.stop is None or index.stop <= start:
+            return []
+
+        ids = self._ranked_ids(start, index.stop - start)
+        posts = Post.objects.feed().in_bulk(ids)
+        return [posts[post_id] for post_id in ids if post_id in posts]
+
+    def _ranked_ids(self, offset, limit):
+        if fts_enabled():
+            sql, params = self._fts_sql(
+                "p.id",
+                f"ORDER BY bm25({FTS_TABLE}), p.pub_date DESC "
+                f"LIMIT %s OFFSET %s"
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params + [limit, offset])
+                return [row[0] for row in cursor.fetchall()]
+        ranking = self._token_ranking().values_list("id", flat=True)
+        return list(ranking[offset:offset + limit])
+
+    def _fts_sql(self, columns, tail=""):
+        where = [f"{FTS_TABLE} MATCH %s"]
+        params = [_match_expression(self.terms)]
+        if self.group is not None:
+            where.append("p.group_id = %s")
+            params.append(self.group.pk)
+        if self.author is not None:
+            where.append("p.author_id = %s")
+            params.append(self.author.pk)
+        sql = (
+            f"SELECT {columns} FROM {FTS_TABLE} "
+            f"JOIN {Post._meta.db_table} p ON p.id = {FTS_TABLE}.rowid "
+            f"WHERE {' AND '.join(where)} {tail}"
+        )
+        return sql, params
+
+    def _token_ranking(self):
+        posts = Post.objects.filter(search_tokens__term__in=self.terms)
+        if self.group is not None:
+            posts = posts.filter(group=self.group)
+        if self.author is not None:
+            posts = posts.filter(author=self.author)
+        return (
+            posts.annotate(matched=Count("search_tokens"),
+                           rank=Sum("search_tokens__weight"))
+            .filter(matched=len(self.terms))
+            .order_by("-rank", "-pub_date")
+        )
+
+
+def search_posts(query, group=None, author=None):
+    return SearchResults(query, group=group, author=author)
@@ -0,0 +1,148 @@
+import functools
+
+from django.db import transaction
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import search, timeline
+from .cache import bump_feed_versions, touch_post
+from .models import (Comment, Follow, Group, Post, PostRate, ProfileStats,
+                     User)
+from .stats import adjust_stats
+from .storage import release_image
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+
+
+@receiver(post_init, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    instance._loaded_group_id = instance.group_id
+    instance._loaded_image = _image_name(instance)
+
+
+def _image_name(post):
+    # Из __dict__, а не через дескриптор: у выборок only() картинка
+    # отложена, и чтение поля стоило бы запроса. Еще не сохраненная
+    # загрузка файлом в хранилище не считается
+    image = post.__dict__.get("image")
+    if isinstance(image, str):
+        return image or None
+    if isinstance(image, FieldFile) and image._committed:
+        return image.name or None
+    return None
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def release_replaced_image(sender, instance, raw=False, **kwargs):
+    """Картинка, на которую больше не ссылается ни один пост,
+    удаляется после фиксации транзакции."""
+    if raw:
+        return
+    loaded = instance._loaded_image
+    current = _image_name(instance)
+    if kwargs["signal"] is post_delete:
+        loaded, current = current or loaded, None
+    if loaded and loaded != current:
+        transaction.on_commit(functools.partial(release_image, loaded))
+    instance._loaded_image = current
+
+
+def _bump(func, *args):
+    """Сменить версии сейчас и еще раз после фиксации транзакции.
+
+    Запрос, пришедший между первой сменой и фиксацией, строит страницу
+    или карточку из еще не закоммиченных данных и сохраняет старое под
+    новой версией; смена версии после фиксации эту запись отбрасывает.
+    """
+    func(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(functools.partial(func, *args))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post(sender, instance, **kwargs):
+    _bump(touch_post, instance.pk, instance.author_id, instance.group_id)
+    # Пост перенесли в другую группу: старая лента тоже устарела
+    loaded_group_id = getattr(instance, "_loaded_group_id", None)
+    if loaded_group_id not in (None, instance.group_id):
+        _bump(bump_feed_versions, f"group:{loaded_group_id}")
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=PostRate)
+@receiver(post_delete, sender=PostRate)
+def invalidate_parent_post(sender, instance, **kwargs):
+    _bump(touch_post, instance.post_id)
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    _bump(bump_feed_versions, f"group:{instance.pk}")
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_profiles(sender, instance, **kwargs):
+    _bump(bump_feed_versions, f"author:{instance.author_id}",
+          f"author:{instance.user_id}")
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline_on_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.add_follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clear_timeline_on_unfollow(sender, instance, **kwargs):
+    timeline.remove_follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def create_profile_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ProfileStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    adjust_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust_stats(instance.author_id, followers_count=1)
+        adjust_stats(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_unfollow(sender, instance, **kwargs):
+    adjust_stats(instance.author_id, followers_count=-1)
+    adjust_stats(instance.user_id, following_count=-1)
@@ -0,0 +1,69 @@
+"""Настройка соединений SQLite.
+
+По умолчанию SQLite ведет журнал отката: пока идет пишущая транзакция
+(оценка, комментарий), читатели ждут ее конца, а долгое чтение не дает
+записи завершиться. configure_connection на каждое новое соединение
+выполняет PRAGMA из POSTS_SQLITE_PRAGMAS:
+
+- journal_mode=WAL — читатели и писатель не блокируют друг друга,
+  читатели видят последнее закоммиченное состояние;
+- synchronous=NORMAL — в режиме WAL fsync только на контрольной точке,
+  целостность сохраняется, теряются лишь последние транзакции при
+  отключении питания;
+- mmap_size — страницы читаются через отображение файла в память без
+  копирования в кеш страниц SQLite;
+- cache_size — размер кеша страниц соединения (отрицательное — в КиБ);
+- busy_timeout — сколько миллисекунд ждать блокировку записи, прежде
+  чем отдать «database is locked».
+
+Для базы в памяти (тестовой) режим журнала не меняется: WAL ей
+недоступен. Другие СУБД соединение не трогает.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Режим журнала хранится в файле базы, остальные PRAGMA — в соединении
+PERSISTENT_PRAGMAS = ("journal_mode",)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """Приемник connection_created: применить POSTS_SQLITE_PRAGMAS."""
+    if connection.vendor != "sqlite":
+        return
+    in_memory = connection.is_in_memory_db()
+    # Запросы идут мимо курсора Django: они не попадают в счетчики
+    # запросов и обертки execute_wrappers
+    for name, value in pragma_statements(settings.POSTS_SQLITE_PRAGMAS):
+        if in_memory and name in PERSISTENT_PRAGMAS:
+            continue
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+def pragma_statements(pragmas):
+    """Пары (имя, значение) PRAGMA с проверкой: значения подставляются
+    в SQL как есть."""
+    statements = []
+    for name, value in (pragmas or {}).items():
+        if not re.fullmatch(r"[a-z_]+", name):
+            raise ImproperlyConfigured(f"Недопустимая PRAGMA {name!r}")
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ImproperlyConfigured(
+                f"PRAGMA {name}: ожидается число или слово, а не {value!r}"
+            )
+        if isinstance(value, str) and not re.fullmatch(r"\w+", value):
+            raise ImproperlyConfigured(
+                f"PRAGMA {name}: недопустимое значение {value!r}"
+            )
+        statements.append((name, value))
+    return statements
+
+
+def current_pragmas(connection, names):
+    """Текущие значения PRAGMA соединения — для проверки и отчетов."""
+    connection.ensure_connection()
+    return {
+        name: connection.connection.execute(f"PRAGMA {name}").fetchone()[0]
+        for name in names
+    }
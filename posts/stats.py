@@ -0,0 +1,98 @@
+"""Денормализованные счетчики профилей.
+
+Страницы профиля и поста показывают число подписчиков, подписок и
+записей автора. Вместо трех COUNT(*) на каждый показ счетчики лежат
+в ProfileStats и меняются выражениями F() при подписке, отписке,
+публикации и удалении поста. Строка создается вместе с пользователем;
+если ее нет (пользователь заведен до появления счетчиков), она
+собирается из таблиц при первом чтении.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import (BooleanField, Count, Exists, F, OuterRef,
+                              Subquery, Value)
+
+from .models import Follow, Post, ProfileStats, User
+
+BATCH_SIZE = 500
+
+
+def adjust_stats(user_id, **deltas):
+    """Изменить счетчики пользователя на deltas, например
+    adjust_stats(user_id, posts_count=1).
+
+    Отсутствующую строку не создает: она соберется при чтении, а при
+    каскадном удалении пользователя создавать ее нельзя.
+    """
+    ProfileStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+def count_stats(user_id):
+    return {
+        "followers_count": Follow.objects.filter(author_id=user_id).count(),
+        "following_count": Follow.objects.filter(user_id=user_id).count(),
+        "posts_count": Post.objects.filter(author_id=user_id).count(),
+    }
+
+
+def get_stats(user):
+    """Счетчики пользователя; если строки нет — посчитать и сохранить."""
+    try:
+        return user.stats
+    except ProfileStats.DoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            stats = ProfileStats.objects.create(user=user,
+                                                **count_stats(user.pk))
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        stats = ProfileStats.objects.get(user=user)
+    user.stats = stats
+    return stats
+
+
+def profile_summaries(viewer=None):
+    """Пользователи вместе со счетчиками профиля и признаком
+    is_following (подписан ли на пользователя viewer).
+
+    Сводка для шапки профиля и страницы поста читается одним
+    запросом: счетчики берутся соединением с ProfileStats, подписка —
+    подзапросом EXISTS. Если строки счетчиков нет, get_stats соберет ее.
+    """
+    users = User.objects.select_related("stats")
+    if viewer is None or not viewer.is_authenticated:
+        return users.annotate(
+            is_following=Value(False, output_field=BooleanField())
+        )
+    return users.annotate(is_following=Exists(
+        Follow.objects.filter(user=viewer, author=OuterRef("pk"))
+    ))
+
+
+def _count(model, field):
+    rows = (model.objects.filter(**{field: OuterRef("pk")}).order_by()
+            .values(field).annotate(count=Count("pk")).values("count"))
+    return Subquery(rows)
+
+
+def rebuild_profile_stats():
+    """Пересчитать счетчики всех пользователей; возвращает их число."""
+    users = User.objects.annotate(
+        followers_total=_count(Follow, "author"),
+        following_total=_count(Follow, "user"),
+        posts_total=_count(Post, "author"),
+    ).values_list("pk", "followers_total", "following_total",
+                  "posts_total")
+
+    with transaction.atomic():
+        ProfileStats.objects.all().delete()
+        stats = (ProfileStats(user_id=pk,
+                              followers_count=followers or 0,
+                              following_count=following or 0,
+                              posts_count=posts or 0)
+                 for pk, followers, following, posts in users.iterator())
+        created = ProfileStats.objects.bulk_create(stats,
+                                                   batch_size=BATCH_SIZE)
+    return len(created)
@@ -0,0 +1,183 @@
+"""Хранилище картинок постов по хешу содержимого.
+
+Файл сохраняется под именем из SHA-256 содержимого внутри каталога
+upload_to: posts/ab/ab12….webp. Одинаковые картинки, сколько бы раз их
+ни загружали, занимают один файл, и sorl режет для них одни миниатюры.
+Ссылками на файл считаются посты с этим именем в Post.image: когда
+последний такой пост удален или сменил картинку, release_image удаляет
+файл вместе с миниатюрами и записями sorl.
+
+Сохранение и release_image берут одну строку-замок StoredImage до конца
+своей транзакции. Иначе загрузка такой же картинки могла бы увидеть
+файл, вернуть его имя без записи и закоммитить пост уже после того,
+как release_image не нашел ссылок и удалил файл. С замком удаление либо
+ждет коммита поста и видит ссылку, либо заканчивается раньше, и
+загрузка пишет файл заново. Пост с картинкой сохраняется в той же
+транзакции, что и файл: представления пишут посты в transaction.atomic.
+
+find_orphans и prune_orphans (команда prune_thumbnails) находят
+миниатюры, оставшиеся от удаленных картинок, и картинки без постов.
+"""
+import hashlib
+import json
+import os
+import posixpath
+
+from django.core.files import File
+from django.db import transaction
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        with transaction.atomic():
+            lock_image(name)
+            if self.exists(name):
+                return name
+            return super().save(name, content, max_length)
+
+    def content_name(self, name, content):
+        """Имя файла по хешу содержимого в каталоге исходного имени."""
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def restore(self, name, content):
+        """Сохранить файл под заданным именем, как при переносе данных:
+        записи постов уже ссылаются на него."""
+        if self.exists(name):
+            return name
+        return super().save(name, content)
+
+
+post_images = ContentAddressedStorage()
+
+
+def lock_image(name):
+    """Взять строку-замок картинки до конца текущей транзакции.
+
+    Замок берется UPDATE, а не select_for_update: SQLite не знает
+    FOR UPDATE, а запись держит его блокировку так же до коммита.
+    Если строку удалили, пока мы ее ждали, она создается заново.
+    """
+    from .models import StoredImage
+
+    locked = 0
+    while not locked:
+        StoredImage.objects.get_or_create(name=name)
+        locked = StoredImage.objects.filter(name=name).update(name=name)
+
+
+def release_image(name):
+    """Удалить картинку и ее миниатюры, если на нее не ссылается ни
+    один пост. Возвращает True, если картинка удалена.
+
+    Трогаются только файлы каталога upload_to: в поле могут лежать и
+    пути, записанные в обход формы.
+    """
+    from .models import Post, StoredImage
+
+    upload_to = Post._meta.get_field("image").upload_to
+    if not name or not name.startswith(upload_to):
+        return False
+    with transaction.atomic():
+        lock_image(name)
+        if Post.objects.filter(image=name).exists():
+            return False
+        image = ImageFile(name, post_images)
+        default.kvstore.delete(image)
+        post_images.delete(name)
+        StoredImage.objects.filter(name=name).delete()
+    return True
+
+
+def find_orphans():
+    """Картинки и миниатюры, на которые не ссылается ни один пост.
+
+    Возвращает (images, thumbnails): имена картинок в хранилище
+    постов и имена файлов миниатюр в хранилище sorl.
+    """
+    from .models import Post
+
+    live = _live_images()
+    upload_to = Post._meta.get_field("image").upload_to
+    images = [name for name in _walk(post_images, upload_to)
+              if name not in live]
+
+    records, thumbnails = _kvstore_records()
+    keep = {
+        records[key].name
+        for source_key, keys in thumbnails.items()
+        if source_key in records and records[source_key].name in live
+        for key in keys if key in records
+    }
+    files = _walk(default.storage, sorl_settings.THUMBNAIL_PREFIX)
+    return sorted(images), sorted(set(files) - keep)
+
+
+def prune_orphans():
+    """Удалить картинки без постов и миниатюры вместе с записями sorl;
+    возвращает удаленные картинки и миниатюры, как find_orphans."""
+    images, thumbnails = find_orphans()
+    live = _live_images()
+    records, sources = _kvstore_records()
+    # Сначала записи sorl об удаленных картинках: kvstore.delete
+    # удаляет и файлы их миниатюр, и кеш записей
+    for key in sources:
+        if key in records and records[key].name not in live:
+            default.kvstore.delete(records[key])
+    # Картинки — через release_image: под замком она еще раз проверяет,
+    # что пост с такой картинкой не появился после find_orphans
+    images = [name for name in images if release_image(name)]
+    for name in thumbnails:
+        default.storage.delete(name)
+    return images, thumbnails
+
+
+def _live_images():
+    from .models import Post
+
+    return set(Post.objects.exclude(image="").exclude(image=None)
+               .values_list("image", flat=True).distinct().iterator())
+
+
+def _walk(storage, directory):
+    """Все файлы каталога хранилища, включая подкаталоги."""
+    directory = directory.rstrip("/")
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for filename in files:
+        yield posixpath.join(directory, filename)
+    for subdirectory in directories:
+        yield from _walk(storage, posixpath.join(directory, subdirectory))
+
+
+def _kvstore_records():
+    """Файлы sorl по ключам и ключи миниатюр по ключам исходных
+    картинок — одним проходом по таблице хранилища."""
+    image_prefix = add_prefix("", "image")
+    thumbnails_prefix = add_prefix("", "thumbnails")
+    records, thumbnails = {}, {}
+    rows = KVStoreModel.objects.values_list("key", "value").iterator()
+    for key, value in rows:
+        if key.startswith(image_prefix):
+            records[key[len(image_prefix):]] = deserialize_image_file(value)
+        elif key.startswith(thumbnails_prefix):
+            thumbnails[key[len(thumbnails_prefix):]] = json.loads(value)
+    return records, thumbnails
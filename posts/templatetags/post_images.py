@@ -0,0 +1,10 @@
+from django import template
+
+from posts.thumbnails import card_srcset as build_card_srcset
+
+register = template.Library()
+
+
+@register.simple_tag
+def card_srcset(image, crop):
+    return build_card_srcset(image, crop)
@@ -0,0 +1,179 @@
+import asyncio
+import importlib
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.test import (RequestFactory, TransactionTestCase,
+                         override_settings)
+from django.urls import clear_url_caches, resolve
+from django.utils.functional import SimpleLazyObject
+
+import posts.urls
+import yatube.urls
+from posts import async_views, benchmark, views
+from posts.models import Comment, Follow, Group, Post
+
+
+@override_settings(POSTS_PAGE_CACHE_TIMEOUT=0)
+class AsyncViewsTests(TransactionTestCase):
+    # Запросы к базе идут из потоков пула со своими соединениями, им
+    # нужны закоммиченные данные
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.author = get_user_model().objects.create(username="Writer")
+        self.reader = get_user_model().objects.create(username="Reader")
+        self.group = Group.objects.create(title="Асинхронная", slug="async")
+        for number in range(12):
+            self.post = Post.objects.create(
+                text=f"Асинхронный пост {number}", author=self.author,
+                group=self.group,
+            )
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Комментарий из потока")
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def call(self, view, path="/", user=None, **kwargs):
+        request = self.factory.get(path, **kwargs.pop("headers", {}))
+        request.user = user or AnonymousUser()
+        return async_to_sync(view)(request, **kwargs)
+
+    def test_views_render_feeds(self):
+        """Асинхронные представления отдают те же ленты, что и
+        синхронные"""
+        cases = {
+            "index": (async_views.index, {}),
+            "group": (async_views.group_posts, {"slug": "async"}),
+            "profile": (async_views.profile, {"username": "Writer"}),
+            "follow": (async_views.follow_index, {}),
+        }
+        for name, (view, kwargs) in cases.items():
+            with self.subTest(view=name):
+                response = self.call(view, user=self.reader, **kwargs)
+
+                self.assertEqual(response.status_code, 200)
+                content = response.content.decode()
+                self.assertIn("Асинхронный пост 11", content)
+                self.assertNotIn("Асинхронный пост 0", content)
+
+    def test_second_page_and_page_past_end(self):
+        """Вторая страница и номер за концом ленты отдают последние
+        посты"""
+        for page in ("2", "99"):
+            with self.subTest(page=page):
+                response = self.call(async_views.index, f"/?page={page}")
+
+                self.assertContains(response, "Асинхронный пост 0")
+                self.assertNotContains(response, "Асинхронный пост 11")
+
+    def test_profile_follow_state(self):
+        """Профиль показывает подписку читателя и число подписчиков"""
+        response = self.call(async_views.profile, user=self.reader,
+                             username="Writer")
+
+        self.assertContains(response, "Отписаться")
+        self.assertContains(response, "Подписчиков: 1")
+
+    def test_post_view_with_comments(self):
+        """Страница поста собирает автора, пост и комментарии"""
+        response = self.call(async_views.post_view, user=self.reader,
+                             username="Writer", post_id=self.post.pk)
+
+        self.assertContains(response, "Комментарий из потока")
+        self.assertContains(response, "Записей: 12")
+        with self.assertRaises(Http404):
+            self.call(async_views.post_view, username="Reader",
+                      post_id=self.post.pk)
+
+    def test_conditional_get(self):
+        """Неизменная страница отдает 304 по ETag"""
+        etag = self.call(async_views.index)["ETag"]
+
+        response = self.call(async_views.index,
+                             headers={"HTTP_IF_NONE_MATCH": etag})
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_index_requires_login(self):
+        """Лента подписок отправляет анонима на вход"""
+        response = self.call(async_views.follow_index, "/follow/")
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("/auth/login/?next=/follow/", response.url)
+
+    @override_settings(POSTS_PAGE_CACHE_TIMEOUT=600)
+    def test_anonymous_pages_come_from_page_cache(self):
+        """Анонимная страница рендерится один раз на версию ленты"""
+        first = self.call(async_views.group_posts, slug="async")
+        Post.objects.filter(pk=self.post.pk).update(text="Без сигналов")
+
+        second = self.call(async_views.group_posts, slug="async")
+
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, "Асинхронный пост 11")
+
+    @override_settings(POSTS_PAGE_CACHE_TIMEOUT=600)
+    def test_page_cache_check_reads_user_off_the_loop(self):
+        """Проверка кеша страниц читает ленивого пользователя в потоке,
+        а не в цикле событий"""
+        @async_views.conditional(lambda request: "feed",
+                                 lambda request: None, views.index)
+        async def view(request):
+            return HttpResponse("Свежая страница")
+
+        request = self.factory.get("/")
+        request.user = SimpleLazyObject(
+            lambda: get_user_model().objects.get(username="Reader")
+        )
+        response = async_to_sync(view)(request)
+
+        self.assertContains(response, "Свежая страница")
+
+
+@override_settings(POSTS_PAGE_CACHE_TIMEOUT=0)
+class AsyncRoutingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        author = get_user_model().objects.create(username="Routed")
+        Post.objects.create(text="Пост по маршруту ASGI", author=author)
+        self.route(True)
+        self.addCleanup(self.route, settings.POSTS_ASYNC_VIEWS)
+
+    def route(self, enabled):
+        # posts.urls выбирает представления при импорте
+        with override_settings(POSTS_ASYNC_VIEWS=enabled):
+            importlib.reload(posts.urls)
+        importlib.reload(yatube.urls)
+        clear_url_caches()
+
+    def test_urls_route_to_coroutines(self):
+        """С POSTS_ASYNC_VIEWS ленты обслуживают корутины"""
+        self.assertTrue(asyncio.iscoroutinefunction(resolve("/").func))
+
+        response = self.client.get("/")
+
+        self.assertContains(response, "Пост по маршруту ASGI")
+
+
+class ConcurrencyBenchmarkTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_compares_sync_and_async_views(self):
+        """Стенд сравнивает синхронные и асинхронные чтения"""
+        benchmark.generate_data(users=5, groups=2, posts=30, comments=20,
+                                follows=10, rates=10)
+
+        results = benchmark.run_concurrency_benchmark(requests=3,
+                                                      delay=0.001)
+
+        self.assertEqual(set(results), {"index", "index_last_page",
+                                        "group", "profile", "post",
+                                        "follow"})
+        for name, metrics in results.items():
+            with self.subTest(scenario=name):
+                self.assertLess(metrics["status"], 400)
+                self.assertGreater(metrics["speedup"], 0)
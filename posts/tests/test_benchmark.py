@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from posts import benchmark
+from posts.models import Comment, Post, ProfileStats, User
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_generated_data_is_complete(self):
+        """Генератор создает связанные данные и пересобирает счетчики"""
+        counts = benchmark.generate_data(users=5, groups=2, posts=30,
+                                         comments=20, follows=10, rates=10)
+
+        self.assertEqual(counts["posts"], 30)
+        self.assertEqual(Post.objects.count(), 30)
+        self.assertEqual(Comment.objects.count(), 20)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(
+            sum(ProfileStats.objects.values_list("posts_count", flat=True)),
+            30,
+        )
+
+    def test_run_reports_metrics_for_every_scenario(self):
+        """Прогон отдает метрики по всем сценариям без ошибок"""
+        benchmark.generate_data(users=5, groups=2, posts=30, comments=20,
+                                follows=10, rates=10)
+
+        results = benchmark.run_benchmark(requests=3, warmup=1)
+
+        self.assertIn("follow", results)
+        for name, metrics in results.items():
+            with self.subTest(scenario=name):
+                self.assertLess(metrics["status"], 400)
+                self.assertGreater(metrics["queries"], 0)
+                self.assertLessEqual(metrics["p50_ms"], metrics["p95_ms"])
+
+    def test_compare_finds_regressions(self):
+        """Сравнение ловит рост p95 и числа запросов"""
+        baseline = {"index": {"p95_ms": 10, "queries": 2}}
+
+        self.assertEqual(benchmark.compare(
+            {"index": {"p95_ms": 11, "queries": 2}}, baseline), [])
+        self.assertEqual(len(benchmark.compare(
+            {"index": {"p95_ms": 13, "queries": 3}}, baseline)), 2)
+        self.assertEqual(benchmark.percentile([3, 1, 2, 4], 50), 2)
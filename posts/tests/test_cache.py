@@ -0,0 +1,189 @@
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.cache import COMPUTE_LOCK_KEY, feed_versions, get_or_compute
+from posts.models import Follow, Post
+
+
+class GetOrComputeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value="новое"):
+        self.calls += 1
+        return value
+
+    def test_value_is_computed_once(self):
+        """Значение вычисляется один раз и дальше берется из кеша"""
+        for _ in range(3):
+            self.assertEqual(get_or_compute("key", self.compute, 60),
+                             "новое")
+
+        self.assertEqual(self.calls, 1)
+
+    def test_expiring_entry_is_refreshed_early(self):
+        """Дорогая запись у конца срока пересчитывается заранее"""
+        cache.set("cheap", ("старое", 0.0, time.time() + 60))
+        cache.set("slow", ("старое", 100.0, time.time() + 60))
+
+        with mock.patch("posts.cache.random.random", return_value=0.5):
+            self.assertEqual(get_or_compute("cheap", self.compute, 60),
+                             "старое")
+            self.assertEqual(get_or_compute("slow", self.compute, 60),
+                             "новое")
+
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_is_served_during_recompute(self):
+        """Пока другой запрос пересчитывает, отдается прошлое значение"""
+        cache.set("page:1", ("прошлая версия", 0.0, None))
+        cache.set(COMPUTE_LOCK_KEY.format("page:2"), 1)
+
+        value = get_or_compute("page:2", self.compute, 60,
+                               stale_key="page:1")
+
+        self.assertEqual(value, "прошлая версия")
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(POSTS_CACHE_LOCK_TIMEOUT=0.2)
+    def test_abandoned_lock_does_not_block_forever(self):
+        """Без значения и пересчета запрос ждет не дольше блокировки"""
+        cache.set(COMPUTE_LOCK_KEY.format("key"), 1)
+
+        self.assertEqual(get_or_compute("key", self.compute, 60), "новое")
+        self.assertEqual(self.calls, 1)
+
+    def test_uncacheable_values_are_not_stored(self):
+        """Значения, отвергнутые cacheable, не сохраняются"""
+        for _ in range(2):
+            get_or_compute("key", self.compute, 60,
+                           cacheable=lambda value: False)
+
+        self.assertEqual(self.calls, 2)
+
+    @override_settings(CACHES={"default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }})
+    def test_concurrent_misses_compute_once(self):
+        """Одновременные промахи вычисляют значение один раз"""
+        def slow():
+            time.sleep(0.2)
+            return self.compute()
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(get_or_compute("key", slow, 60))
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["новое"] * 5)
+        self.assertEqual(self.calls, 1)
+
+
+class FeedCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Counted")
+        Post.objects.bulk_create(
+            Post(text=f"Пост {number}", author=cls.author)
+            for number in range(12)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query["sql"] for query in queries
+                          if "COUNT(*)" in query["sql"]]
+
+    def test_feed_count_is_cached_until_feed_changes(self):
+        """Число постов ленты считается заново только после записи"""
+        url = reverse("posts:index")
+        self.client.get(url)
+
+        response, counts = self.count_queries(url)
+        self.assertEqual(counts, [])
+        self.assertEqual(response.context["paginator"].count, 12)
+
+        Post.objects.create(text="Еще один", author=self.author)
+        response, counts = self.count_queries(url)
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(response.context["paginator"].count, 13)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "culled",
+        "OPTIONS": {"MAX_ENTRIES": 5, "CULL_FREQUENCY": 1},
+    },
+    "versions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "versions",
+        "TIMEOUT": None,
+    },
+})
+class VersionCacheTests(TestCase):
+    def test_culling_pages_keeps_versions(self):
+        """Вытеснение страниц из кеша не трогает версии лент"""
+        versions = feed_versions("index", "author:1")
+
+        cache.set_many({f"page:{number}": "страница"
+                        for number in range(20)})
+        cache.clear()
+
+        self.assertEqual(feed_versions("index", "author:1"), versions)
+
+
+class CommitOrderTests(TransactionTestCase):
+    # Версии должны смениться уже после фиксации транзакции записи
+    def setUp(self):
+        cache.clear()
+        self.author = get_user_model().objects.create(username="Committer")
+        self.reader = get_user_model().objects.create(username="Waiter")
+
+    def test_versions_change_again_after_commit(self):
+        """Версии, прочитанные до фиксации, устаревают после нее"""
+        post = Post.objects.create(text="Пост до удаления",
+                                   author=self.author)
+        scopes = ("index", f"author:{self.author.pk}", f"post:{post.pk}",
+                  f"author:{self.reader.pk}")
+        writes = {
+            "delete": lambda: Post.objects.filter(pk=post.pk).delete(),
+            "follow": lambda: Follow.objects.create(user=self.reader,
+                                                    author=self.author),
+        }
+        for name, write in writes.items():
+            with self.subTest(write=name):
+                with transaction.atomic():
+                    write()
+                    # Так видит версии запрос, пришедший до фиксации
+                    before = feed_versions(*scopes)
+
+                after = feed_versions(*scopes)
+                self.assertEqual(
+                    [scope for scope, old, new in zip(scopes, before, after)
+                     if old == new],
+                    ["index", f"post:{post.pk}"] if name == "follow"
+                    else [f"author:{self.reader.pk}"],
+                )
@@ -0,0 +1,123 @@
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Feeder")
+        cls.other = get_user_model().objects.create(username="Other")
+        cls.group = Group.objects.create(title="Ленты", slug="feeds")
+        for number in range(3):
+            Post.objects.create(text=f"Пост ленты {number}",
+                                author=cls.author, group=cls.group)
+        Post.objects.create(text="Чужой пост", author=cls.other)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def get_feed(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if isinstance(response, StreamingHttpResponse):
+            response.text = b"".join(response.streaming_content).decode()
+        return response
+
+    def test_feeds_stream_matching_posts(self):
+        """Ленты отдаются потоком и содержат посты своей выборки"""
+        cases = {
+            reverse("posts:index_feed", args=["rss"]): 4,
+            reverse("posts:group_feed", args=["feeds", "rss"]): 3,
+            reverse("posts:profile_feed", args=["Other", "rss"]): 1,
+        }
+        for url, count in cases.items():
+            with self.subTest(url=url):
+                response = self.get_feed(url)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.streaming)
+                self.assertIn("rss", response["Content-Type"])
+                channel = ElementTree.fromstring(response.text)[0]
+                items = channel.findall("item")
+                self.assertEqual(len(items), count)
+
+        newest = Post.objects.order_by("-pub_date", "-id").first()
+        link = items[0].find("link").text
+        self.assertTrue(link.endswith(
+            reverse("posts:post", args=["Other", newest.pk])
+        ))
+
+    def test_atom_feed(self):
+        """Atom-лента отдает записи с автором и датой обновления"""
+        response = self.get_feed(
+            reverse("posts:group_feed", args=["feeds", "atom"])
+        )
+
+        root = ElementTree.fromstring(response.text)
+        entries = root.findall(f"{ATOM}entry")
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(
+            entries[0].find(f"{ATOM}author/{ATOM}name").text, "Feeder"
+        )
+        self.assertIsNotNone(root.find(f"{ATOM}updated").text)
+
+    def test_empty_feed_is_valid(self):
+        """Лента без постов — корректный документ без записей"""
+        get_user_model().objects.create(username="Silent")
+
+        response = self.get_feed(
+            reverse("posts:profile_feed", args=["Silent", "atom"])
+        )
+
+        root = ElementTree.fromstring(response.text)
+        self.assertEqual(root.findall(f"{ATOM}entry"), [])
+
+    def test_unknown_sources_return_404(self):
+        """Несуществующие группа и автор дают 404"""
+        for url in (reverse("posts:group_feed", args=["missing", "rss"]),
+                    reverse("posts:profile_feed", args=["Nobody", "rss"])):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_conditional_get(self):
+        """Неизменная лента отдает 304 без выборки постов, новая
+        запись меняет ETag"""
+        url = reverse("posts:profile_feed", args=["Feeder", "atom"])
+        etag = self.get_feed(url)["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any("posts_post" in query["sql"]
+                             for query in queries))
+
+        Comment.objects.create(post=self.author.posts.first(),
+                               author=self.other, text="Комментарий")
+        response = self.get_feed(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(POSTS_FEED_ITEMS=2)
+    def test_feed_is_limited(self):
+        """Лента отдает не больше POSTS_FEED_ITEMS записей"""
+        response = self.get_feed(reverse("posts:index_feed",
+                                         args=["atom"]))
+
+        root = ElementTree.fromstring(response.text)
+        self.assertEqual(len(root.findall(f"{ATOM}entry")), 2)
+
+    def test_feed_queries_do_not_depend_on_items(self):
+        """Лента выбирает посты одним запросом"""
+        url = reverse("posts:index_feed", args=["rss"])
+        with self.assertNumQueries(1):
+            self.get_feed(url)
@@ -1,6 +1,8 @@
+import io
 import shutil
 import tempfile
-from django.test import Client, TestCase
+from PIL import Image
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.conf import settings
@@ -138,3 +140,70 @@ class PostFormTests(TestCase):
             reverse("posts:post",
                     kwargs={"username": "AndreyT", "post_id": "2"})
         )
+
+
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="Uploader")
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def upload(self, image, name="photo.jpg", fmt="JPEG", **save_options):
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, **save_options)
+        return self.client.post(reverse("posts:new_post"), data={
+            "text": "Пост с фото",
+            "image": SimpleUploadedFile(name, buffer.getvalue()),
+        })
+
+    @override_settings(POSTS_IMAGE_STORED_SIDE=200)
+    def test_upload_is_reencoded_without_metadata(self):
+        """Картинка уменьшается, поворачивается по EXIF и
+        пересохраняется без метаданных"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90°
+        exif[0x010F] = "Камера"
+
+        self.upload(Image.new("RGB", (800, 400), "green"), exif=exif)
+
+        post = Post.objects.get(author=self.user)
+        self.assertRegex(post.image.name, r"^posts/\w\w/\w{64}\.webp$")
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.format, "WEBP")
+            self.assertEqual(stored.size, (100, 200))
+            self.assertEqual(len(stored.getexif()), 0)
+
+    @override_settings(POSTS_IMAGE_FORMAT="JPEG")
+    def test_transparent_upload_is_flattened_for_jpeg(self):
+        """Прозрачная картинка сохраняется в JPEG на белом фоне"""
+        self.upload(Image.new("RGBA", (20, 20), (255, 0, 0, 0)),
+                    name="logo.png", fmt="PNG")
+
+        post = Post.objects.get(author=self.user)
+        with Image.open(post.image.path) as stored:
+            self.assertEqual(stored.format, "JPEG")
+            self.assertEqual(stored.getpixel((10, 10)), (255, 255, 255))
+
+    @override_settings(POSTS_IMAGE_MAX_SIDE=100)
+    def test_oversized_upload_is_rejected(self):
+        """Слишком большая картинка не принимается"""
+        response = self.upload(Image.new("RGB", (120, 10)))
+
+        self.assertFalse(Post.objects.filter(author=self.user).exists())
+        self.assertFormError(response, "form", "image", (
+            "Картинка слишком большая: не больше 100 точек по стороне и "
+            "40 мегапикселей."
+        ))
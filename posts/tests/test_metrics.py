@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.metrics import MetricsMiddleware, registry
+from posts.models import Post
+
+
+class MetricsDisabledTests(TestCase):
+    def test_middleware_is_not_used(self):
+        """Выключенные метрики не попадают в цепочку middleware"""
+        with self.assertRaises(MiddlewareNotUsed):
+            MetricsMiddleware(lambda request: None)
+
+        response = Client().get(reverse("posts:index"))
+
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertEqual(
+            Client().get(reverse("posts:metrics")).status_code, 404)
+
+
+@override_settings(POSTS_METRICS_ENABLED=True,
+                   POSTS_METRICS_SERVER_TIMING=True,
+                   POSTS_PAGE_CACHE_TIMEOUT=0)
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = get_user_model().objects.create(username="Measured")
+        Post.objects.create(text="Измеряемый пост", author=author)
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = Client()
+
+    def metric(self, text, name):
+        for line in text.splitlines():
+            if line.startswith(name + " "):
+                return float(line.split()[-1])
+        self.fail(f"Нет метрики {name}")
+
+    def test_server_timing_header(self):
+        """Ответ несет время базы, шаблонов и статистику кеша"""
+        response = self.client.get(reverse("posts:index"))
+
+        timing = response["Server-Timing"]
+        self.assertIn('db;dur=', timing)
+        self.assertIn('2 queries', timing)
+        self.assertIn("tpl;dur=", timing)
+        self.assertIn("cache;desc=", timing)
+
+    def test_metrics_are_aggregated_by_view(self):
+        """Страница /-/metrics/ суммирует запросы по представлениям"""
+        self.client.get(reverse("posts:index"))
+        self.client.get(reverse("posts:index"))
+
+        text = self.client.get(reverse("posts:metrics")).content.decode()
+        view = '{view="posts:index"}'
+
+        self.assertEqual(self.metric(
+            text, 'yatube_requests_total{view="posts:index",status="200"}'
+        ), 2)
+        # Второй показ не считает посты: их число уже в кеше
+        self.assertEqual(
+            self.metric(text, f"yatube_db_queries_total{view}"), 3)
+        self.assertGreater(
+            self.metric(text, f"yatube_template_duration_seconds_total"
+                              f"{view}"), 0)
+        # Второй показ берет карточку и версии лент из кеша
+        self.assertGreater(
+            self.metric(text, f"yatube_cache_hits_total{view}"), 0)
+        self.assertGreater(
+            self.metric(text, f"yatube_cache_misses_total{view}"), 0)
+
+    @override_settings(POSTS_METRICS_ALLOWED_IPS=[])
+    def test_metrics_page_is_restricted(self):
+        """Метрики отдаются только доверенным адресам"""
+        response = self.client.get(reverse("posts:metrics"))
+
+        self.assertEqual(response.status_code, 404)
@@ -1,7 +1,10 @@
+from unittest import skipUnless
+
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
 
-from posts.models import Post, Group
+from posts.models import Comment, Group, Post, PostRate
 
 
 class PostModelTest(TestCase):
@@ -54,3 +57,38 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         expected_object_name = post.text[:15]
         self.assertEquals(expected_object_name, str(post))
+
+
+@skipUnless(connection.vendor == "sqlite", "план запроса в формате SQLite")
+class QueryPlanTests(TestCase):
+    """Горячие запросы лент идут по индексам, без сортировки таблицы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username="Planner")
+        cls.group = Group.objects.create(title="План", slug="plan")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f"INDEX {index_name}", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_feed_queries_use_indexes(self):
+        feeds = {
+            "post_pub_date_idx": Post.objects.feed(),
+            "post_group_date_idx": self.group.posts.feed(),
+            "post_author_date_idx": self.user.posts.feed(),
+        }
+        for index_name, queryset in feeds.items():
+            with self.subTest(index=index_name):
+                self.assertUsesIndex(queryset[:10], index_name)
+
+    def test_comments_use_post_index(self):
+        comments = Comment.objects.filter(post_id=1).order_by("created", "id")
+
+        self.assertUsesIndex(comments, "comment_post_created_idx")
+
+    def test_vote_lookup_uses_unique_index(self):
+        plan = PostRate.objects.filter(post_id=1, user_id=1).explain()
+
+        self.assertIn("(post_id=? AND user_id=?)", plan)
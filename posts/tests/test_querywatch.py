@@ -0,0 +1,108 @@
+import io
+import shutil
+import tempfile
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+from posts.querywatch import (DuplicateQueriesError, fingerprint,
+                              watch_queries)
+
+
+class QueryWatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Watched")
+        for number in range(3):
+            post = Post.objects.create(text=f"Пост {number}",
+                                       author=cls.author)
+            Comment.objects.create(post=post, author=cls.author,
+                                   text="Комментарий")
+
+    def test_fingerprint_ignores_values(self):
+        """Отпечаток не зависит от литералов и длины списков IN"""
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 1 AND name = 'a''b'"),
+            fingerprint("SELECT  *  FROM t WHERE id = 25 AND name = 'c'"),
+        )
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s)"),
+        )
+
+    def test_n_plus_one_fails_with_origin(self):
+        """Повторы одной формы роняют проверку и указывают на строку
+        кода"""
+        with self.assertRaises(DuplicateQueriesError) as error:
+            with watch_queries("test", raise_errors=True):
+                for post in Post.objects.all():
+                    post.comments.count()
+
+        self.assertIn("3 одинаковых запросов", str(error.exception))
+        self.assertIn("posts/tests/test_querywatch.py", str(error.exception))
+
+    def test_slow_queries_are_logged(self):
+        """Запрос дольше порога попадает в лог"""
+        with self.assertLogs("posts.querywatch", "WARNING") as logs:
+            with watch_queries("test", slow_ms=0):
+                Post.objects.count()
+
+        self.assertIn("Медленный запрос", logs.output[0])
+
+
+@override_settings(POSTS_QUERYWATCH_ENABLED=True,
+                   POSTS_QUERYWATCH_RAISE=True)
+class PagesWithoutDuplicateQueriesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.author = get_user_model().objects.create(username="Busy")
+        self.reader = get_user_model().objects.create(username="Reader")
+        self.group = Group.objects.create(title="Группа", slug="busy")
+        Follow.objects.create(user=self.reader, author=self.author)
+        for number in range(5):
+            buffer = io.BytesIO()
+            Image.new("RGB", (20, 20), "green").save(buffer, "PNG")
+            self.post = Post.objects.create(
+                text=f"Пост {number}", author=self.author, group=self.group,
+                image=SimpleUploadedFile(f"{number}.png", buffer.getvalue(),
+                                         content_type="image/png"),
+            )
+            for _ in range(2):
+                Comment.objects.create(post=self.post, author=self.reader,
+                                       text="Комментарий")
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_pages_do_not_repeat_queries(self):
+        """Страницы с картинками и комментариями не делают N+1"""
+        urls = [
+            reverse("posts:index"),
+            reverse("posts:group", args=["busy"]),
+            reverse("posts:profile", args=["Busy"]),
+            reverse("posts:post", args=["Busy", self.post.id]),
+            reverse("posts:follow_index"),
+            reverse("posts:search") + "?q=пост",
+            reverse("posts:post_rate", args=["Busy", self.post.id, 4]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.client.get(url)
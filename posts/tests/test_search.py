@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts import search
+from posts.models import Post, Group, SearchToken
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.author = get_user_model().objects.create(username="Searcher")
+        self.other = get_user_model().objects.create(username="Other")
+        self.group = Group.objects.create(title="Коты", slug="cats")
+
+        Post.objects.create(text="Рыжий кот спит на окне",
+                            author=self.author, group=self.group)
+        Post.objects.create(text="Кот и еще раз кот, снова кот",
+                            author=self.other)
+        Post.objects.create(text="Собака гуляет во дворе",
+                            author=self.author)
+
+    def found(self, **params):
+        response = self.guest_client.get(reverse("posts:search"), params)
+        return [post.text for post in response.context["page"]]
+
+    def check_search(self):
+        self.assertEqual(self.found(q="кот"), [
+            "Кот и еще раз кот, снова кот",
+            "Рыжий кот спит на окне",
+        ])
+        self.assertEqual(self.found(q="рыжий КОТ"),
+                         ["Рыжий кот спит на окне"])
+        self.assertEqual(self.found(q="кот", group="cats"),
+                         ["Рыжий кот спит на окне"])
+        self.assertEqual(self.found(q="кот", author="Other"),
+                         ["Кот и еще раз кот, снова кот"])
+        self.assertEqual(self.found(q="кот", author="Nobody"), [])
+        self.assertEqual(self.found(q="лошадь"), [])
+
+    def test_fts_search(self):
+        """Поиск через FTS5 находит и ранжирует посты"""
+        self.assertTrue(search.fts_enabled())
+        self.check_search()
+
+    def test_new_fts_table_indexes_existing_posts(self):
+        """Таблица FTS5, созданная на базе с постами, сразу их находит"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {search.FTS_TABLE}")
+
+        search.create_fts_table()
+
+        self.check_search()
+
+    def test_service_pages_keep_usernames_free(self):
+        """Поиск и метрики не занимают адреса профилей"""
+        for username in ("search", "metrics"):
+            with self.subTest(username=username):
+                get_user_model().objects.create(username=username)
+
+                response = self.guest_client.get(f"/{username}/")
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context["author"].username,
+                                 username)
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идет по тому же индексу"""
+        post_admin = site._registry[Post]
+        queryset, use_distinct = post_admin.get_search_results(
+            None, Post.objects.all(), "рыжий кот"
+        )
+
+        self.assertEqual([post.text for post in queryset],
+                         ["Рыжий кот спит на окне"])
+        self.assertFalse(use_distinct)
+
+    def test_search_follows_post_changes(self):
+        """Индекс обновляется при правке и удалении поста"""
+        post = Post.objects.get(text__startswith="Собака")
+        post.text = "Собака и кот"
+        post.save()
+        self.assertIn("Собака и кот", self.found(q="кот"))
+
+        post.delete()
+        self.assertNotIn("Собака и кот", self.found(q="кот"))
+
+
+class TokenSearchTests(SearchTests):
+    def setUp(self):
+        patcher = mock.patch("posts.search.fts_enabled", return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+
+    def test_fts_search(self):
+        """Запасной индекс без FTS5 дает ту же выдачу"""
+        self.assertTrue(SearchToken.objects.exists())
+        self.check_search()
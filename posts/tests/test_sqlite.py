@@ -0,0 +1,81 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from posts import benchmark
+from posts.sqlite import current_pragmas, pragma_statements
+
+PRAGMAS = ("journal_mode", "synchronous", "mmap_size", "cache_size",
+           "busy_timeout")
+
+
+@override_settings(POSTS_SQLITE_PRAGMAS={
+    "journal_mode": "wal", "synchronous": "normal", "mmap_size": 1048576,
+    "cache_size": -4096, "busy_timeout": 1234,
+})
+class SqlitePragmaTests(TestCase):
+    def open_connection(self, name):
+        default = connections["default"]
+        wrapper = default.__class__({**default.settings_dict, "NAME": name},
+                                    "tuning")
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_new_file_connection_is_tuned(self):
+        """Новое соединение с файлом базы получает PRAGMA из настроек"""
+        with tempfile.TemporaryDirectory(dir=settings.BASE_DIR) as directory:
+            wrapper = self.open_connection(
+                os.path.join(directory, "tuned.sqlite3")
+            )
+
+            self.assertEqual(current_pragmas(wrapper, PRAGMAS), {
+                "journal_mode": "wal", "synchronous": 1,
+                "mmap_size": 1048576, "cache_size": -4096,
+                "busy_timeout": 1234,
+            })
+            wrapper.close()
+
+    def test_memory_database_keeps_journal_mode(self):
+        """База в памяти не переводится в WAL, остальное применяется"""
+        wrapper = self.open_connection(":memory:")
+
+        pragmas = current_pragmas(wrapper, ("journal_mode",
+                                            "busy_timeout"))
+
+        self.assertEqual(pragmas["journal_mode"], "memory")
+        self.assertEqual(pragmas["busy_timeout"], 1234)
+
+    def test_invalid_pragmas_are_rejected(self):
+        """Имена и значения PRAGMA проверяются перед подстановкой в SQL"""
+        for pragmas in ({"journal_mode": "wal; DROP TABLE posts_post"},
+                        {"cache size": 10}, {"mmap_size": 1.5}):
+            with self.subTest(pragmas=pragmas):
+                with self.assertRaises(ImproperlyConfigured):
+                    pragma_statements(pragmas)
+        self.assertEqual(pragma_statements(None), [])
+
+
+class SqliteBenchmarkTests(TransactionTestCase):
+    # Копия базы для процессов снимается с закоммиченных данных
+    def setUp(self):
+        cache.clear()
+
+    def test_compares_pragma_profiles(self):
+        """Стенд гоняет чтения и записи из процессов по профилям"""
+        benchmark.generate_data(users=5, groups=2, posts=30, comments=20,
+                                follows=10, rates=10)
+
+        results = benchmark.run_sqlite_benchmark(readers=1, writers=1,
+                                                 operations=5)
+
+        self.assertEqual(set(results), {"default", "tuned"})
+        for name, metrics in results.items():
+            with self.subTest(profile=name):
+                self.assertEqual(metrics["locked"], 0)
+                self.assertGreater(metrics["reads_per_s"], 0)
+                self.assertGreater(metrics["writes_per_s"], 0)
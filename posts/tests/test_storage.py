@@ -0,0 +1,147 @@
+import io
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from posts.models import Post, StoredImage
+from posts.storage import find_orphans, post_images, release_image
+from posts.thumbnails import generate_thumbnails
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class MediaRootMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root,
+                                               POSTS_THUMBNAIL_WORKERS=0)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.author = get_user_model().objects.create(username="Storer")
+
+    def create_post(self, content, name="picture.png"):
+        return Post.objects.create(
+            text="Пост с картинкой", author=self.author,
+            image=SimpleUploadedFile(name, content),
+        )
+
+    def files(self, directory):
+        return [os.path.join(root, name) for root, _, names
+                in os.walk(os.path.join(self.media_root, directory))
+                for name in names]
+
+
+class ContentAddressedStorageTests(MediaRootMixin, TestCase):
+    def test_identical_uploads_share_one_file(self):
+        """Одинаковые картинки хранятся одним файлом по хешу"""
+        first = self.create_post(png("red"), "first.png")
+        second = self.create_post(png("red"), "second.png")
+        other = self.create_post(png("blue"))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertRegex(first.image.name, r"^posts/\w\w/\w{64}\.png$")
+        self.assertEqual(len(self.files("posts")), 2)
+
+    def test_image_is_released_with_last_reference(self):
+        """Картинка и миниатюры удаляются, когда на нее не ссылается
+        ни один пост"""
+        first = self.create_post(png("red"))
+        second = self.create_post(png("red"))
+        generate_thumbnails(first.image)
+        name = first.image.name
+
+        first.delete()
+        self.assertFalse(release_image(name))
+        self.assertTrue(post_images.exists(name))
+
+        second.delete()
+        self.assertTrue(release_image(name))
+        self.assertFalse(post_images.exists(name))
+        self.assertEqual(self.files("cache"), [])
+
+    def test_upload_and_release_share_the_image_lock(self):
+        """Сохранение и освобождение картинки берут ее замок раньше,
+        чем смотрят на файл и ссылки постов"""
+        name = post_images.content_name("posts/picture.png",
+                                        ContentFile(png("red")))
+
+        with CaptureQueriesContext(connection) as saving:
+            post_images.save("posts/picture.png", ContentFile(png("red")))
+        with CaptureQueriesContext(connection) as releasing:
+            self.assertTrue(release_image(name))
+
+        self.assertIn('UPDATE "posts_storedimage"',
+                      " ".join(query["sql"] for query in saving))
+        statements = [query["sql"] for query in releasing]
+        lock = next(index for index, sql in enumerate(statements)
+                    if sql.startswith('UPDATE "posts_storedimage"'))
+        check = next(index for index, sql in enumerate(statements)
+                     if 'FROM "posts_post"' in sql)
+        self.assertLess(lock, check)
+        self.assertFalse(post_images.exists(name))
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+
+    def test_paths_outside_upload_dir_are_kept(self):
+        """Пути вне каталога картинок постов не удаляются"""
+        self.assertFalse(release_image("/tmp/picture.jpg"))
+
+    def test_prune_command_removes_orphans(self):
+        """Команда находит и удаляет картинки без постов и миниатюры
+        удаленных картинок"""
+        post = self.create_post(png("red"))
+        generate_thumbnails(post.image)
+        orphan = post_images.save("posts/lost.png", ContentFile(png("blue")))
+        Post.objects.all().delete()
+
+        images, thumbnails = find_orphans()
+        self.assertEqual(images, sorted([post.image.name, orphan]))
+        self.assertTrue(thumbnails)
+
+        output = io.StringIO()
+        call_command("prune_thumbnails", "--prune", stdout=output)
+
+        self.assertIn("картинок без постов: 2", output.getvalue())
+        self.assertEqual(self.files("posts"), [])
+        self.assertEqual(self.files("cache"), [])
+        self.assertEqual(find_orphans(), ([], []))
+
+
+class ImageReleaseSignalTests(MediaRootMixin, TransactionTestCase):
+    def test_deleting_or_replacing_image_releases_file(self):
+        """Удаление поста и смена картинки освобождают старый файл"""
+        post = self.create_post(png("red"))
+        old_name = post.image.name
+
+        post.image = SimpleUploadedFile("new.png", png("green"))
+        post.save()
+        self.assertFalse(post_images.exists(old_name))
+
+        new_name = post.image.name
+        post.delete()
+        self.assertFalse(post_images.exists(new_name))
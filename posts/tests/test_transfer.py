@@ -0,0 +1,187 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import (Comment, Follow, Group, Post, PostRate,
+                          ProfileStats, TimelineEntry)
+from posts.ratings import rate_post
+from posts.search import search_posts
+from posts.transfer import IdMap, _assign_ids
+
+SMALL_GIF = (
+    b"\x47\x49\x46\x38\x39\x61\x02\x00"
+    b"\x01\x00\x80\x00\x00\x00\x00\x00"
+    b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+    b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+    b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+    b"\x0A\x00\x3B"
+)
+
+
+class TransferTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root,
+                                               POSTS_THUMBNAIL_WORKERS=0)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_dir, ignore_errors=True)
+
+        self.author = get_user_model().objects.create(username="Exporter")
+        reader = get_user_model().objects.create(username="Importer")
+        group = Group.objects.create(title="Переезд", slug="move")
+        self.post = Post.objects.create(
+            text="Пост для переноса", author=self.author, group=group,
+            image=SimpleUploadedFile("move.gif", SMALL_GIF,
+                                     content_type="image/gif"),
+        )
+        self.comment = Comment.objects.create(post=self.post, author=reader,
+                                              text="Комментарий")
+        Follow.objects.create(user=reader, author=self.author)
+        rate_post(self.post.pk, reader.pk, 4)
+
+    def export(self, *args):
+        call_command("export_posts", self.export_dir, *args,
+                     stdout=io.StringIO())
+
+    def import_(self, *args):
+        call_command("import_posts", self.export_dir, *args,
+                     stdout=io.StringIO())
+
+    def clear_database(self):
+        default_storage.delete(self.post.image.name)
+        Group.objects.all().delete()
+        Post.objects.all().delete()
+        Follow.objects.all().delete()
+        get_user_model().objects.filter(username="Importer").delete()
+
+    def test_round_trip_restores_data_and_derived_state(self):
+        """Выгрузка и загрузка восстанавливают данные, картинки,
+        счетчики, ленты и поиск"""
+        reply = Comment.objects.create(post=self.post, author=self.author,
+                                       text="Ответ", parent=self.comment)
+        self.export("--images", self.export_dir)
+        self.clear_database()
+        self.import_("--images", self.export_dir, "--batch-size", "1")
+
+        post = Post.objects.get(pk=self.post.pk)
+        reader = get_user_model().objects.get(username="Importer")
+        self.assertEqual(post.pub_date, self.post.pub_date)
+        self.assertEqual(post.group.slug, "move")
+        self.assertEqual(Comment.objects.get(pk=self.comment.pk).created,
+                         self.comment.created)
+        self.assertEqual(Comment.objects.get(pk=reply.pk).parent_id,
+                         self.comment.pk)
+        self.assertFalse(reader.has_usable_password())
+        self.assertTrue(Follow.objects.filter(user=reader,
+                                              author=self.author).exists())
+        self.assertEqual(PostRate.objects.get().rate, 4)
+        self.assertEqual((post.rate_sum, post.rate_count), (4, 1))
+        self.assertTrue(default_storage.exists(post.image.name))
+
+        stats = ProfileStats.objects.get(user=self.author)
+        self.assertEqual((stats.followers_count, stats.posts_count), (1, 1))
+        self.assertTrue(TimelineEntry.objects.filter(user=reader,
+                                                     post=post).exists())
+        self.assertEqual(list(search_posts("переноса")[:10]), [post])
+
+    def test_csv_import_is_repeatable(self):
+        """CSV загружается так же, повторная загрузка не дублирует
+        строки"""
+        self.export("--format", "csv")
+        self.clear_database()
+        self.import_()
+        self.import_()
+
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(PostRate.objects.count(), 1)
+        self.assertEqual(Post.objects.get().group.slug, "move")
+
+    def test_import_changes_feed_etag(self):
+        """После загрузки лента отдает новый ETag, а не 304 по старому"""
+        self.export()
+        self.clear_database()
+        etag = self.client.get(reverse("posts:index"))["ETag"]
+
+        self.import_()
+
+        response = self.client.get(reverse("posts:index"),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertContains(response, "Пост для переноса")
+
+    def test_taken_id_does_not_merge_posts(self):
+        """Пост с занятым id получает новый, а его комментарии и оценки
+        не уходят к чужому посту; auto_now_add моделей не меняется"""
+        self.export()
+        self.clear_database()
+        local = Post.objects.create(id=self.post.pk, text="Местный пост",
+                                    author=self.author)
+        auto_now_add = []
+
+        def assign(model, date_field, *args):
+            auto_now_add.append(model._meta.get_field(date_field)
+                                .auto_now_add)
+            return _assign_ids(model, date_field, *args)
+
+        with mock.patch("posts.transfer._assign_ids", side_effect=assign):
+            self.import_()
+
+        imported = Post.objects.get(text="Пост для переноса")
+        self.assertNotEqual(imported.pk, local.pk)
+        self.assertEqual(imported.pub_date, self.post.pub_date)
+        comments = imported.comments.values_list("text", flat=True)
+        self.assertEqual(list(comments), ["Комментарий"])
+        self.assertEqual(PostRate.objects.get().post, imported)
+        self.assertFalse(local.comments.exists())
+        self.assertEqual(auto_now_add, [True, True])
+
+    def test_id_map_lives_in_temporary_table(self):
+        """Соответствие id хранится во временной таблице базы и
+        удаляется после импорта"""
+        with IdMap() as ids:
+            ids.add("posts", [(1, 10), (2, 20)])
+            ids.add("posts", [(2, 30)])
+            ids.add("comments", [(1, 40)])
+
+            self.assertEqual(ids.get("posts", [1, 2, 3, None]),
+                             {1: 10, 2: 30})
+            self.assertEqual(ids.get("comments", range(1, 1200)), {1: 40})
+            self.assertIn(IdMap.table, self.tables())
+
+        self.assertNotIn(IdMap.table, self.tables())
+
+    @staticmethod
+    def tables():
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT tablename FROM pg_tables "
+                               "WHERE schemaname LIKE 'pg_temp%'")
+            else:
+                cursor.execute("SELECT name FROM sqlite_temp_master")
+            return [row[0] for row in cursor.fetchall()]
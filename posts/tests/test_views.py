@@ -1,16 +1,32 @@
+import io
+import os
 import shutil
 import tempfile
 import datetime as dt
+import time
+from unittest import mock
+from PIL import Image
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django import forms
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.cache import cache
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 
-from posts.models import Post, Group, Comment, Follow
+from posts import freshness
+from posts.cache import COMPUTE_LOCK_KEY
+from posts.pagecache import PAGE_KEY
+from posts.thumbnails import generate_thumbnails
+from posts.stats import get_stats, profile_summaries
+from posts.comments import comment_page
+from posts.timeline import Timeline, timeline_posts
+from django.core.management import call_command
+from posts.models import (Post, Group, Comment, Follow, PostRate,
+                          ProfileStats, TimelineEntry)
 
 
 class PostPagesTests(TestCase):
@@ -342,3 +358,775 @@ class PostPagesTests(TestCase):
         for value, expected in comments.items():
             with self.subTest(value=value):
                 self.assertEqual(value, expected)
+
+
+class FeedQueriesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="FeedAuthor")
+        cls.group = Group.objects.create(title="Группа ленты",
+                                         slug="feed-group")
+        Post.objects.bulk_create([
+            Post(text=f"Запись {number}",
+                 author=cls.author,
+                 group=cls.group)
+            for number in range(25)
+        ])
+        Comment.objects.bulk_create([
+            Comment(post=post, author=cls.author, text="Комментарий")
+            for post in Post.objects.all()
+        ])
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def test_feed_queries_do_not_depend_on_page_size(self):
+        """Число запросов ленты не зависит от количества постов
+        на странице"""
+        # Главная: count + страница; группа: еще id группы для ETag
+        # и два запроса группы; профиль: id автора для ETag и автор
+        # вместе со счетчиками
+        query_budget = {
+            reverse("posts:index"): 2,
+            reverse("posts:group", kwargs={"slug": "feed-group"}): 5,
+            reverse("posts:profile", kwargs={"username": "FeedAuthor"}): 4,
+        }
+        for url, queries in query_budget.items():
+            with self.subTest(url=url):
+                with self.assertNumQueries(queries):
+                    response = self.guest_client.get(url)
+                self.assertEqual(len(response.context["page"]), 10)
+
+                # Число постов ленты уже в кеше
+                with self.assertNumQueries(queries - 1):
+                    response = self.guest_client.get(url + "?page=3")
+                self.assertEqual(len(response.context["page"]), 5)
+
+    def test_feed_annotates_comments_count(self):
+        """Лента отдает число комментариев без отдельных запросов"""
+        response = self.guest_client.get(reverse("posts:index"))
+
+        with self.assertNumQueries(0):
+            counts = [post.comments_count for post in response.context["page"]]
+        self.assertEqual(counts, [1] * 10)
+
+    def test_cursor_pagination_walks_feed(self):
+        """Курсорная пагинация проходит ленту без пропусков и повторов
+        за одинаковое число запросов"""
+        url = reverse("posts:index")
+        seen = []
+        cursor = ""
+        sizes = []
+        while cursor is not None:
+            with self.assertNumQueries(1):
+                response = self.guest_client.get(url, {"cursor": cursor})
+            page = response.context["page"]
+            sizes.append(len(page))
+            seen.extend(post.id for post in page)
+            cursor = page.next_cursor
+
+        self.assertEqual(sizes, [10, 10, 5])
+        self.assertEqual(seen, list(
+            Post.objects.order_by("-pub_date", "-id")
+            .values_list("id", flat=True)
+        ))
+
+        previous = self.guest_client.get(
+            url, {"cursor": page.previous_cursor}
+        ).context["page"]
+        self.assertEqual([post.id for post in previous], seen[10:20])
+        self.assertTrue(previous.has_next())
+
+
+class FollowTimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Writer")
+        cls.reader = get_user_model().objects.create(username="Reader")
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def follow_feed(self):
+        response = self.reader_client.get(reverse("posts:follow_index"))
+        return [post.text for post in response.context["page"]]
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        """Новый пост раскладывается в ленты подписчиков"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text="Разложенный пост",
+                                   author=self.author)
+
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertEqual(self.follow_feed(), ["Разложенный пост"])
+
+    def test_follow_backfills_and_unfollow_clears_timeline(self):
+        """Подписка добавляет старые посты автора, отписка их убирает"""
+        Post.objects.create(text="Старый пост", author=self.author)
+
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.follow_feed(), ["Старый пост"])
+
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertEqual(self.follow_feed(), [])
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(POSTS_TIMELINE_FANOUT_LIMIT=0)
+    def test_heavy_author_is_read_on_demand(self):
+        """Посты авторов с большим числом подписчиков не раскладываются,
+        но попадают в ленту при чтении"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text="Пост популярного автора",
+                            author=self.author)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.follow_feed(), ["Пост популярного автора"])
+
+    @override_settings(POSTS_TIMELINE_FANOUT_LIMIT=1)
+    def test_timeline_merges_entries_with_heavy_authors(self):
+        """Записи ленты и посты тяжелых авторов сливаются по дате на
+        страницах с номерами и с курсором"""
+        heavy = get_user_model().objects.create(username="Popular")
+        other = get_user_model().objects.create(username="Other")
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=heavy)
+        Follow.objects.create(user=other, author=heavy)
+        for number in range(12):
+            Post.objects.create(text=f"Пост {number}",
+                                author=(heavy, self.author)[number % 2])
+        expected = [f"Пост {number}" for number in range(11, -1, -1)]
+
+        self.assertEqual(TimelineEntry.objects.count(), 6)
+        second = self.reader_client.get(reverse("posts:follow_index"),
+                                        {"page": 2})
+        self.assertEqual(
+            self.follow_feed() + [post.text
+                                  for post in second.context["page"]],
+            expected,
+        )
+        first = self.reader_client.get(reverse("posts:follow_index"),
+                                       {"cursor": ""}).context["page"]
+        second = self.reader_client.get(reverse("posts:follow_index"), {
+            "cursor": first.next_cursor
+        }).context["page"]
+        self.assertEqual([post.text for post in [*first, *second]],
+                         expected)
+
+    @override_settings(POSTS_TIMELINE_FANOUT_LIMIT=0)
+    def test_heavy_author_without_counters_is_read_on_demand(self):
+        """Тяжелый автор без строки счетчиков не пропадает из ленты:
+        раскладка и чтение считают подписчиков одинаково"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        ProfileStats.objects.filter(user=self.author).delete()
+        Post.objects.create(text="Пост без счетчиков", author=self.author)
+
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.follow_feed(), ["Пост без счетчиков"])
+
+    def test_deep_page_loads_only_its_posts(self):
+        """Страница со смещением читает посты только самой страницы"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        for number in range(12):
+            Post.objects.create(text=f"Пост {number}", author=self.author)
+
+        with mock.patch("posts.timeline.Timeline._posts",
+                        wraps=Timeline._posts) as load:
+            page = timeline_posts(self.reader)[10:12]
+
+        self.assertEqual([post.text for post in page],
+                         ["Пост 1", "Пост 0"])
+        self.assertEqual(len(load.call_args[0][0]), 2)
+
+    @override_settings(POSTS_TIMELINE_FANOUT_LIMIT=1)
+    def test_author_below_limit_is_fanned_out_again(self):
+        """Автор, опустившийся до порога, снова раскладывается в ленты
+        вместе со старыми постами"""
+        other = get_user_model().objects.create(username="Leaving")
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        Post.objects.create(text="Пост без раскладки", author=self.author)
+
+        Follow.objects.filter(user=other).delete()
+
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader)
+                        .exists())
+        self.assertEqual(self.follow_feed(), ["Пост без раскладки"])
+
+
+class ProfileStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Counted")
+        cls.reader = get_user_model().objects.create(username="Counter")
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+
+    def stats(self, user):
+        stats = ProfileStats.objects.get(user=user)
+        return stats.followers_count, stats.following_count, stats.posts_count
+
+    def test_counters_follow_views(self):
+        """Подписка, отписка, новый пост и удаление меняют счетчики"""
+        self.reader_client.get(reverse("posts:profile_follow",
+                                       kwargs={"username": "Counted"}))
+        self.assertEqual(self.stats(self.author), (1, 0, 0))
+        self.assertEqual(self.stats(self.reader), (0, 1, 0))
+
+        self.reader_client.post(reverse("posts:new_post"),
+                                data={"text": "Посчитанный пост"})
+        self.assertEqual(self.stats(self.reader), (0, 1, 1))
+
+        post = Post.objects.get(text="Посчитанный пост")
+        self.reader_client.get(reverse(
+            "posts:post_del",
+            kwargs={"username": "Counter", "post_id": post.id}))
+        self.reader_client.get(reverse("posts:profile_unfollow",
+                                       kwargs={"username": "Counted"}))
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+        self.assertEqual(self.stats(self.reader), (0, 0, 0))
+
+    def test_profile_reads_counters(self):
+        """Профиль показывает счетчики из ProfileStats"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text="Пост", author=self.author)
+
+        response = self.reader_client.get(reverse(
+            "posts:profile", kwargs={"username": "Counted"}))
+
+        self.assertEqual(response.context["following"], 1)
+        self.assertEqual(response.context["stats"].posts_count, 1)
+        self.assertEqual(response.context["db_name"], self.author)
+
+    def test_profile_summary_is_one_query(self):
+        """Счетчики и состояние подписки читаются одним запросом"""
+        Follow.objects.create(user=self.reader, author=self.author)
+
+        with self.assertNumQueries(1):
+            author = profile_summaries(self.reader).get(username="Counted")
+            stats = get_stats(author)
+        self.assertTrue(author.is_following)
+        self.assertEqual((stats.followers_count, stats.following_count,
+                          stats.posts_count), (1, 0, 0))
+
+        with self.assertNumQueries(1):
+            author = profile_summaries(AnonymousUser()).get(
+                username="Counted"
+            )
+        self.assertFalse(author.is_following)
+
+    def test_profile_and_post_query_budget(self):
+        """Профиль и пост не добирают счетчики и подписку запросами"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text="Пост", author=self.author)
+        # Сессия, пользователь, id автора для ETag и сводка профиля;
+        # в профиле еще число постов и страница, у поста — пост и
+        # комментарии
+        urls = [
+            reverse("posts:profile", kwargs={"username": "Counted"}),
+            reverse("posts:post", kwargs={"username": "Counted",
+                                          "post_id": post.pk}),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                with self.assertNumQueries(6):
+                    response = self.reader_client.get(url)
+                self.assertEqual(response.context["stats"].followers_count,
+                                 1)
+
+    def test_missing_counters_are_rebuilt(self):
+        """Счетчики без строки собираются при чтении и командой"""
+        Post.objects.create(text="Пост", author=self.author)
+        ProfileStats.objects.all().delete()
+
+        response = self.reader_client.get(reverse(
+            "posts:profile", kwargs={"username": "Counted"}))
+        self.assertEqual(response.context["stats"].posts_count, 1)
+
+        ProfileStats.objects.filter(user=self.author).update(posts_count=7)
+        call_command("rebuild_profile_stats", stdout=io.StringIO())
+        self.assertEqual(self.stats(self.author), (0, 0, 1))
+        self.assertEqual(self.stats(self.reader), (0, 0, 0))
+
+
+@override_settings(POSTS_COMMENTS_PER_PAGE=3)
+class CommentPagesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Talker")
+        cls.post = Post.objects.create(text="Обсуждаемый пост",
+                                       author=cls.author)
+        cls.roots = []
+        for number in range(7):
+            commenter = get_user_model().objects.create(
+                username=f"commenter{number}"
+            )
+            root = Comment.objects.create(post=cls.post, author=commenter,
+                                          text=f"Комментарий {number}")
+            Comment.objects.create(post=cls.post, author=cls.author,
+                                   text=f"Ответ {number}", parent=root)
+            cls.roots.append(root)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.author)
+        cache.clear()
+        self.post_url = reverse("posts:post", kwargs={
+            "username": "Talker", "post_id": self.post.pk
+        })
+
+    def test_post_page_shows_first_page_with_replies(self):
+        """На странице поста — новые корневые комментарии с ответами,
+        без запросов на каждого автора"""
+        response = self.client.get(self.post_url)
+
+        comments = response.context["comments"]
+        self.assertEqual([comment.text for comment in comments],
+                         ["Комментарий 6", "Комментарий 5", "Комментарий 4"])
+        self.assertEqual([reply.text for reply in comments[0].replies_list],
+                         ["Ответ 6"])
+        self.assertTrue(response.context["comments_page"].has_next())
+        self.assertContains(response, "Показать еще")
+
+        # Ключи страницы, комментарии и ответы — три запроса при любом
+        # числе комментариев
+        with self.assertNumQueries(3):
+            comments, _ = comment_page(self.post.pk)
+            authors = [(comment.author.username,
+                        [reply.author.username
+                         for reply in comment.replies_list])
+                       for comment in comments]
+        self.assertEqual(len(authors), 3)
+
+    def test_load_more_walks_all_comments(self):
+        """JSON-страницы отдают все корневые комментарии без повторов"""
+        url = reverse("posts:post_comments", kwargs={
+            "username": "Talker", "post_id": self.post.pk
+        })
+        seen = []
+        while url is not None:
+            data = self.client.get(url).json()
+            seen.extend(comment["id"] for comment in data["comments"])
+            self.assertEqual(len(data["comments"][0]["replies"]), 1)
+            self.assertIn("Ответить", data["html"])
+            url = data["next"]
+
+        self.assertEqual(seen, [root.pk for root in reversed(self.roots)])
+
+    @override_settings(POSTS_COMMENT_REPLIES_PER_PAGE=2)
+    def test_busy_thread_shows_first_replies(self):
+        """Под комментарием только первые ответы, остальные отдаются
+        страницами по кнопке"""
+        root = self.roots[-1]
+        for number in range(4):
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text=f"Еще ответ {number}", parent=root)
+
+        with self.assertNumQueries(3):
+            comments = list(comment_page(self.post.pk)[0])
+        self.assertEqual([reply.text for reply in comments[0].replies_list],
+                         ["Ответ 6", "Еще ответ 0"])
+        self.assertIsNone(comments[1].replies_cursor)
+        response = self.client.get(self.post_url)
+        self.assertContains(response, "Показать еще ответы", count=1)
+
+        url = reverse("posts:comment_replies", kwargs={
+            "username": "Talker", "post_id": self.post.pk,
+            "comment_id": root.pk,
+        }) + f"?cursor={comments[0].replies_cursor}"
+        seen = []
+        while url is not None:
+            data = self.client.get(url).json()
+            seen.extend(reply["text"] for reply in data["replies"])
+            url = data["next"]
+        self.assertEqual(seen, ["Еще ответ 1", "Еще ответ 2",
+                                "Еще ответ 3"])
+
+    def test_replies_stay_one_level_deep(self):
+        """Ответ на ответ прикрепляется к корню, чужой комментарий
+        в качестве родителя игнорируется"""
+        url = reverse("posts:add_comment", kwargs={
+            "username": "Talker", "post_id": self.post.pk
+        })
+        reply = self.roots[0].replies.get()
+        other_post = Post.objects.create(text="Другой", author=self.author)
+        foreign = Comment.objects.create(post=other_post, author=self.author,
+                                         text="Чужой")
+
+        self.client.post(url, {"text": "Ответ на ответ",
+                               "parent": reply.pk})
+        self.client.post(url, {"text": "Мимо", "parent": foreign.pk})
+
+        self.assertEqual(Comment.objects.get(text="Ответ на ответ").parent,
+                         self.roots[0])
+        self.assertIsNone(Comment.objects.get(text="Мимо").parent)
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="CardAuthor")
+        cls.post = Post.objects.create(text="Исходный текст",
+                                       author=cls.author)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        cache.clear()
+
+    def index_html(self, client):
+        return client.get(reverse("posts:index")).content.decode()
+
+    def test_card_fragment_is_cached(self):
+        """Карточка поста берется из кеша, пока версия не изменилась"""
+        self.index_html(self.guest_client)
+        Post.objects.filter(pk=self.post.pk).update(text="Тихая правка")
+
+        self.assertIn("Исходный текст", self.index_html(self.guest_client))
+
+    def test_card_version_is_bumped_on_changes(self):
+        """Правка и новый комментарий сбрасывают кеш карточки"""
+        self.index_html(self.guest_client)
+
+        self.post.text = "Новый текст"
+        self.post.save()
+        self.assertIn("Новый текст", self.index_html(self.guest_client))
+
+        Comment.objects.create(post=self.post, author=self.author,
+                               text="Комментарий")
+        self.assertIn("Комментариев: 1", self.index_html(self.guest_client))
+
+    def test_author_buttons_are_not_cached(self):
+        """Кнопки автора не попадают в кеш для других пользователей"""
+        edit_url = reverse("posts:post_edit", kwargs={
+            "username": "CardAuthor", "post_id": self.post.pk
+        })
+
+        self.assertIn(edit_url, self.index_html(self.author_client))
+        self.assertNotIn(edit_url, self.index_html(self.guest_client))
+
+
+class PostRateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="RateAuthor")
+        cls.post = Post.objects.create(text="Оцениваемый пост",
+                                       author=cls.author)
+
+    def setUp(self):
+        self.voter = get_user_model().objects.create(username="Voter")
+        self.voter_client = Client()
+        self.voter_client.force_login(self.voter)
+        cache.clear()
+
+    def vote(self, client, rate):
+        return client.get(reverse("posts:post_rate", kwargs={
+            "username": "RateAuthor", "post_id": self.post.pk, "rate": rate
+        }))
+
+    def test_rate_counters_are_incremental(self):
+        """Повторный голос меняет сумму, но не число оценок"""
+        other_client = Client()
+        other_client.force_login(self.author)
+
+        self.vote(self.voter_client, 5)
+        self.vote(self.voter_client, 3)
+        self.vote(other_client, 4)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.rate_sum, 7)
+        self.assertEqual(self.post.rate_count, 2)
+        self.assertEqual(self.post.post_rate_avg, 4)
+        self.assertEqual(PostRate.objects.filter(post=self.post).count(), 2)
+
+    def test_counters_are_recounted_by_command(self):
+        """Команда заполняет счетчики оценок, заведенных до них"""
+        PostRate.objects.create(post=self.post, user=self.voter, rate=3)
+        PostRate.objects.create(post=self.post, user=self.author, rate=5)
+
+        call_command("recount_ratings", stdout=io.StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.rate_sum, self.post.rate_count), (8, 2))
+
+    def test_vote_cost_does_not_grow_with_rates(self):
+        """Стоимость голоса не зависит от числа оценок поста"""
+        self.vote(self.voter_client, 5)
+        with CaptureQueriesContext(connection) as first:
+            self.vote(self.voter_client, 2)
+
+        voters = [
+            get_user_model().objects.create(username=f"voter{number}")
+            for number in range(30)
+        ]
+        PostRate.objects.bulk_create([
+            PostRate(post=self.post, user=voter, rate=3) for voter in voters
+        ])
+        with CaptureQueriesContext(connection) as second:
+            self.vote(self.voter_client, 4)
+
+        self.assertEqual(len(first), len(second))
+
+    def test_user_rates_post_once(self):
+        """Пользователь не может оставить две оценки одному посту"""
+        PostRate.objects.create(post=self.post, user=self.voter, rate=1)
+
+        with self.assertRaises(IntegrityError):
+            PostRate.objects.create(post=self.post, user=self.voter, rate=2)
+
+
+class DeferredThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        buffer = io.BytesIO()
+        Image.new("RGB", (1200, 800), "orange").save(buffer, "PNG")
+        author = get_user_model().objects.create(username="Painter")
+        self.post = Post.objects.create(
+            text="Пост с картинкой",
+            author=author,
+            image=SimpleUploadedFile("big.png", buffer.getvalue(),
+                                     content_type="image/png"),
+        )
+
+    def test_feed_does_not_resize_images_in_request(self):
+        """Лента показывает исходную картинку, пока миниатюра готовится"""
+        response = self.client.get(reverse("posts:index"))
+
+        self.assertContains(response, self.post.image.url)
+        self.assertFalse(os.path.exists(os.path.join(self.media_root,
+                                                     "cache")))
+
+    def test_feed_uses_generated_thumbnail(self):
+        """После фоновой обработки лента показывает миниатюру"""
+        generate_thumbnails(self.post.image)
+
+        response = self.client.get(reverse("posts:index"))
+
+        self.assertNotContains(response, self.post.image.url)
+        self.assertContains(response, settings.MEDIA_URL + "cache/")
+        # Узкая миниатюра для srcset; широкая не больше оригинала
+        self.assertContains(response, " 480w, ")
+        self.assertContains(response, " 1200w")
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Etag")
+        cls.reader = get_user_model().objects.create(username="EtagReader")
+        cls.group = Group.objects.create(title="ETag", slug="etag")
+        cls.post = Post.objects.create(text="Запись", author=cls.author,
+                                       group=cls.group)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+        self.urls = {
+            "index": reverse("posts:index"),
+            "group": reverse("posts:group", kwargs={"slug": "etag"}),
+            "profile": reverse("posts:profile",
+                               kwargs={"username": "Etag"}),
+            "post": reverse("posts:post", kwargs={
+                "username": "Etag", "post_id": self.post.pk
+            }),
+        }
+
+    def revalidate(self, url, client=None):
+        client = client or self.guest_client
+        etag = client.get(url)["ETag"]
+        return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_return_not_modified(self):
+        """Неизменившиеся страницы отдают 304 без рендеринга"""
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                self.assertIsNone(response.context)
+
+    def test_changes_invalidate_etag(self):
+        """Комментарий и подписка меняют ETag нужных страниц"""
+        etags = {name: self.guest_client.get(url)["ETag"]
+                 for name, url in self.urls.items()}
+
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Комментарий")
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[name]
+                )
+                self.assertEqual(response.status_code, 200)
+
+        profile = self.urls["profile"]
+        etag = self.guest_client.get(profile)["ETag"]
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.guest_client.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_modified_follows_feed_versions(self):
+        """Last-Modified отдает 304 по If-Modified-Since, пока ленту не
+        изменили, и сдвигается после записи"""
+        dates = {name: self.guest_client.get(url)["Last-Modified"]
+                 for name, url in self.urls.items()}
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response = self.guest_client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=dates[name]
+                )
+                self.assertEqual(response.status_code, 304)
+
+        # Last-Modified точен до секунды: запись «через минуту»
+        later = time.time_ns() + 60 * 10 ** 9
+        with mock.patch("posts.cache.new_version", return_value=later):
+            Comment.objects.create(post=self.post, author=self.reader,
+                                   text="Комментарий")
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                response = self.guest_client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=dates[name]
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["Last-Modified"], dates[name])
+
+    def test_etag_depends_on_user(self):
+        """Страница другого пользователя не считается свежей"""
+        url = self.urls["index"]
+        etag = self.guest_client.get(url)["ETag"]
+
+        response = self.reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="Cached")
+        cls.reader = get_user_model().objects.create(username="Visitor")
+        cls.group = Group.objects.create(title="Кеш", slug="page-cache")
+        cls.post = Post.objects.create(text="Страница из кеша",
+                                       author=cls.author, group=cls.group)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        cache.clear()
+        self.post_kwargs = {"username": "Cached", "post_id": self.post.pk}
+        self.urls = {
+            "index": reverse("posts:index"),
+            "group": reverse("posts:group", kwargs={"slug": "page-cache"}),
+            "profile": reverse("posts:profile",
+                               kwargs={"username": "Cached"}),
+            "post": reverse("posts:post", kwargs=self.post_kwargs),
+        }
+
+    def test_anonymous_pages_are_cached(self):
+        """Повторный показ анониму отдается из кеша без рендеринга"""
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                first = self.guest_client.get(url)
+                with CaptureQueriesContext(connection) as queries:
+                    second = self.guest_client.get(url)
+
+                self.assertIsNotNone(first.context)
+                self.assertIsNone(second.context)
+                self.assertEqual(second.content, first.content)
+                # Остается только поиск автора или группы для ETag
+                self.assertLessEqual(len(queries), 1)
+
+    def test_writes_invalidate_cached_pages(self):
+        """Комментарий, оценка, пост и правка группы сбрасывают кеш"""
+        for url in self.urls.values():
+            self.guest_client.get(url)
+
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Свежий комментарий")
+        self.assertContains(self.guest_client.get(self.urls["post"]),
+                            "Свежий комментарий")
+
+        self.reader_client.get(reverse("posts:post_rate", kwargs={
+            **self.post_kwargs, "rate": 5}))
+        response = self.guest_client.get(self.urls["index"])
+        self.assertIsNotNone(response.context)
+        self.assertEqual(response.context["page"][0].rate_sum, 5)
+
+        Post.objects.create(text="Новая запись", author=self.author,
+                            group=self.group)
+        for name in ("index", "group", "profile"):
+            with self.subTest(page=name):
+                self.assertContains(self.guest_client.get(self.urls[name]),
+                                    "Новая запись")
+
+        self.group.title = "Переименованная группа"
+        self.group.save()
+        self.assertContains(self.guest_client.get(self.urls["group"]),
+                            "Переименованная группа")
+
+    def test_stale_page_keeps_its_own_etag(self):
+        """Пока новую версию рендерит другой запрос, прошлая страница
+        уходит под прошлым ETag и не получает 304 по новому"""
+        url = self.urls["index"]
+        first = self.guest_client.get(url)
+        Post.objects.create(text="Новая запись", author=self.author)
+
+        request = RequestFactory().get(url)
+        request.user = AnonymousUser()
+        etag = freshness.index_etag(request)
+        # Блокировку пересчета новой версии держит другой запрос
+        lock = COMPUTE_LOCK_KEY.format(PAGE_KEY.format(etag))
+        cache.add(lock, 1)
+
+        stale = self.guest_client.get(url)
+        self.assertNotContains(stale, "Новая запись")
+        self.assertEqual(stale["ETag"], first["ETag"])
+        revalidated = self.guest_client.get(
+            url, HTTP_IF_NONE_MATCH=stale["ETag"]
+        )
+        self.assertEqual(revalidated.status_code, 200)
+
+        cache.delete(lock)
+        fresh = self.guest_client.get(url, HTTP_IF_NONE_MATCH=stale["ETag"])
+        self.assertContains(fresh, "Новая запись")
+        self.assertNotEqual(fresh["ETag"], first["ETag"])
+
+    def test_authenticated_users_bypass_cache(self):
+        """Авторизованным страницы рендерятся каждый раз"""
+        url = self.urls["index"]
+        self.reader_client.get(url)
+
+        response = self.reader_client.get(url)
+
+        self.assertIsNotNone(response.context)
+
+    @override_settings(POSTS_PAGE_CACHE_TIMEOUT=0)
+    def test_page_cache_can_be_disabled(self):
+        """С нулевым сроком кеш страниц выключен"""
+        url = self.urls["index"]
+        self.guest_client.get(url)
+
+        self.assertIsNotNone(self.guest_client.get(url).context)
@@ -0,0 +1,205 @@
+import os
+import signal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import writequeue
+from posts.models import Comment, Post, PostRate
+
+
+@override_settings(POSTS_WRITE_QUEUE=True, POSTS_WRITE_QUEUE_INTERVAL=0,
+                   POSTS_WRITE_QUEUE_BATCH=100, POSTS_PAGE_CACHE_TIMEOUT=0)
+class WriteQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = get_user_model().objects.create(username="QueueAuthor")
+        cls.voter = get_user_model().objects.create(username="QueueVoter")
+        cls.post = Post.objects.create(text="Пост под очередью",
+                                       author=cls.author)
+        cls.other = Post.objects.create(text="Второй пост под очередью",
+                                        author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.voter_client = Client()
+        self.voter_client.force_login(self.voter)
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def tearDown(self):
+        writequeue.flush()
+
+    def comment(self, client, text, post=None):
+        post = post or self.post
+        return client.post(reverse("posts:add_comment", kwargs={
+            "username": "QueueAuthor", "post_id": post.pk
+        }), {"text": text})
+
+    def vote(self, client, rate, post=None):
+        post = post or self.post
+        return client.get(reverse("posts:post_rate", kwargs={
+            "username": "QueueAuthor", "post_id": post.pk, "rate": rate
+        }))
+
+    def post_html(self, client):
+        return client.get(reverse("posts:post", kwargs={
+            "username": "QueueAuthor", "post_id": self.post.pk
+        })).content.decode()
+
+    @override_settings(POSTS_WRITE_QUEUE=False)
+    def test_queue_is_off_by_default(self):
+        """Без очереди комментарий и голос пишутся сразу"""
+        self.comment(self.voter_client, "Сразу в базу")
+        self.vote(self.voter_client, 4)
+
+        self.assertTrue(Comment.objects.filter(text="Сразу в базу").exists())
+        self.assertTrue(PostRate.objects.filter(post=self.post).exists())
+        self.assertEqual(writequeue.flush(), 0)
+
+    def test_writes_go_to_database_in_one_batch(self):
+        """Комментарии и голоса пишутся одной пачкой при сбросе"""
+        for number in range(3):
+            self.comment(self.voter_client, f"Отложенный {number}")
+        self.vote(self.voter_client, 5)
+        self.vote(self.voter_client, 3, self.other)
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(PostRate.objects.exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(writequeue.flush(), 5)
+
+        writes = [query for query in queries.captured_queries
+                  if query["sql"].startswith(("INSERT", "UPDATE"))]
+        # Вставка комментариев, вставка голосов и по UPDATE сумм на пост
+        self.assertEqual(len(writes), 4)
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 3)
+        self.assertEqual(PostRate.objects.count(), 2)
+
+    def test_repeated_votes_are_coalesced(self):
+        """Повторные голоса схлопываются, а сумма и число оценок верны"""
+        PostRate.objects.create(post=self.post, user=self.author, rate=1)
+        Post.objects.filter(pk=self.post.pk).update(rate_sum=1, rate_count=1)
+
+        self.vote(self.voter_client, 5)
+        self.vote(self.voter_client, 2)
+        self.vote(self.author_client, 4)
+        self.assertEqual(writequeue.flush(), 2)
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.rate_sum, 6)
+        self.assertEqual(self.post.rate_count, 2)
+        self.assertEqual(
+            dict(PostRate.objects.values_list("user__username", "rate")),
+            {"QueueAuthor": 4, "QueueVoter": 2},
+        )
+
+    def test_full_batch_is_written_at_once(self):
+        """Набравшаяся пачка пишется без ожидания сброса"""
+        with self.settings(POSTS_WRITE_QUEUE_BATCH=2):
+            self.comment(self.voter_client, "Первый в пачке")
+            self.assertFalse(Comment.objects.exists())
+            self.vote(self.voter_client, 5)
+
+        self.assertTrue(Comment.objects.exists())
+        self.assertTrue(PostRate.objects.exists())
+
+    def test_user_reads_own_pending_writes(self):
+        """Автор записи видит ее до сброса, остальные — после"""
+        self.comment(self.voter_client, "Ждет очереди")
+        self.vote(self.voter_client, 5)
+
+        voter_html = self.post_html(self.voter_client)
+        self.assertIn("Ждет очереди", voter_html)
+        self.assertIn("отправляется", voter_html)
+        self.assertNotIn("Ждет очереди", self.post_html(self.author_client))
+
+        post = Post.objects.get(pk=self.post.pk)
+        post.card_version = "1"
+        writequeue.apply_pending_rates(self.voter, [post])
+        self.assertEqual((post.rate_sum, post.rate_count), (5, 1))
+        self.assertNotEqual(post.card_version, "1")
+
+        writequeue.flush()
+
+        self.assertEqual(writequeue.pending_comments(self.voter,
+                                                     self.post.pk), [])
+        voter_html = self.post_html(self.voter_client)
+        self.assertIn("Ждет очереди", voter_html)
+        self.assertNotIn("отправляется", voter_html)
+        self.assertIn("Ждет очереди", self.post_html(self.author_client))
+
+    def test_written_items_are_not_counted_twice(self):
+        """После коммита пачки отметки уже сняты: голос и комментарий не
+        учитываются и из базы, и из очереди"""
+        self.comment(self.voter_client, "Один раз")
+        self.vote(self.voter_client, 5)
+        seen = []
+
+        def after_commit(post_id, *args):
+            post = Post.objects.get(pk=post_id)
+            post.card_version = "1"
+            writequeue.apply_pending_rates(self.voter, [post])
+            seen.append((post.rate_sum, post.rate_count,
+                         len(writequeue.pending_comments(self.voter,
+                                                         post_id))))
+
+        with mock.patch("posts.writequeue.touch_post",
+                        side_effect=after_commit):
+            writequeue.flush()
+
+        self.assertEqual(seen, [(5, 1, 0)])
+
+    def test_failed_batch_is_written_one_by_one(self):
+        """Если пачка не записалась, записи пишутся по одной"""
+        self.comment(self.voter_client, "Запасной путь")
+        self.vote(self.voter_client, 4)
+
+        with mock.patch("posts.writequeue.apply_rates",
+                        side_effect=DatabaseError):
+            self.assertEqual(writequeue.flush(), 2)
+
+        self.assertEqual(Comment.objects.count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.rate_sum, self.post.rate_count), (4, 1))
+
+
+@override_settings(POSTS_WRITE_QUEUE=True, POSTS_WRITE_QUEUE_INTERVAL=0,
+                   POSTS_WRITE_QUEUE_BATCH=100)
+class WriteQueueShutdownTests(TransactionTestCase):
+    # Очередь по сигналу пишет отдельный поток со своим соединением
+    def setUp(self):
+        cache.clear()
+        self.author = get_user_model().objects.create(username="Stopping")
+        self.post = Post.objects.create(text="Пост перед остановкой",
+                                        author=self.author)
+        original = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, original)
+
+    def test_sigterm_flushes_queue_before_previous_handler(self):
+        """SIGTERM записывает очередь и передает сигнал прежнему
+        обработчику"""
+        previous = mock.Mock(
+            side_effect=lambda *args: self.assertTrue(
+                Comment.objects.filter(text="До сигнала").exists()
+            )
+        )
+        signal.signal(signal.SIGTERM, previous)
+        self.assertTrue(writequeue.install_signal_handler())
+        # Повторная установка не оборачивает обработчик второй раз
+        self.assertTrue(writequeue.install_signal_handler())
+        writequeue.save_comment(
+            Comment(post=self.post, author=self.author, text="До сигнала"),
+            self.post,
+        )
+
+        os.kill(os.getpid(), signal.SIGTERM)
+
+        previous.assert_called_once()
+        self.assertEqual(Comment.objects.count(), 1)
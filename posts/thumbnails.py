@@ -0,0 +1,199 @@
+"""Фоновая подготовка миниатюр картинок постов.
+
+Шаблоны получают только уже готовые миниатюры: если миниатюры нет,
+DeferredThumbnailBackend ставит картинку в очередь пула потоков и
+возвращает None, а тег {% thumbnail %} показывает ветку {% empty %}
+с исходной картинкой. Одна картинка обрабатывается одним заданием,
+сколько бы запросов ее ни ждали. prefetch_thumbnails заранее достает
+записи хранилища sorl для всей страницы одним запросом, чтобы карточки
+не искали каждую миниатюру отдельно.
+
+Кроме основной миниатюры 960x339 готовятся те же кадры шириной
+POSTS_IMAGE_WIDTHS; card_srcset собирает из готовых атрибут srcset,
+и узкие экраны скачивают меньше.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from .cache import touch_post
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Кадр карточки из post_card.html (crop="top") и picture.html
+# (crop="center")
+CARD_SIZE = (960, 339)
+CARD_CROPS = ("top", "center")
+
+_executor = None
+# Задания в работе по именам картинок
+_pending = {}
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.POSTS_THUMBNAIL_WORKERS,
+                thread_name_prefix="thumbnails",
+            )
+        return _executor
+
+
+def schedule_thumbnails(image):
+    """Поставить картинку в очередь после фиксации транзакции."""
+    if not image or not settings.POSTS_THUMBNAIL_WORKERS:
+        return
+    transaction.on_commit(lambda: _submit(image))
+
+
+def _submit(image):
+    executor = _get_executor()
+    with _lock:
+        if _name(image) in _pending:
+            return
+        _pending[_name(image)] = executor.submit(generate_thumbnails, image)
+
+
+def wait_for_thumbnails(timeout=None):
+    """Дождаться заданий в очереди; нужно тестам, чтобы фоновый поток
+    не обращался к базе, пока ее очищают."""
+    with _lock:
+        futures = list(_pending.values())
+    wait(futures, timeout)
+
+
+def _name(image):
+    return getattr(image, "name", image)
+
+
+def card_geometries(crop):
+    """Основная миниатюра карточки, как в шаблоне, и ее ширины для
+    srcset. Узкие варианты не увеличиваются сверх исходной картинки."""
+    width, height = CARD_SIZE
+    geometries = [(f"{width}x{height}", {"crop": crop, "upscale": True})]
+    for extra in sorted(set(settings.POSTS_IMAGE_WIDTHS) - {width}):
+        geometries.append((f"{extra}x{round(extra * height / width)}",
+                           {"crop": crop, "upscale": False}))
+    return geometries
+
+
+def thumbnail_geometries():
+    return [geometry for crop in CARD_CROPS
+            for geometry in card_geometries(crop)]
+
+
+def card_srcset(image, crop):
+    """srcset из готовых миниатюр карточки; недостающие ставятся в
+    очередь."""
+    if not image:
+        return ""
+    thumbnails = (default.backend.get_thumbnail(image, geometry, **options)
+                  for geometry, options in card_geometries(crop))
+    widths = {thumbnail.width: thumbnail.url
+              for thumbnail in thumbnails if thumbnail}
+    return ", ".join(f"{url} {width}w"
+                     for width, url in sorted(widths.items()))
+
+
+def generate_thumbnails(image):
+    """Синхронно создать все миниатюры картинки и сбросить кеш карточек
+    постов, которые ее показывают."""
+    backend = ThumbnailBackend()
+    try:
+        for geometry, options in thumbnail_geometries():
+            backend.get_thumbnail(image, geometry, **options)
+        posts = Post.objects.filter(image=_name(image)).values_list(
+            "pk", "author_id", "group_id"
+        )
+        for post_id, author_id, group_id in posts:
+            touch_post(post_id, author_id, group_id)
+    except Exception:
+        logger.exception("Не удалось создать миниатюры %s", _name(image))
+    finally:
+        with _lock:
+            _pending.pop(_name(image), None)
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def prefetch_thumbnails(posts):
+    """Положить в кеш sorl записи о миниатюрах картинок posts одним
+    запросом, включая отметки об отсутствующих."""
+    kvstore = default.kvstore
+    backend = default.backend
+    if (not settings.POSTS_THUMBNAIL_WORKERS
+            or not isinstance(kvstore, CachedDBStore)
+            or not isinstance(backend, DeferredThumbnailBackend)):
+        return
+    keys = [
+        add_prefix(backend.thumbnail_file(post.image, geometry, options).key)
+        for post in posts if post.image
+        for geometry, options in thumbnail_geometries()
+    ]
+    if not keys:
+        return
+    missing = set(keys) - set(kvstore.cache.get_many(keys))
+    if not missing:
+        return
+    found = dict(KVStoreModel.objects.filter(key__in=missing)
+                 .values_list("key", "value"))
+    kvstore.cache.set_many(
+        {key: found.get(key, EMPTY_VALUE) for key in missing},
+        sorl_settings.THUMBNAIL_CACHE_TIMEOUT,
+    )
+
+
+class DeferredThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который не ресайзит картинки внутри запроса."""
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_ or not settings.POSTS_THUMBNAIL_WORKERS:
+            return super().get_thumbnail(file_, geometry_string, **options)
+
+        cached = default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, options)
+        )
+        if cached:
+            return cached
+
+        schedule_thumbnails(file_)
+        return None
+
+    def thumbnail_file(self, file_, geometry_string, options):
+        """Файл миниатюры, который создаст get_thumbnail, без
+        обращения к хранилищу."""
+        source = ImageFile(file_)
+        name = self._get_thumbnail_filename(
+            source, geometry_string, self._prepare_options(source, options)
+        )
+        return ImageFile(name, default.storage)
+
+    def _prepare_options(self, source, options):
+        # Те же умолчания, что подставляет ThumbnailBackend.get_thumbnail:
+        # от них зависит имя файла миниатюры
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault("format", self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
@@ -0,0 +1,191 @@
+"""Материализованные ленты подписок (fan-out on write).
+
+При публикации пост раскладывается в ленты всех подписчиков автора,
+и /follow/ читает готовую ленту диапазоном по индексу (user, pub_date)
+вместо соединения Follow и Post на каждый просмотр. Авторов, у которых
+подписчиков больше POSTS_TIMELINE_FANOUT_LIMIT, не раскладываем: их
+посты выбираются при чтении отдельным запросом с тем же LIMIT и
+сливаются с лентой.
+
+В лентах лежат посты ровно тех авторов, что не больше порога: автор,
+перешедший порог, убирается из лент подписчиков, а опустившийся до
+порога раскладывается по ним заново вместе со старыми постами. После
+смены POSTS_TIMELINE_FANOUT_LIMIT ленты пересобирает
+rebuild_timelines.
+"""
+import heapq
+import itertools
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import Follow, Post, ProfileStats, TimelineEntry
+
+BATCH_SIZE = 500
+
+
+def _heavy(followers):
+    """Отобрать авторов, которые читаются без раскладки.
+
+    followers — {id автора: число подписчиков из ProfileStats или None,
+    если строки счетчиков нет}; недостающие числа считаются по Follow.
+    """
+    missing = [pk for pk, count in followers.items() if count is None]
+    if missing:
+        followers.update(
+            Follow.objects.filter(author_id__in=missing).order_by()
+            .values("author_id").annotate(count=Count("pk"))
+            .values_list("author_id", "count")
+        )
+    limit = settings.POSTS_TIMELINE_FANOUT_LIMIT
+    return [pk for pk, count in followers.items() if (count or 0) > limit]
+
+
+def is_heavy_author(author_id):
+    followers = ProfileStats.objects.filter(user_id=author_id).values_list(
+        "followers_count", flat=True
+    ).first()
+    return bool(_heavy({author_id: followers}))
+
+
+def heavy_authors(user):
+    """id авторов из подписок user, которые читаются без раскладки."""
+    return _heavy(dict(
+        Follow.objects.filter(user=user).values_list(
+            "author_id", "author__stats__followers_count"
+        )
+    ))
+
+
+class Timeline:
+    """Лента подписок user для Paginator и CursorPaginator.
+
+    Страница собирается из двух выборок по ключу (pub_date, id): записей
+    TimelineEntry по индексу ленты и постов тяжелых авторов. Каждая
+    ограничена концом страницы, после слияния посты страницы читаются
+    через Post.objects.feed() по id.
+    """
+
+    ordered = True
+
+    def __init__(self, user):
+        self.user = user
+        self.heavy = heavy_authors(user)
+
+    def count(self):
+        count = TimelineEntry.objects.filter(user=self.user).count()
+        if self.heavy:
+            count += Post.objects.filter(author_id__in=self.heavy).count()
+        return count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError("Timeline supports only slices without step")
+        keys = self._merged_keys(None, True, index.stop)
+        # Посты читаются только для самой страницы, а не для всех
+        # ключей до ее конца
+        return self._posts(keys[index.start or 0:])
+
+    def keyset(self, position, descending, limit):
+        """limit постов после ключа position (pub_date, id) в порядке
+        убывания или, если not descending, возрастания."""
+        return self._posts(self._merged_keys(position, descending, limit))
+
+    def _merged_keys(self, position, descending, limit):
+        entries = TimelineEntry.objects.filter(user=self.user)
+        keys = [self._keys(entries, "post_id", position, descending, limit)]
+        if self.heavy:
+            posts = Post.objects.filter(author_id__in=self.heavy)
+            keys.append(self._keys(posts, "id", position, descending,
+                                   limit))
+        return list(itertools.islice(
+            heapq.merge(*keys, reverse=descending), limit
+        ))
+
+    @staticmethod
+    def _posts(keys):
+        posts = Post.objects.feed().in_bulk([pk for _, pk in keys])
+        return [posts[pk] for _, pk in keys if pk in posts]
+
+    @staticmethod
+    def _keys(queryset, id_field, position, descending, limit):
+        sign = "-" if descending else ""
+        if position is not None:
+            value, pk = position
+            compare = "lt" if descending else "gt"
+            queryset = queryset.filter(
+                Q(**{f"pub_date__{compare}": value})
+                | Q(**{"pub_date": value, f"{id_field}__{compare}": pk})
+            )
+        queryset = queryset.order_by(f"{sign}pub_date", f"{sign}{id_field}")
+        return list(queryset.values_list("pub_date", id_field)[:limit])
+
+
+def timeline_posts(user):
+    """Лента подписок user в виде выборки для пагинации."""
+    return Timeline(user)
+
+
+def fan_out_post(post):
+    """Разложить новый пост по лентам подписчиков автора."""
+    if is_heavy_author(post.author_id):
+        return
+    followers = Follow.objects.filter(author_id=post.author_id).values_list(
+        "user_id", flat=True
+    )
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def add_follow(user_id, author_id):
+    """Дополнить ленту нового подписчика уже опубликованными постами."""
+    followers = _followers(author_id)
+    limit = settings.POSTS_TIMELINE_FANOUT_LIMIT
+    if followers == limit + 1:
+        # Автор перешел порог: дальше его посты читаются без раскладки
+        TimelineEntry.objects.filter(post__author_id=author_id).delete()
+    if followers <= limit:
+        _fill([user_id], author_id)
+
+
+def remove_follow(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 post__author_id=author_id).delete()
+    if _followers(author_id) == settings.POSTS_TIMELINE_FANOUT_LIMIT:
+        # Автор опустился до порога: без раскладки его посты пропали бы
+        # из лент оставшихся подписчиков
+        _fill(Follow.objects.filter(author_id=author_id)
+              .values_list("user_id", flat=True), author_id)
+
+
+def rebuild_timelines():
+    """Пересобрать все ленты заново; возвращает число подписок."""
+    TimelineEntry.objects.all().delete()
+    follows = Follow.objects.values_list("user_id", "author_id")
+    count = 0
+    for user_id, author_id in follows.iterator():
+        if not is_heavy_author(author_id):
+            _fill([user_id], author_id)
+        count += 1
+    return count
+
+
+def _followers(author_id):
+    return Follow.objects.filter(author_id=author_id).count()
+
+
+def _fill(user_ids, author_id):
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        "id", "pub_date"
+    )
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for user_id in user_ids
+         for post_id, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
@@ -0,0 +1,482 @@
+"""Потоковый импорт и экспорт групп, постов, комментариев, подписок и
+оценок.
+
+Каждая таблица лежит в своем файле каталога (groups, posts, comments,
+follows, rates) в формате NDJSON или CSV. Экспорт читает базу
+итератором, импорт копит строки пачками по batch_size и сохраняет их
+через bulk_create, поэтому память не зависит от размера файлов.
+Пользователи передаются по username (недостающие создаются без
+пароля), группы — по slug. Посты узнаются по автору, дате и тексту,
+комментарии — по посту, автору, дате и тексту, поэтому повторный импорт
+пропускает уже загруженные строки. Новая строка сохраняет id из файла,
+если он свободен, иначе получает следующий за последним. Комментарии и
+оценки ссылаются на посты по id из файла: соответствие id из файла
+локальным id копится во временной таблице базы (IdMap), общей для всех
+таблиц одного импорта, и ссылки каждой пачки переводятся запросом к
+ней. Строки со ссылкой на пост не из этого импорта пропускаются.
+
+bulk_create не отправляет сигналы, поэтому после импорта оценки,
+счетчики профилей, ленты подписок и поисковый индекс пересобираются
+целиком, а кеш версий сбрасывается.
+"""
+import csv
+import datetime
+import json
+import os
+import shutil
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files import File
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import reset_versions
+from .models import Comment, Follow, Group, Post, PostRate, User
+from .ratings import recount_ratings
+from .search import rebuild_index
+from .stats import rebuild_profile_stats
+from .storage import post_images
+from .timeline import rebuild_timelines
+
+FORMATS = ("ndjson", "csv")
+BATCH_SIZE = 500
+
+# Порядок важен для импорта: посты ссылаются на группы, комментарии и
+# оценки — на посты
+COLUMNS = {
+    "groups": (
+        ("slug", "slug"),
+        ("title", "title"),
+        ("description", "description"),
+    ),
+    "posts": (
+        ("id", "id"),
+        ("author", "author__username"),
+        ("group", "group__slug"),
+        ("pub_date", "pub_date"),
+        ("text", "text"),
+        ("image", "image"),
+    ),
+    "comments": (
+        ("id", "id"),
+        ("post", "post_id"),
+        ("author", "author__username"),
+        ("created", "created"),
+        ("text", "text"),
+        ("parent", "parent_id"),
+    ),
+    "follows": (
+        ("user", "user__username"),
+        ("author", "author__username"),
+    ),
+    "rates": (
+        ("post", "post_id"),
+        ("user", "user__username"),
+        ("rate", "rate"),
+    ),
+}
+MODELS = {
+    "groups": Group,
+    "posts": Post,
+    "comments": Comment,
+    "follows": Follow,
+    "rates": PostRate,
+}
+
+
+def export_data(directory, fmt="ndjson", images=None):
+    """Выгрузить все таблицы в directory; возвращает число строк по
+    таблицам. С images копирует туда же файлы картинок постов."""
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    for name, columns in COLUMNS.items():
+        lookups = [lookup for column, lookup in columns]
+        rows = (MODELS[name].objects.order_by("pk")
+                .values_list(*lookups).iterator())
+        path = os.path.join(directory, f"{name}.{fmt}")
+        counts[name] = _write(path, fmt, [column for column, _ in columns],
+                              rows)
+    if images is not None:
+        counts["images"] = export_images(images)
+    return counts
+
+
+def export_images(directory):
+    """Скопировать картинки постов из хранилища в directory."""
+    copied = 0
+    names = (Post.objects.exclude(image="").exclude(image=None)
+             .values_list("image", flat=True).distinct().iterator())
+    for name in names:
+        target = os.path.join(directory, name)
+        if os.path.exists(target) or not post_images.exists(name):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with post_images.open(name) as source, \
+                open(target, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+        copied += 1
+    return copied
+
+
+def import_data(directory, images=None, batch_size=BATCH_SIZE,
+                rebuild=True):
+    """Загрузить таблицы из directory; возвращает число прочитанных строк
+    по таблицам. Файлы могут быть и в NDJSON, и в CSV."""
+    counts = {}
+    with IdMap() as ids:
+        for name in COLUMNS:
+            path = _find_dataset(directory, name)
+            if path is not None:
+                counts[name] = load_records(name, _read(path),
+                                            images=images,
+                                            batch_size=batch_size, ids=ids)
+
+    finish_import(rebuild)
+    return counts
+
+
+def load_records(name, records, images=None, batch_size=BATCH_SIZE,
+                 ids=None):
+    """Сохранить поток записей таблицы name в формате файлов выгрузки;
+    возвращает число записей. Производные данные не пересобирает.
+
+    ids — IdMap с соответствием id из файла локальным id; чтобы
+    комментарии и оценки нашли свои посты, таблицы одного импорта
+    загружаются с общим IdMap.
+    """
+    if ids is None:
+        with IdMap() as ids:
+            return load_records(name, records, images, batch_size, ids)
+    count = 0
+    for batch in _batches(records, batch_size):
+        with transaction.atomic():
+            _LOADERS[name](batch, images, ids)
+        count += len(batch)
+    return count
+
+
+class IdMap:
+    """Соответствие id из файла локальным id по таблицам импорта.
+
+    Лежит во временной таблице соединения, а не в памяти: файл может
+    быть сколь угодно большим, а пачке нужны только ее ссылки. Таблица
+    создается на входе в with и удаляется на выходе.
+    """
+    table = "posts_transfer_ids"
+    chunk_size = 500
+
+    def __enter__(self):
+        name = connection.ops.quote_name(self.table)
+        with connection.cursor() as cursor:
+            # Таблица могла остаться от прерванного импорта
+            cursor.execute(f"DROP TABLE IF EXISTS {name}")
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {name} ("
+                "kind varchar(16) NOT NULL, source bigint NOT NULL, "
+                "local bigint NOT NULL, PRIMARY KEY (kind, source))"
+            )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # После ошибки транзакция PostgreSQL может быть прервана;
+        # временная таблица тогда исчезнет вместе с соединением
+        if exc_type is None:
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE "
+                               + connection.ops.quote_name(self.table))
+
+    def add(self, kind, pairs):
+        """Запомнить пары (id из файла, локальный id) таблицы kind."""
+        name = connection.ops.quote_name(self.table)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {name} (kind, source, local) "
+                "VALUES (%s, %s, %s) ON CONFLICT (kind, source) "
+                "DO UPDATE SET local = excluded.local",
+                [(kind, source, local) for source, local in pairs],
+            )
+
+    def get(self, kind, sources):
+        """Локальные id по id из файла; неизвестных id в ответе нет."""
+        name = connection.ops.quote_name(self.table)
+        sources = sorted(set(sources) - {None})
+        found = {}
+        with connection.cursor() as cursor:
+            for start in range(0, len(sources), self.chunk_size):
+                chunk = sources[start:start + self.chunk_size]
+                marks = ", ".join(["%s"] * len(chunk))
+                cursor.execute(
+                    f"SELECT source, local FROM {name} "
+                    f"WHERE kind = %s AND source IN ({marks})",
+                    [kind, *chunk],
+                )
+                found.update(cursor.fetchall())
+        return found
+
+
+def finish_import(rebuild=True):
+    """Завершить загрузку: сдвинуть счетчики id, если rebuild,
+    пересобрать производные данные и сменить версии лент."""
+    _reset_sequences(Post, Comment)
+    if rebuild:
+        rebuild_after_import()
+    # bulk_create не отправляет сигналов, сбрасывающих версии, а без
+    # новых версий ленты отвечали бы 304 по старым ETag
+    reset_versions()
+
+
+def rebuild_after_import():
+    """Пересобрать все производные данные после bulk_create."""
+    recount_ratings()
+    rebuild_profile_stats()
+    rebuild_timelines()
+    rebuild_index()
+    cache.clear()
+
+
+def _write(path, fmt, columns, rows):
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow("" if value is None else _plain(value)
+                                for value in row)
+                count += 1
+        else:
+            for row in rows:
+                record = dict(zip(columns, map(_plain, row)))
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def _plain(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _find_dataset(directory, name):
+    for fmt in FORMATS:
+        path = os.path.join(directory, f"{name}.{fmt}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _read(path):
+    with open(path, encoding="utf-8", newline="") as file:
+        if path.endswith(".csv"):
+            for record in csv.DictReader(file):
+                yield {key: value if value != "" else None
+                       for key, value in record.items()}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _date(value):
+    date = parse_datetime(value) if value else None
+    if date is None:
+        return timezone.now()
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, timezone.utc)
+    return date
+
+
+def _user_ids(usernames):
+    """id пользователей по username; недостающие создаются без пароля."""
+    usernames = set(filter(None, usernames))
+    ids = dict(User.objects.filter(username__in=usernames)
+               .values_list("username", "id"))
+    missing = usernames - ids.keys()
+    if missing:
+        User.objects.bulk_create(
+            (User(username=username, password=make_password(None))
+             for username in missing),
+            ignore_conflicts=True,
+        )
+        ids.update(User.objects.filter(username__in=missing)
+                   .values_list("username", "id"))
+    return ids
+
+
+def _source_id(value):
+    return int(value) if value else None
+
+
+def _assign_ids(model, date_field, key_fields, objects, sources, known):
+    """Проставить объектам локальные id; возвращает новые объекты.
+
+    Объект, совпавший по естественному ключу (date_field и key_fields) со
+    строкой в базе или в этой же пачке, не создается. Новый объект
+    сохраняет id из файла, если тот свободен, иначе получает следующий
+    за последним. known пополняется соответствием id из файла локальным
+    для строк пачки.
+    """
+    fields = (date_field, *key_fields)
+    rows = model.objects.filter(**{
+        f"{date_field}__in": {getattr(obj, date_field) for obj in objects}
+    }).values_list("pk", *fields)
+    existing = {tuple(row[1:]): row[0] for row in rows}
+    taken = set(model.objects.filter(pk__in=set(sources) - {None})
+                .values_list("pk", flat=True))
+    next_id = None
+    created = []
+    for obj, source in zip(objects, sources):
+        key = tuple(getattr(obj, field) for field in fields)
+        if key not in existing:
+            if source is None or source in taken:
+                if next_id is None:
+                    last = model.objects.aggregate(last=Max("pk"))["last"]
+                    next_id = max([last or 0, *filter(None, sources)]) + 1
+                source_pk, next_id = next_id, next_id + 1
+            else:
+                source_pk = source
+            obj.pk = existing[key] = source_pk
+            taken.add(source_pk)
+            created.append(obj)
+        if source is not None:
+            known[source] = existing[key]
+    return created
+
+
+def _create(model, date_field, objects):
+    # auto_now_add заменяет дату при вставке, поэтому даты из файла
+    # пишутся отдельным UPDATE в той же транзакции
+    dates = [getattr(obj, date_field) for obj in objects]
+    model.objects.bulk_create(objects)
+    for obj, date in zip(objects, dates):
+        setattr(obj, date_field, date)
+    model.objects.bulk_update(objects, [date_field])
+
+
+def _load_groups(records, images, ids):
+    Group.objects.bulk_create(
+        (Group(slug=record["slug"],
+               title=record["title"],
+               description=record.get("description"))
+         for record in records),
+        ignore_conflicts=True,
+    )
+
+
+def _load_posts(records, images, ids):
+    users = _user_ids(record["author"] for record in records)
+    groups = dict(Group.objects.filter(
+        slug__in={record["group"] for record in records if record["group"]}
+    ).values_list("slug", "id"))
+
+    posts = [Post(author_id=users[record["author"]],
+                  group_id=groups.get(record["group"]),
+                  pub_date=_date(record["pub_date"]),
+                  text=record["text"] or "",
+                  image=record.get("image") or "")
+             for record in records]
+    known = {}
+    _create(Post, "pub_date", _assign_ids(
+        Post, "pub_date", ("author_id", "text"), posts,
+        [_source_id(record["id"]) for record in records], known,
+    ))
+    ids.add("posts", known.items())
+    if images is not None:
+        _import_images(images, (record.get("image") for record in records))
+
+
+def _import_images(directory, names):
+    for name in filter(None, names):
+        source = os.path.join(directory, name)
+        if post_images.exists(name) or not os.path.exists(source):
+            continue
+        with open(source, "rb") as file:
+            post_images.restore(name, File(file))
+
+
+def _load_comments(records, images, ids):
+    users = _user_ids(record["author"] for record in records)
+    posts = ids.get("posts", (_source_id(record["post"])
+                              for record in records))
+    records = [record for record in records
+               if _source_id(record["post"]) in posts]
+
+    comments = [Comment(post_id=posts[_source_id(record["post"])],
+                        author_id=users[record["author"]],
+                        created=_date(record["created"]),
+                        text=record["text"] or "")
+                for record in records]
+    known = {}
+    created = _assign_ids(
+        Comment, "created", ("post_id", "author_id", "text"), comments,
+        [_source_id(record["id"]) for record in records], known,
+    )
+    # Выгрузка идет по pk, поэтому корень ветки уже загружен или лежит в
+    # этой же пачке; ответ на пропущенный комментарий становится корнем
+    parents = [_source_id(record.get("parent")) for record in records]
+    loaded = {**ids.get("comments", set(parents) - known.keys()), **known}
+    for comment, parent in zip(comments, parents):
+        comment.parent_id = loaded.get(parent)
+    _create(Comment, "created", created)
+    ids.add("comments", known.items())
+
+
+def _load_follows(records, images, ids):
+    users = _user_ids(username for record in records
+                      for username in (record["user"], record["author"]))
+
+    Follow.objects.bulk_create(
+        (Follow(user_id=users[record["user"]],
+                author_id=users[record["author"]])
+         for record in records if record["user"] != record["author"]),
+        ignore_conflicts=True,
+    )
+
+
+def _load_rates(records, images, ids):
+    users = _user_ids(record["user"] for record in records)
+    posts = ids.get("posts", (_source_id(record["post"])
+                              for record in records))
+
+    PostRate.objects.bulk_create(
+        (PostRate(post_id=posts[_source_id(record["post"])],
+                  user_id=users[record["user"]],
+                  rate=None if record["rate"] is None
+                  else int(record["rate"]))
+         for record in records if _source_id(record["post"]) in posts),
+        ignore_conflicts=True,
+    )
+
+
+_LOADERS = {
+    "groups": _load_groups,
+    "posts": _load_posts,
+    "comments": _load_comments,
+    "follows": _load_follows,
+    "rates": _load_rates,
+}
+
+
+def _reset_sequences(*models):
+    # Посты и комментарии получили id при импорте: счетчики автоинкремента
+    # PostgreSQL нужно сдвинуть за них
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
@@ -1,17 +1,46 @@
-from django.urls import path
-from . import views
+from django.conf import settings
+from django.urls import path, register_converter
+from . import feeds, metrics, views
+
+# Ленты и страницы постов — корутинами под ASGI
+if settings.POSTS_ASYNC_VIEWS:
+    from . import async_views as read_views
+else:
+    read_views = views
+
+
+class FeedFormatConverter:
+    regex = "rss|atom"
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+register_converter(FeedFormatConverter, "feed")
 
 
 app_name = "posts"
 
 urlpatterns = [
-    path("", views.index, name="index"),
-    path("group/<slug:slug>/", views.group_posts, name="group"),
+    path("", read_views.index, name="index"),
+    path("group/<slug:slug>/", read_views.group_posts, name="group"),
+    path("group/<slug:slug>/<feed:feed_format>/", feeds.group_feed,
+         name="group_feed"),
+    path("feed/<feed:feed_format>/", feeds.index_feed, name="index_feed"),
     path("new_group/", views.new_group, name="new_group"),
     path("new/", views.new_post, name="new_post"),
-    path("follow/", views.follow_index, name="follow_index"),
-    path("<str:username>/", views.profile, name="profile"),
-    path("<str:username>/<int:post_id>/", views.post_view, name="post"),
+    path("follow/", read_views.follow_index, name="follow_index"),
+    # Служебные страницы — под префиксом "-/": одиночный сегмент занял
+    # бы адрес профиля пользователя с таким именем
+    path("-/search/", views.search, name="search"),
+    path("-/metrics/", metrics.metrics_view, name="metrics"),
+    path("<str:username>/", read_views.profile, name="profile"),
+    path("<str:username>/<feed:feed_format>/", feeds.profile_feed,
+         name="profile_feed"),
+    path("<str:username>/<int:post_id>/", read_views.post_view, name="post"),
     path(
         "<str:username>/<int:post_id>/edit/",
         views.post_edit,
@@ -22,6 +51,16 @@ urlpatterns = [
         views.add_comment,
         name="add_comment"
     ),
+    path(
+        "<str:username>/<int:post_id>/comments/",
+        views.post_comments,
+        name="post_comments"
+    ),
+    path(
+        "<str:username>/<int:post_id>/comments/<int:comment_id>/replies/",
+        views.comment_replies,
+        name="comment_replies"
+    ),
     path(
         "<str:username>/follow/",
         views.profile_follow,
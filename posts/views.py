@@ -1,29 +1,72 @@
 from django.shortcuts import render, get_object_or_404
 from django.shortcuts import redirect, HttpResponseRedirect
+from django.http import JsonResponse
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.core.paginator import Paginator
-from django.views.decorators.cache import cache_page
+from django.conf import settings
+from django.db import transaction
+from django.views.decorators.http import condition
 from pytils.translit import slugify
-from django.db.models import Avg
 
 
-from .models import Post, Group, User, Follow, PostRate
-from .forms import PostForm, CommentForm, GroupForm
+from .models import Post, Group, User, Follow, Comment
+from . import freshness
+from .forms import PostForm, CommentForm, GroupForm, SearchForm
+from .cache import attach_card_versions, feed_count
+from .comments import (comment_data, comment_page, reply_page,
+                       reply_parent_id)
+from .pagecache import cache_anonymous_page
+from .paginators import CursorPaginator
+from .search import search_posts
+from .stats import get_stats, profile_summaries
+from .thumbnails import prefetch_thumbnails, schedule_thumbnails
+from .timeline import timeline_posts
+from .writequeue import (apply_pending_rates, pending_comments,
+                         save_comment, save_rate)
+
+
+def paginate(request, posts, per_page=10, scope=None):
+    """Разбить ленту на страницы.
+
+    По умолчанию — обычный Paginator с номерами страниц; курсорный режим
+    включается настройкой POSTS_CURSOR_PAGINATION или параметром
+    ?cursor= в запросе. Для ленты с версией scope (см. posts.cache)
+    число постов берется из кеша.
+    """
+    if settings.POSTS_CURSOR_PAGINATION or "cursor" in request.GET:
+        paginator = CursorPaginator(posts, per_page)
+        page = paginator.get_page(request.GET.get("cursor"))
+    else:
+        paginator = Paginator(posts, per_page)
+        if scope is not None:
+            paginator.count = feed_count(scope, posts)
+        page = paginator.get_page(request.GET.get("page"))
+
+    attach_card_versions(page)
+    apply_pending_rates(request.user, page)
+    prefetch_thumbnails(page)
+    return page, paginator
 
 
-#@cache_page(20)
+@condition(etag_func=freshness.index_etag,
+           last_modified_func=freshness.index_last_modified)
+@cache_anonymous_page(freshness.index_etag,
+                      freshness.index_last_modified)
 def index(request):
-    latest = Post.objects.all()
-    paginator = Paginator(latest, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    latest = Post.objects.feed()
+    page, paginator = paginate(request, latest, scope="index")
 
     return render(request, "posts/index.html", {"page": page,
                                                 "paginator": paginator,
                                                 "latest": latest})
 
 
+@condition(etag_func=freshness.group_etag,
+           last_modified_func=freshness.group_last_modified)
+@cache_anonymous_page(freshness.group_etag,
+                      freshness.group_last_modified)
 def group_posts(request, slug):
     group_count = Group.objects.filter(slug=slug).count()
     if group_count == 0:
@@ -33,10 +76,9 @@ def group_posts(request, slug):
     )
     else:
         group = get_object_or_404(Group, slug=slug)
-        posts = group.posts.all()
-        paginator = Paginator(posts, 10)
-        page_number = request.GET.get("page")
-        page = paginator.get_page(page_number)
+        posts = group.posts.feed()
+        page, paginator = paginate(request, posts,
+                                   scope=f"group:{group.pk}")
 
         context = {
             "group": group,
@@ -53,6 +95,7 @@ def group_posts(request, slug):
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
 
     author = get_object_or_404(User, username=username)
@@ -73,6 +116,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     user = request.user
@@ -86,6 +130,7 @@ def profile_unfollow(request, username):
 
 
 @login_required
+@transaction.atomic
 def new_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
 
@@ -96,34 +141,30 @@ def new_post(request):
     post.author = request.user
 
     post.save()
+    schedule_thumbnails(post.image)
     return redirect(reverse_lazy("posts:index"))
 
 
+@condition(etag_func=freshness.profile_etag,
+           last_modified_func=freshness.profile_last_modified)
+@cache_anonymous_page(freshness.profile_etag,
+                      freshness.profile_last_modified)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
     user = request.user
+    author = get_object_or_404(profile_summaries(user), username=username)
+    stats = get_stats(author)
 
-    latest = author.posts.all()
+    latest = author.posts.feed()
 
-    paginator = Paginator(latest, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    page, paginator = paginate(request, latest, scope=f"author:{author.pk}")
 
     # Функция для тестов на подписку/отписку
-    following = Follow.objects.filter(author=author).count()
-    if user.is_authenticated:
-        count = Follow.objects.filter(user=user, author=author).count()
-    else:
-        count = 0
-
-    if user == author or count == 0:
-        db_name = None
-    else:
-        follow_user = Follow.objects.get(user=user, author=author)
-        db_name = follow_user.author
+    following = stats.followers_count
+    db_name = author if author.is_following else None
 
     return render(request, "posts/profile.html", {"author": author,
                                                   "user": user,
+                                                  "stats": stats,
                                                   "page": page,
                                                   "paginator": paginator,
                                                   "db_name": db_name,
@@ -150,28 +191,42 @@ def post_edit(request, username, post_id):
                                                        "user": username,
                                                        "post": post})
 
-    form.save()
+    post = form.save()
+    schedule_thumbnails(post.image)
     return redirect(reverse_lazy(
         "posts:post",
         kwargs={"username": username, "post_id": post_id}
     ))
 
 
+@condition(etag_func=freshness.post_etag,
+           last_modified_func=freshness.post_last_modified)
+@cache_anonymous_page(freshness.post_etag,
+                      freshness.post_last_modified)
 def post_view(request, username, post_id):
     # Для ревьюера: автор нужен для формирования информации на странице,
     # не могу удалить его
-    author = get_object_or_404(User, username=username)
     user = request.user
-
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-    comments = post.comments.all()
+    author = get_object_or_404(profile_summaries(user), username=username)
+
+    post = get_object_or_404(Post.objects.feed(),
+                             id=post_id,
+                             author__username=username)
+    attach_card_versions([post])
+    apply_pending_rates(user, [post])
+    comments, comments_page = comment_page(post.pk,
+                                           request.GET.get("comments"))
+    pending = pending_comments(user, post.pk)
     form = CommentForm(request.POST or None)
 
     return render(request, "posts/post.html", {"form": form,
                                                "author": author,
+                                               "stats": get_stats(author),
                                                "user": user,
                                                "post": post,
                                                "comments": comments,
+                                               "comments_page": comments_page,
+                                               "pending_comments": pending,
                                                "post_id": post_id})
 
 
@@ -185,14 +240,68 @@ def add_comment(request, username, post_id):
 
     comment.post = post
     comment.author = request.user
+    comment.parent_id = reply_parent_id(post.pk, request.POST.get("parent"))
 
-    comment.save()
+    save_comment(comment, post)
     return redirect(reverse_lazy(
         "posts:post",
         kwargs={"username": username, "post_id": post_id}
     ))
 
 
+@condition(etag_func=freshness.post_etag,
+           last_modified_func=freshness.post_last_modified)
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев поста в JSON: данные, готовый
+    HTML для вставки и адрес следующей страницы."""
+    post = get_object_or_404(Post.objects.select_related("author"),
+                             id=post_id,
+                             author__username=username)
+    comments, page = comment_page(post.pk, request.GET.get("cursor"))
+
+    next_url = None
+    if page.has_next():
+        next_url = reverse("posts:post_comments", kwargs={
+            "username": username, "post_id": post_id
+        }) + f"?cursor={page.next_cursor}"
+    html = render_to_string("comment_list.html", {
+        "comments": comments,
+        "post": post,
+        "author": post.author,
+    }, request=request)
+    return JsonResponse({
+        "comments": [comment_data(comment) for comment in comments],
+        "html": html,
+        "next": next_url,
+    })
+
+
+@condition(etag_func=freshness.post_etag,
+           last_modified_func=freshness.post_last_modified)
+def comment_replies(request, username, post_id, comment_id):
+    """Следующие ответы на комментарий в JSON: данные, готовый HTML
+    для вставки и адрес следующей страницы ответов."""
+    root = get_object_or_404(Comment.objects.select_related("post__author"),
+                             id=comment_id,
+                             parent=None,
+                             post_id=post_id,
+                             post__author__username=username)
+    page = reply_page(root.pk, request.GET.get("cursor"))
+
+    next_url = None
+    if page.has_next():
+        next_url = reverse("posts:comment_replies", kwargs={
+            "username": username, "post_id": post_id, "comment_id": root.pk
+        }) + f"?cursor={page.next_cursor}"
+    html = render_to_string("reply_list.html", {"replies": page},
+                            request=request)
+    return JsonResponse({
+        "replies": [comment_data(reply) for reply in page],
+        "html": html,
+        "next": next_url,
+    })
+
+
 def page_not_found(request, exception):
     # Переменная exception содержит отладочную информацию
     return render(
@@ -210,15 +319,44 @@ def server_error(request):
 @login_required
 def follow_index(request):
 
-    authors = Post.objects.filter(author__following__user=request.user)
+    authors = timeline_posts(request.user)
 
-    paginator = Paginator(authors, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    page, paginator = paginate(request, authors)
 
     return render(request, "posts/follow.html", {"page": page,
                                                  "paginator": paginator})
 
+def search(request):
+    form = SearchForm(request.GET or None)
+    results = []
+
+    if form.is_valid():
+        author = None
+        if form.cleaned_data["author"]:
+            author = User.objects.filter(
+                username=form.cleaned_data["author"]
+            ).first()
+        if author is not None or not form.cleaned_data["author"]:
+            results = search_posts(form.cleaned_data["q"],
+                                   group=form.cleaned_data["group"],
+                                   author=author)
+
+    paginator = Paginator(results, 10)
+    page = paginator.get_page(request.GET.get("page"))
+    attach_card_versions(page)
+    apply_pending_rates(request.user, page)
+    prefetch_thumbnails(page)
+
+    query = request.GET.copy()
+    query.pop("page", None)
+    page_query = query.urlencode() + "&" if query else ""
+
+    return render(request, "posts/search.html", {"form": form,
+                                                 "page": page,
+                                                 "paginator": paginator,
+                                                 "page_query": page_query})
+
+
 def new_group(request):
 
     form = GroupForm(request.POST or None)#, files=request.FILES or None)
@@ -236,6 +374,7 @@ def new_group(request):
     return redirect(reverse_lazy("posts:group", kwargs={"slug": group_slug}))
 
 
+@transaction.atomic
 def post_del(request, username, post_id):
     
     post = Post.objects.filter(id=post_id, author__username=request.user)
@@ -247,29 +386,13 @@ def post_del(request, username, post_id):
 
 @login_required
 def post_rate(request, username, post_id, rate):
-    
-
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-
-    user = request.user
-    
-    if user.is_authenticated:
-        count = PostRate.objects.filter(post_id=post.pk, user=user).count()
-    else:
-        return HttpResponseRedirect(request.META.get('HTTP_REFERER','/'))
+    back = HttpResponseRedirect(request.META.get("HTTP_REFERER", "/"))
     if rate < 0 or rate > 6:
-        return HttpResponseRedirect(request.META.get('HTTP_REFERER','/'))
-
-    if count == 0:
-        PostRate.objects.create(post_id=post.pk, user=user, rate=rate)
-    else:
-        PostRate.objects.filter(post_id=post.pk, user=user).delete()
-        PostRate.objects.create(post_id=post.pk, user=user, rate=rate)
-    post_rate_avg = PostRate.objects.filter(post_id=post.pk).aggregate(Avg('rate'))
-    post_rate_avg = round(post_rate_avg['rate__avg'],0)
-
-    post.post_rate_avg = post_rate_avg
-    post.save()
+        return back
 
+    post = get_object_or_404(Post.objects.only("id", "author", "group"),
+                             id=post_id,
+                             author__username=username)
+    save_rate(post, request.user.pk, rate)
 
-    return HttpResponseRedirect(request.META.get('HTTP_REFERER','/'))
\ No newline at end of file
+    return back
@@ -0,0 +1,295 @@
+"""Отложенная пачечная запись комментариев и оценок.
+
+Под всплеском кликов каждый комментарий и голос — отдельная пишущая
+транзакция, и в SQLite они выстраиваются в очередь за блокировкой
+записи. С POSTS_WRITE_QUEUE комментарии и голоса копятся в памяти
+воркера и пишутся пачкой в одной транзакции: фоновый поток сбрасывает
+очередь раз в POSTS_WRITE_QUEUE_INTERVAL секунд или как только в ней
+набралось POSTS_WRITE_QUEUE_BATCH записей. Повторные голоса одного
+пользователя за пост схлопываются в последний. Дата комментария в
+базе — время записи пачки, на интервал позже клика.
+
+Пока запись не дошла до базы, автор видит ее сам (read-your-writes):
+ожидающие записи пользователя лежат в общем кеше под PENDING_KEY, и
+страница поста показывает его комментарии, а карточки — рейтинг с
+учетом его голоса. Отметки снимаются последним шагом транзакции пачки,
+до коммита: запись может на время коммита пропасть из виду, но не
+будет учтена дважды — и в базе, и в отметке. Ленты сбрасываются сразу
+при постановке в очередь и еще раз после записи, поэтому ETag не
+отдаст устаревшую страницу.
+
+Очередь сбрасывается при штатном завершении процесса (atexit) и по
+SIGTERM (install_signal_handler, ставится в PostsConfig.ready). При
+SIGKILL или падении процесса несброшенные записи теряются — это цена
+отложенной записи.
+"""
+import atexit
+import logging
+import os
+import signal
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .cache import touch_post
+from .models import Comment, PostRate
+from .ratings import apply_rates, rate_post
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "posts:pending_writes:{}"
+# Сколько живут отметки об ожидающих записях, если пачка не записалась
+PENDING_TIMEOUT = 300
+# Сколько секунд ждать записи очереди при получении SIGTERM
+EXIT_FLUSH_TIMEOUT = 10
+
+# Комментарии в порядке поступления и голоса по (post_id, user_id)
+_comments = []
+_votes = {}
+# Автор и группа постов из очереди — для сброса лент без запросов
+_scopes = {}
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+_sigterm_handler = None
+
+
+def save_comment(comment, post):
+    """Сохранить комментарий сразу или поставить в очередь."""
+    if not settings.POSTS_WRITE_QUEUE:
+        comment.save()
+        return
+    comment.created = timezone.now()
+    token = uuid.uuid4().hex
+    _remember(comment.author_id, "comments", token, {
+        "post_id": post.pk,
+        "parent_id": comment.parent_id,
+        "text": comment.text,
+        "created": comment.created,
+    })
+    with _lock:
+        _comments.append((token, comment))
+    _enqueued(post)
+
+
+def save_rate(post, user_id, rate):
+    """Поставить голос сразу или поставить в очередь."""
+    if not settings.POSTS_WRITE_QUEUE:
+        rate_post(post.pk, user_id, rate, post.author_id, post.group_id)
+        return
+    # Прежний голос нужен только для показа рейтинга автору голоса;
+    # это чтение, блокировка записи ему не нужна
+    previous = PostRate.objects.filter(post_id=post.pk,
+                                       user_id=user_id).values_list(
+        "rate", flat=True
+    ).first()
+    _remember(user_id, "rates", post.pk, (rate, previous))
+    with _lock:
+        _votes[post.pk, user_id] = rate
+    _enqueued(post)
+
+
+def _enqueued(post):
+    with _lock:
+        _scopes[post.pk] = (post.author_id, post.group_id)
+        size = len(_comments) + len(_votes)
+    touch_post(post.pk, post.author_id, post.group_id)
+
+    if settings.POSTS_WRITE_QUEUE_INTERVAL:
+        _start_worker()
+        if size >= settings.POSTS_WRITE_QUEUE_BATCH:
+            _wakeup.set()
+    elif size >= settings.POSTS_WRITE_QUEUE_BATCH:
+        flush()
+
+
+def _start_worker():
+    global _worker
+    with _lock:
+        if _worker is not None:
+            return
+        _worker = threading.Thread(target=_run, name="write-queue",
+                                   daemon=True)
+        _worker.start()
+
+
+def _run():
+    while True:
+        _wakeup.wait(settings.POSTS_WRITE_QUEUE_INTERVAL)
+        _wakeup.clear()
+        _flush_and_close()
+
+
+def flush():
+    """Записать очередь одной транзакцией; возвращает число записей."""
+    global _comments, _votes, _scopes
+    with _flush_lock:
+        with _lock:
+            comments, votes, scopes = _comments, _votes, _scopes
+            _comments, _votes, _scopes = [], {}, {}
+        if not comments and not votes:
+            return 0
+
+        try:
+            with transaction.atomic():
+                Comment.objects.bulk_create(
+                    comment for _, comment in comments
+                )
+                apply_rates(votes)
+                # После коммита отметка учла бы запись второй раз
+                _forget(comments, votes)
+        except DatabaseError:
+            logger.warning("Пачка не записалась целиком, пишем по одной "
+                           "записи", exc_info=True)
+            _forget(comments, votes)
+            _write_one_by_one(comments, votes)
+
+        for post_id, (author_id, group_id) in scopes.items():
+            touch_post(post_id, author_id, group_id)
+        return len(comments) + len(votes)
+
+
+def _write_one_by_one(comments, votes):
+    for _, comment in comments:
+        try:
+            comment.pk = None
+            comment.save()
+        except DatabaseError:
+            # Пост удалили, пока комментарий ждал в очереди
+            logger.exception("Комментарий к посту %s не записан",
+                             comment.post_id)
+    for (post_id, user_id), rate in votes.items():
+        try:
+            rate_post(post_id, user_id, rate)
+        except DatabaseError:
+            logger.exception("Голос за пост %s не записан", post_id)
+
+
+def _remember(user_id, kind, key, value):
+    # get и set не атомарны: параллельный клик того же пользователя
+    # может затереть отметку, и запись станет видна после сброса
+    pending_key = PENDING_KEY.format(user_id)
+    pending = cache.get(pending_key) or {"comments": {}, "rates": {}}
+    pending[kind][key] = value
+    cache.set(pending_key, pending, PENDING_TIMEOUT)
+
+
+def _forget(comments, votes):
+    done = {}
+    for token, comment in comments:
+        done.setdefault(comment.author_id, ([], []))[0].append(token)
+    for post_id, user_id in votes:
+        done.setdefault(user_id, ([], []))[1].append(post_id)
+
+    for user_id, (tokens, post_ids) in done.items():
+        pending_key = PENDING_KEY.format(user_id)
+        pending = cache.get(pending_key)
+        if pending is None:
+            continue
+        for token in tokens:
+            pending["comments"].pop(token, None)
+        with _lock:
+            # Новый голос, пришедший во время записи, еще ждет очереди
+            post_ids = [post_id for post_id in post_ids
+                        if (post_id, user_id) not in _votes]
+        for post_id in post_ids:
+            pending["rates"].pop(post_id, None)
+        if pending["comments"] or pending["rates"]:
+            cache.set(pending_key, pending, PENDING_TIMEOUT)
+        else:
+            cache.delete(pending_key)
+
+
+def _pending(user):
+    if not settings.POSTS_WRITE_QUEUE or not user.is_authenticated:
+        return None
+    return cache.get(PENDING_KEY.format(user.pk))
+
+
+def pending_comments(user, post_id):
+    """Комментарии user к посту, еще не записанные в базу."""
+    pending = _pending(user)
+    if not pending:
+        return []
+    comments = [
+        Comment(author=user, post_id=post_id, text=data["text"],
+                parent_id=data["parent_id"], created=data["created"])
+        for data in pending["comments"].values()
+        if data["post_id"] == post_id
+    ]
+    return sorted(comments, key=lambda comment: comment.created,
+                  reverse=True)
+
+
+def apply_pending_rates(user, posts):
+    """Учесть в рейтинге карточек голоса user из очереди.
+
+    Такие карточки получают свою версию фрагмента, чтобы общий кеш
+    карточек не подхватил рейтинг одного пользователя.
+    """
+    pending = _pending(user)
+    if not pending or not pending["rates"]:
+        return
+    for post in posts:
+        if post.pk not in pending["rates"]:
+            continue
+        rate, previous = pending["rates"][post.pk]
+        post.rate_sum += rate - (previous or 0)
+        post.rate_count += previous is None
+        post.card_version = f"{post.card_version}:{user.pk}:{rate}"
+
+
+@atexit.register
+def _flush_on_exit():
+    if _comments or _votes:
+        flush()
+
+
+def install_signal_handler():
+    """Сбрасывать очередь по SIGTERM перед прежним обработчиком.
+
+    SIGTERM без обработчика завершает процесс без atexit. Прежний
+    обработчик (например, воркера gunicorn) вызывается после записи;
+    если его не было, процесс завершается, как без очереди. Ставится
+    только из главного потока; возвращает, поставлен ли обработчик.
+    """
+    global _sigterm_handler
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signal.SIGTERM)
+    if previous is not None and previous is _sigterm_handler:
+        return True
+
+    def handler(signum, frame):
+        _on_sigterm(signum, frame)
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    _sigterm_handler = handler
+    signal.signal(signal.SIGTERM, handler)
+    return True
+
+
+def _on_sigterm(signum, frame):
+    # Сигнал мог прервать главный поток посреди запроса с открытой
+    # транзакцией, поэтому очередь пишет отдельный поток со своим
+    # соединением
+    writer = threading.Thread(target=_flush_and_close,
+                              name="write-queue-exit")
+    writer.start()
+    writer.join(EXIT_FLUSH_TIMEOUT)
+
+
+def _flush_and_close():
+    try:
+        flush()
+    finally:
+        connection.close()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 #from dotenv import load_dotenv
 
 
@@ -49,6 +50,7 @@ INSTALLED_APPS = [
     'about',
     'users',
     'posts',
+    'api',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -58,9 +60,15 @@ INSTALLED_APPS = [
     'sorl.thumbnail',
     'debug_toolbar',
     'pytils',
+    # rest_framework не подключаем как приложение: API отдает только JSON,
+    # шаблоны browsable API не нужны, а переводы DRF подменяют
+    # сообщения валидации форм Django
+    'django_filters',
 ]
 
 MIDDLEWARE = [
+    'posts.metrics.MetricsMiddleware',
+    'posts.querywatch.QueryWatchMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -103,11 +111,44 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# По умолчанию SQLite; для продакшена задайте DB_ENGINE, например
+# django.db.backends.postgresql, и параметры подключения в окружении
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'django.db.backends.sqlite3')
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.getenv('DB_NAME', os.getenv('POSTGRES_DB', 'yatube')),
+            'USER': os.getenv('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # Постоянные соединения вместо нового на каждый запрос
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        }
+    }
+
+# PRAGMA для каждого нового соединения с SQLite (posts.sqlite): WAL,
+# чтобы чтения не ждали записи оценок и комментариев, и fsync только
+# на контрольных точках. На других СУБД не применяются
+POSTS_SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': 'normal',
+    # Байт файла базы, отображаемых в память
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    # Кеш страниц соединения; отрицательное значение — в КиБ
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64 * 1024)),
+    # Сколько миллисекунд ждать блокировку записи
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
 }
 
 
@@ -168,8 +209,135 @@ EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 # указываем директорию, в которую будут складываться файлы писем
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
+# Курсорная (keyset) пагинация лент вместо номеров страниц.
+# Без флага курсорный режим включается параметром ?cursor= в запросе
+POSTS_CURSOR_PAGINATION = False
+
+# Авторы, у которых подписчиков больше этого числа, не раскладываются
+# по лентам подписчиков при публикации, а подмешиваются при чтении.
+# После смены порога ленты пересобирает команда rebuild_timelines
+POSTS_TIMELINE_FANOUT_LIMIT = 1000
+
+# Миниатюры картинок готовятся в фоновом пуле потоков; шаблоны до
+# готовности показывают исходную картинку. 0 — ресайз прямо в запросе
+POSTS_THUMBNAIL_WORKERS = 2
+THUMBNAIL_BACKEND = "posts.thumbnails.DeferredThumbnailBackend"
+
+# Загруженные картинки больше этих размеров отклоняются, остальные
+# уменьшаются до POSTS_IMAGE_STORED_SIDE по длинной стороне и
+# пересохраняются без метаданных в POSTS_IMAGE_FORMAT (WEBP или JPEG)
+POSTS_IMAGE_MAX_SIDE = 10000
+POSTS_IMAGE_MAX_PIXELS = 40 * 10 ** 6
+POSTS_IMAGE_STORED_SIDE = 1920
+POSTS_IMAGE_FORMAT = "WEBP"
+POSTS_IMAGE_QUALITY = 82
+# Ширины миниатюр карточек для srcset
+POSTS_IMAGE_WIDTHS = (480, 960, 1440)
+
+# Метрики запросов для Prometheus на /-/metrics/. Выключенный middleware
+# исключается из цепочки и ничего не стоит
+POSTS_METRICS_ENABLED = False
+POSTS_METRICS_SERVER_TIMING = False
+POSTS_METRICS_ALLOWED_IPS = ["127.0.0.1"]
+
+# Поиск N+1 и медленных запросов: повторы одной формы и запросы дольше
+# порога пишутся в лог posts.querywatch. POSTS_QUERYWATCH=log включает
+# поиск, POSTS_QUERYWATCH=raise еще и роняет запрос на повторах —
+# так удобно гонять тесты
+POSTS_QUERYWATCH_ENABLED = os.getenv('POSTS_QUERYWATCH') in ('log', 'raise')
+POSTS_QUERYWATCH_RAISE = os.getenv('POSTS_QUERYWATCH') == 'raise'
+POSTS_QUERYWATCH_SLOW_MS = 100
+POSTS_QUERYWATCH_DUPLICATES = 2
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.AllowAny',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+    ],
+    'PAGE_SIZE': 10,
+}
+
+# Кеш общий для всех воркеров: в нем лежат страницы, их прошлые версии,
+# фрагменты карточек и записи sorl. По умолчанию файловый, для
+# memcached задайте CACHE_BACKEND и CACHE_LOCATION. Переполненный
+# файловый кеш удаляет треть записей, поэтому MAX_ENTRIES с запасом
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'
+)
+FILE_CACHE = CACHE_BACKEND.endswith('FileBasedCache')
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'yatube-cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000)),
+        },
+    },
+    # Версии лент и карточек (posts.cache): вытесненная версия меняет
+    # ETag и ключи фрагментов без изменения содержимого, поэтому они
+    # лежат отдельно и не вытесняются. Для memcached выделите экземпляр
+    # без вытеснения (или Redis с noeviction) в VERSIONS_CACHE_LOCATION
+    'versions': {
+        'BACKEND': os.getenv('VERSIONS_CACHE_BACKEND', CACHE_BACKEND),
+        'LOCATION': os.getenv(
+            'VERSIONS_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'yatube-versions')
+            if FILE_CACHE else os.getenv('CACHE_LOCATION')
+        ),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 10 ** 9},
+    },
 }
+POSTS_VERSION_CACHE_ALIAS = 'versions'
+
+# Страницы лент и постов для анонимных посетителей хранятся целиком
+# и сбрасываются по версиям лент; срок только чистит старые записи.
+# 0 выключает кеш страниц
+POSTS_PAGE_CACHE_ALIAS = 'default'
+POSTS_PAGE_CACHE_TIMEOUT = 600
+
+# Число постов в ленте хранится до смены ее версии, срок только чистит
+# старые записи
+POSTS_FEED_COUNT_TIMEOUT = 600
+
+# Комментариев первого уровня на странице поста; следующие
+# подгружаются кнопкой «Показать еще»
+POSTS_COMMENTS_PER_PAGE = 20
+
+# Ответов под комментарием сразу и за одно нажатие «Показать еще
+# ответы»
+POSTS_COMMENT_REPLIES_PER_PAGE = 5
+
+# Отложенная запись комментариев и оценок (posts.writequeue): клики
+# копятся в памяти воркера и пишутся пачкой одной транзакцией раз в
+# POSTS_WRITE_QUEUE_INTERVAL секунд или по POSTS_WRITE_QUEUE_BATCH
+# записей. Интервал 0 — без фонового потока, только по размеру пачки
+# и при остановке процесса
+POSTS_WRITE_QUEUE = os.getenv('POSTS_WRITE_QUEUE') == '1'
+POSTS_WRITE_QUEUE_INTERVAL = 0.5
+POSTS_WRITE_QUEUE_BATCH = 200
+
+# Сколько последних постов отдают RSS и Atom
+POSTS_FEED_ITEMS = 20
+
+# Пересчет дорогих значений кеша (posts.cache.get_or_compute): сколько
+# секунд держится блокировка пересчета и насколько рано запись
+# обновляется до истечения (1.0 — как в XFetch, больше — раньше)
+POSTS_CACHE_LOCK_TIMEOUT = 10
+POSTS_CACHE_EARLY_REFRESH_BETA = 1.0
+
+# Асинхронные ленты и страницы постов (posts.async_views) для запуска
+# под ASGI (yatube.asgi)
+POSTS_ASYNC_VIEWS = os.getenv('POSTS_ASYNC_VIEWS') == '1'
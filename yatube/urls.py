@@ -36,6 +36,10 @@ urlpatterns = [
     #  раздел администратора
     path("admin/", admin.site.urls),
 
+    #  JSON API для мобильных клиентов; до posts, чтобы /api/ не приняли
+    #  за страницу пользователя
+    path("api/", include("api.urls")),
+
     #  обработчик для главной страницы ищем в urls.py приложения posts
     path("", include("posts.urls", namespace="posts")),
 